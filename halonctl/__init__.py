@@ -1,9 +1,28 @@
-import os
-from pkg_resources import get_distribution, DistributionNotFound
+import sys
 
-__version__ = None
+def installed_version():
+	'''Returns the installed version of halonctl, or None if it's not
+	installed.'''
+	
+	try:
+		from importlib.metadata import version, PackageNotFoundError
+	except ImportError:
+		from pkg_resources import get_distribution, DistributionNotFound as PackageNotFoundError
+		version = lambda name: get_distribution(name).version
+	
+	try:
+		return version('halonctl')
+	except PackageNotFoundError:
+		return None
 
-try:
-	__version__ = get_distribution('halonctl').version
-except DistributionNotFound:
-	pass
+# Looking up the version is slow, and hardly ever needed; where modules can
+# have attributes computed on demand, it's only done on first access
+if sys.version_info >= (3, 7):
+	def __getattr__(name):
+		if name == '__version__':
+			global __version__
+			__version__ = installed_version()
+			return __version__
+		raise AttributeError(u"module {0!r} has no attribute {1!r}".format(__name__, name))
+else:
+	__version__ = installed_version()
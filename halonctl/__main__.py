@@ -5,81 +5,194 @@ import six
 import os, sys
 import re
 import inspect
-import pkgutil
-import importlib
+import itertools
 import argparse
-import json
 import logging
-import arrow
-import requests
 import getpass
 from collections import OrderedDict
-from natsort import natsorted
 from .models import *
 from .util import *
-from .roles import Role
-from . import __version__
 from . import cache
 from . import config as g_config
+from .compression import transfers
+from .breaker import breakers
+from .scheduler import executor
+from .responses import responses
+from .capture import captures, CaptureError
+from .credentials import credentials
+from .agent import Fallback, forward
+from .manifest import load as load_manifest, load_plugin, replay
+from .inventory import SelectorError, is_pattern
+from .snapshot import configurations, compile_config, Configuration, Snapshot, ConfiguredNodes, ConfiguredClusters, ConfigError, ConfigSyntaxError
 
 # Figure out where this script is, and change the PATH appropriately
 BASE = os.path.abspath(os.path.dirname(sys.modules[__name__].__file__))
 sys.path.insert(0, BASE)
 
-# Create an argument parser
-parser = argparse.ArgumentParser(description=u"Easily manage Halon nodes and clusters.")
-subparsers = parser.add_subparsers(title='subcommands', dest='_mod_name', metavar='cmd')
-subparsers.required = True
+# Directories modules and formatters are loaded from
+BASE_PATHS = [BASE, os.path.expanduser('~/halonctl'), os.path.expanduser('~/.halonctl')]
 
-# All available modules and output formatters
+# The argument parser, created by setup()
+parser = None
+subparsers = None
+
+# Available modules and formatters, and the ones loaded so far
+manifest = {}
 modules = {}
 formatters = {}
 
+# Parsers for single modules, with all their arguments; see module_parser()
+module_parsers = {}
+
 # Loaded configuration, configured nodes and clusters
 config = {}
 nodes = {}
 clusters = {}
 
-# Disable unverified HTTPS warnings - we know what we're doing
-requests.packages.urllib3.disable_warnings()
+# Modules that are never run by an agent, as they're interactive or deal
+# with credentials, which the agent holds on to
+LOCAL_MODULES = ['cmd', 'shell', 'keyring']
 
 # Regex that matches quick-connect nodes
 quick_node_re = re.compile(r'^(?:(?P<name>[a-zA-Z0-9_-]+)=)?(?:(?P<protocol>https?)://)?(?P<data>(?P<username>[^@]+)@(?P<host>[a-zA-Z0-9\-\.]+)(?::(?P<port>[0-9]+))?)$')
 
 
 
-def load_modules(modules_path):
-	'''Load all modules from the 'modules' directory.'''
+class VersionAction(argparse.Action):
+	'''Prints version information and exits; unlike argparse's own version
+	action, the version is only looked up if it's actually asked for.'''
 	
-	# Figure out where all the modules are, then treat it as a package,
-	# iterating over its modules and attempting to load each of them. The
-	# 'module' variable in the imported module is the module instance to use -
-	# register that with the application. Yay, dynamic loading abuse.
-	for loader, name, ispkg in pkgutil.iter_modules(path=[modules_path]):
-		mod = loader.find_module(name).load_module(name)
-		if hasattr(mod, 'module'):
-			register_module(name.rstrip('_'), mod.module)
-		else:
-			print(u"Ignoring invalid module (missing 'module' variable): {name}".format(name=name), file=sys.stderr)
+	def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+		super(VersionAction, self).__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+	
+	def __call__(self, parser, namespace, values, option_string=None):
+		print(u"halonctl {version}".format(version=get_version()))
+		parser.exit()
 
-def load_formatters(formatters_path):
-	'''Load all formatters from the 'formatters' directory.'''
+def load_network():
+	'''Imports the HTTP stack, which is only needed once nodes are actually
+	contacted.'''
 	
-	for loader, name, ispkg in pkgutil.iter_modules(path=[formatters_path]):
-		fmt = loader.find_module(name).load_module(name)
-		if hasattr(fmt, 'formatter'):
-			formatters[name.rstrip('_')] = fmt.formatter
-		else:
-			print(u"Ignoring invalid formatter (missing 'formatter' member): {name}".format(name=name), file=sys.stderr)
+	import requests
+	
+	# Disable unverified HTTPS warnings - we know what we're doing
+	requests.packages.urllib3.disable_warnings()
+
+def load_module(name):
+	'''Imports a module from the manifest, if it hasn't been already.'''
+	
+	if not name in modules:
+		entry = manifest['modules'][name]
+		modules[name] = load_plugin(entry['path'], entry['file']).module
+	return modules[name]
+
+def load_formatter(name):
+	'''Imports a formatter from the manifest, if it hasn't been already.'''
+	
+	if not name in formatters:
+		entry = manifest['formatters'][name]
+		fmt = load_plugin(entry['path'], entry['file'])
+		if not hasattr(fmt, 'formatter'):
+			sys.exit(u"Invalid formatter (missing 'formatter' member): {name}".format(name=name))
+		formatters[name] = fmt.formatter
+	return formatters[name]
 
-def register_module(name, mod):
+def register_module(name, mod, subparsers=None):
 	'''Registers a loaded module instance'''
 	
-	p = subparsers.add_parser(name, help=mod.__doc__)
+	p = (subparsers or globals()['subparsers']).add_parser(name, help=mod.__doc__)
 	p.set_defaults(_mod=mod)
 	mod.register_arguments(p)
 	modules[name] = mod
 
+def make_parser():
+	'''Creates an argument parser with halonctl's own arguments, returning
+	it along with the subparsers modules are registered on.'''
+	
+	parser = argparse.ArgumentParser(prog='halonctl', description=u"Easily manage Halon nodes and clusters.")
+	subparsers = parser.add_subparsers(title='subcommands', dest='_mod_name', metavar='cmd')
+	subparsers.required = True
+	
+	parser.add_argument('-V', '--version', action=VersionAction,
+		help=u"print version information and exit")
+	
+	parser.add_argument('-C', '--config', type=argparse.FileType('r'),
+		help="use specified configuration file")
+	
+	parser.add_argument('-n', '--node', dest='nodes', action='append', metavar="NODES",
+		default=[], help=u"target nodes")
+	parser.add_argument('-c', '--cluster', dest='clusters', action='append', metavar="CLUSTERS",
+		default=[], help=u"target clusters")
+	parser.add_argument('-t', '--target', dest='targets', action='append', metavar="SELECTOR",
+		default=[], help=u"target nodes picked by a selector, eg. 'cluster:eu-* & tag:edge'")
+	parser.add_argument('-s', '--slice', dest='slice',
+		default='', help=u"slicing, as a Python slice expression")
+	parser.add_argument('-d', '--dry', dest='dry_run', action='store_true',
+		help=u"only list the nodes that would be affected")
+	
+	parser.add_argument('-i', '--ignore-partial', action='store_true',
+		help=u"exit normally even for partial results")
+	parser.add_argument('-f', '--format', choices=sorted(manifest['formatters'].keys()), default='table',
+		help=u"use the specified output format (default: table)")
+	parser.add_argument('-r', '--raw', action='store_true',
+		help=u"don't humanize the output, output it as raw as possible")
+	parser.add_argument('-g', '--group-by', metavar="KEY",
+		help=u"group output; ignored for table-like formats")
+	parser.add_argument('-k', '--key', dest='group_key', action='store_true',
+		help=u"assume grouper is unique, and key only a single value to it")
+	
+	parser.add_argument('--clear-cache', action='store_true',
+		help=u"clear the WSDL and response caches")
+	parser.add_argument('--no-cache', action='store_true',
+		help=u"don't use cached responses, even if enabled")
+	parser.add_argument('--engine', choices=['threads', 'asyncio'],
+		help=u"transport used for SOAP calls (default: threads)")
+	parser.add_argument('--workers', type=int, metavar="N",
+		help=u"make at most N calls at once (default: 64)")
+	parser.add_argument('--stats', action='store_true',
+		help=u"print connection, transfer and queueing statistics to stderr when done")
+	capture = parser.add_mutually_exclusive_group()
+	capture.add_argument('--record', metavar="FILE",
+		help=u"record all SOAP calls and their replies to a capture file")
+	capture.add_argument('--replay', metavar="FILE",
+		help=u"answer SOAP calls from a capture file, rather than the nodes")
+	parser.add_argument('--no-agent', action='store_true',
+		help=u"don't hand the run over to a running agent")
+	
+	return (parser, subparsers)
+
+def module_parser(name):
+	'''Returns a parser with a single module's real arguments registered,
+	importing the module.'''
+	
+	if not name in module_parsers:
+		p, sp = make_parser()
+		register_module(name, load_module(name), sp)
+		module_parsers[name] = p
+	return module_parsers[name]
+
+def resolve_args(args, argv=None):
+	'''Parses the commandline again with the selected module imported, if
+	it was only parsed against the module's arguments from the manifest.'''
+	
+	if hasattr(args, '_mod'):
+		return args
+	return module_parser(args._mod_name).parse_args(argv)
+
+def get_version():
+	'''Returns the program version, with the git revision if available.'''
+	
+	from . import __version__
+	version = __version__
+	try:
+		head_path = os.path.join(os.path.dirname(__file__), '..', '.git', 'refs', 'heads', 'master')
+		with open(head_path) as f:
+			revision = f.read().strip()[:7]
+			version = "{version} ({revision})".format(version=__version__, revision=revision)
+	except IOError:
+		pass
+	return version
+
 def open_config():
 	'''Opens a configuration file from the first found default location.'''
 	
@@ -112,41 +225,34 @@ def open_config():
 		print(u"", file=sys.stderr)
 		sys.exit(1)
 	
-	return open(config_path, 'rU')
+	return open(config_path, 'r')
 
 def load_config(f):
-	'''Loads configuration data from a given file.'''
+	'''Loads the configuration in a given file, and any fragments of it, as
+	a :class:`halonctl.snapshot.Configuration`.'''
 	
 	try:
-		conf = json.load(f, encoding='utf-8', object_pairs_hook=OrderedDict)
-	except ValueError as e:
+		configuration = configurations.load(f)
+	except ConfigSyntaxError as e:
 		sys.exit(u"Configuration Syntax Error: {0}".format(e))
+	except ConfigError as e:
+		sys.exit(u"Configuration Error: {0}".format(e))
+	finally:
+		f.close()
 	
-	f.close()
-	g_config.config.update(conf)
-	return conf
+	g_config.config.update(configuration.settings)
+	return configuration
 
 def process_config(config):
-	'''Processes a configuration dictionary into usable components.'''
+	'''Processes a configuration dictionary into usable components; the
+	nodes and clusters are created as they're looked up, just like those of
+	a configuration file, see :func:`load_config`.'''
 	
-	nodes = OrderedDict([(name, Node(data, name)) for name, data in six.iteritems(config.get('nodes', {}))])
-	clusters = {}
-	
-	for name, data in six.iteritems(config.get('clusters', {})):
-		cluster = NodeList()
-		cluster.name = name
-		cluster.load_data(data)
-		
-		for nid in data['nodes'] if isinstance(data, dict) else data:
-			if not nid in nodes:
-				sys.exit(u"Configuration Error: Cluster '{cid}' references nonexistent node '{nid}'".format(cid=cluster.name, nid=nid))
-			node = nodes[nid]
-			node.cluster = cluster
-			cluster.append(node)
-		
-		clusters[cluster.name] = cluster
-	
-	return (nodes, clusters)
+	try:
+		configuration = Configuration([Snapshot(six.BytesIO(compile_config(config)))])
+	except ConfigError as e:
+		sys.exit(u"Configuration Error: {0}".format(e))
+	return (ConfiguredNodes(configuration), ConfiguredClusters(configuration))
 
 def apply_slice(list_, slice_):
 	if not slice_ or not list_:
@@ -175,92 +281,124 @@ def apply_filter(available_nodes, available_clusters, nodes, clusters, slice_=''
 	
 	return NodeList(targets.values())
 
-def download_wsdl(nodes, verify):
-	path = cache.get_path(u"wsdl.xml")
-	min_mtime = arrow.utcnow().replace(hours=-12)
-	if not os.path.exists(path) or arrow.get(os.path.getmtime(path)) < min_mtime:
-		has_been_downloaded = False
-		for node in nodes:
-			try:
-				r = requests.get(u"{scheme}://{host}/remote/?wsdl".format(scheme=node.scheme, host=node.host), stream=True, verify=False if node.no_verify else verify)
-				if r.status_code == 200:
-					with open(path, 'wb') as f:
-						for chunk in r.iter_content(256):
-							f.write(chunk)
-					has_been_downloaded = True
-					break
-			except requests.exceptions.SSLError:
-				print_ssl_error(node)
-				sys.exit(1)
-			except:
-				pass
-		
-		if not has_been_downloaded:
-			sys.exit("None of your nodes are available, can't download WSDL")
+def probe_nodes(nodes, timeout):
+	'''Concurrently checks which nodes are accepting connections, recording
+	the results in the health cache, and returns the ones that aren't.
+	
+	Calls to nodes that are down will fail right away, rather than each
+	waiting for a connection to time out.'''
+	
+	latencies = async_dispatch({ node: (tcp_probe, (node, timeout)) for node in nodes })
+	cache.set_health(latencies)
+	
+	down = [node for node in nodes if latencies[node] is None]
+	for node in down:
+		breakers.record(node, False)
+	return down
 
+def download_wsdl(nodes, verify, down_nodes=()):
+	from .wsdl import wsdls
+	if not wsdls.refresh(nodes, verify, down_nodes):
+		sys.exit("None of your nodes are available, can't download WSDL")
 
 
-def main():
-	# Configure logging
-	logging.basicConfig(level=logging.ERROR)
-	logging.getLogger('suds.client').setLevel(logging.CRITICAL)
-	
-	# Load modules and formatters
-	base_paths = [BASE, os.path.expanduser('~/halonctl'), os.path.expanduser('~/.halonctl')]
-	for path in base_paths:
-		load_modules(os.path.join(path, 'modules'))
-		load_formatters(os.path.join(path, 'formatters'))
-	
-	# Figure out the program version
-	version = __version__
-	try:
-		head_path = os.path.join(os.path.dirname(__file__), '..', '.git', 'refs', 'heads', 'master')
-		with open(head_path) as f:
-			revision = f.read().strip()[:7]
-			version = "{version} ({revision})".format(version=__version__, revision=revision)
-	except IOError:
-		pass
+
+def setup():
+	'''Reads the manifest of modules and formatters, and registers
+	commandline arguments.
 	
-	# Add parser arguments
-	parser.add_argument('-V', '--version', action='version', version=u"halonctl {version}".format(version=version),
-		help=u"print version information and exit")
+	This only happens once, even in an agent that runs halonctl over and over.'''
 	
-	parser.add_argument('-C', '--config', type=argparse.FileType('rU'),
-		help="use specified configuration file")
+	global parser, subparsers
+	if parser is not None:
+		return
 	
-	parser.add_argument('-n', '--node', dest='nodes', action='append', metavar="NODES",
-		default=[], help=u"target nodes")
-	parser.add_argument('-c', '--cluster', dest='clusters', action='append', metavar="CLUSTERS",
-		default=[], help=u"target clusters")
-	parser.add_argument('-s', '--slice', dest='slice',
-		default='', help=u"slicing, as a Python slice expression")
-	parser.add_argument('-d', '--dry', dest='dry_run', action='store_true',
-		help=u"only list the nodes that would be affected")
+	# Configure logging
+	logging.basicConfig(level=logging.ERROR)
+	logging.getLogger('suds.client').setLevel(logging.CRITICAL)
 	
-	parser.add_argument('-i', '--ignore-partial', action='store_true',
-		help=u"exit normally even for partial results")
-	parser.add_argument('-f', '--format', choices=list(formatters.keys()), default='table',
-		help=u"use the specified output format (default: table)")
-	parser.add_argument('-r', '--raw', action='store_true',
-		help=u"don't humanize the output, output it as raw as possible")
-	parser.add_argument('-g', '--group-by', metavar="KEY",
-		help=u"group output; ignored for table-like formats")
-	parser.add_argument('-k', '--key', dest='group_key', action='store_true',
-		help=u"assume grouper is unique, and key only a single value to it")
+	# Only modules that had to be imported to build the manifest are loaded
+	m, loaded = load_manifest(BASE_PATHS)
+	manifest.update(m)
+	modules.update(loaded)
 	
-	parser.add_argument('--clear-cache', action='store_true',
-		help=u"clear the WSDL cache")
+	parser, subparsers = make_parser()
+	for name, entry in sorted(six.iteritems(manifest['modules'])):
+		if entry['spec'] is None:
+			register_module(name, load_module(name))
+		else:
+			replay(subparsers.add_parser(name, help=entry['help']), entry['spec'])
+
+def main(argv=None):
+	setup()
+	args = resolve_args(parser.parse_args(argv), argv)
+	args._forwarded = False
+	run(args)
+
+def run_forwarded(argv):
+	'''Runs halonctl with the given arguments, on behalf of a client; see
+	:mod:`halonctl.agent`.
+	
+	Raises :class:`halonctl.agent.Fallback` for modules that must run in the
+	client's own process.'''
+	
+	setup()
+	args = parser.parse_args(argv)
+	if args._mod_name in LOCAL_MODULES:
+		raise Fallback()
+	args = resolve_args(args, argv)
+	
+	# Don't let a previous run's configuration leak into this one
+	g_config.config.clear()
+	args._forwarded = True
+	run(args)
+
+def run(args):
+	'''Runs halonctl with parsed commandline arguments.'''
 	
-	# Parse!
-	args = parser.parse_args()
+	# Parts of the configuration are only read once they're needed, so errors
+	# in them can turn up at any point
+	try:
+		execute(args)
+	except ConfigError as e:
+		sys.exit(u"Configuration Error: {0}".format(e))
+
+def execute(args):
+	'''Does the actual work of :func:`run`.'''
 	
 	# Clear cache if requested
 	if args.clear_cache:
-		os.remove(cache.get_path(u"wsdl.xml"))
+		from .wsdl import clients, wsdls
+		responses.clear()
+		clients.clear()
+		wsdls.clear()
+	responses.bypass = args.no_cache or bool(args.record or args.replay)
+	
+	# Every call made is to be recorded, or answered from a capture
+	captures.stop()
+	try:
+		if args.record:
+			captures.record_to(args.record)
+		elif args.replay:
+			captures.replay_from(args.replay)
+	except (IOError, OSError, CaptureError) as e:
+		sys.exit(u"Can't use capture file: {0}".format(e))
 	
 	# Load configuration
-	config = load_config(args.config or open_config())
-	nodes, clusters = process_config(config)
+	configuration = load_config(args.config or open_config())
+	config = configuration.settings
+	nodes = ConfiguredNodes(configuration)
+	clusters = ConfiguredClusters(configuration)
+	
+	# Pick a transport; the asyncio one needs Python 3.5+
+	if args.engine:
+		g_config.config['engine'] = args.engine
+	if g_config.config.get('engine') == 'asyncio' and sys.version_info < (3, 5):
+		sys.exit(u"The asyncio engine requires Python 3.5 or later")
+	
+	# The thread pool is only created when first used, so this isn't too late
+	if args.workers:
+		g_config.config['max_workers'] = args.workers
 	
 	# Allow wildcard cluster- and node targeting
 	if args.clusters == ['-']:
@@ -269,9 +407,18 @@ def main():
 		args.nodes = list(nodes.keys())
 	
 	# Allow slices without targeting, defaulting to each cluster
-	if args.slice and not args.clusters and not args.nodes:
+	if args.slice and not args.clusters and not args.nodes and not args.targets:
 		args.clusters = list(clusters.keys())
 	
+	# Allow glob patterns and regular expressions for node and cluster names
+	if any(is_pattern(name) for name in args.nodes + args.clusters):
+		try:
+			inventory = configuration.get_inventory()
+			args.nodes = inventory.expand(args.nodes, 'node')
+			args.clusters = inventory.expand(args.clusters, 'cluster')
+		except SelectorError as e:
+			sys.exit(six.text_type(e))
+	
 	# Allow non-configured nodes to be specified as '[name:]username@host'
 	quick_node_matches = [ quick_node_re.match(n) for n in args.nodes ]
 	quick_node_args = []
@@ -284,9 +431,14 @@ def main():
 		quick_node_args.append(arg)
 	
 	if quick_node_args:
+		load_network()
 		l = NodeList([nodes[arg] for arg in quick_node_args])
 		for node, (code, result) in six.iteritems(l.service.login()):
 			if code == 401:
+				# The agent can't prompt on the client's terminal
+				if args._forwarded:
+					raise Fallback()
+				
 				while True:
 					password = getpass.getpass(u"Password for {node.username}@{node.host}: ".format(node=node))
 					if not password:
@@ -319,7 +471,18 @@ def main():
 		sys.exit(1)
 	
 	# Filter nodes to choices
-	target_nodes = apply_filter(nodes, clusters, args.nodes, args.clusters, args.slice)
+	target_nodes = NodeList()
+	if args.nodes or args.clusters or not args.targets:
+		target_nodes = apply_filter(nodes, clusters, args.nodes, args.clusters, args.slice)
+	
+	# Add the nodes picked by selectors, slicing them just like a list of nodes
+	if args.targets:
+		try:
+			selected = apply_slice(configuration.get_inventory().select(*args.targets), args.slice)
+		except SelectorError as e:
+			sys.exit(six.text_type(e))
+		present = set(id(node) for node in target_nodes)
+		target_nodes.extend(node for node in selected if not id(node) in present)
 	
 	# If this is a dry run - stop right here and just print the targets
 	if args.dry_run:
@@ -328,27 +491,70 @@ def main():
 			print(u"  - {name} ({cluster})".format(name=node.name, cluster=node.cluster.name))
 		return
 	
-	# Download WSDL and create client objects
-	download_wsdl(target_nodes, verify=config.get('verify_ssl', True))
-	for node in target_nodes:
-		node.load_wsdl()
+	load_network()
+	
+	# Look up every node's credentials once, rather than on every call
+	credentials.resolve(target_nodes)
+	
+	# If asked to, quickly check which nodes are up, so that downed ones can
+	# be skipped; nodes that are merely far away may not answer in time
+	down_nodes = []
+	probe_timeout = config.get('probe_timeout')
+	if probe_timeout and not captures.replaying:
+		down_nodes = probe_nodes(target_nodes, probe_timeout)
+	
+	# Download the WSDL; clients are created from it as nodes need them
+	if captures.replaying:
+		if not captures.install_wsdls(target_nodes):
+			sys.exit(u"The capture file doesn't contain any calls")
+	else:
+		download_wsdl(target_nodes, config.get('verify_ssl', True), down_nodes)
 	
 	# Run the selected module
 	mod = args._mod
+	mod.exitcode = 0
+	mod.partial = False
+	if down_nodes:
+		mod.partial = True
 	retval = mod.run(target_nodes, args)
 	
+	# Formatters that can print rows as they're produced get to do so
+	formatter = load_formatter(args.format)
+	if inspect.isgenerator(retval) and formatter.streaming:
+		first = next(retval, None)
+		if first is not None:
+			for chunk in formatter.run_iter(itertools.chain([first], retval), args):
+				sys.stdout.write(chunk)
+				sys.stdout.flush()
+			print(u"")
+		retval = None
+	
 	# Normalize generator mods into lists (lets us detect emptiness)
 	if inspect.isgenerator(retval):
 		retval = list(retval)
 	
 	# Print something, if there's anything to print
 	if retval:
+		from . import roles
 		if hasattr(retval, 'draw'):
 			print(retval.draw())
-		elif isinstance(retval, Role):
+		elif isinstance(retval, roles.Role):
 			print(retval.raw() if args.raw else retval.human())
 		else:
-			print(formatters[args.format].run(retval, args))
+			print(formatter.run(retval, args))
+	
+	# Print connection statistics, if requested
+	if args.stats:
+		from .pool import pool
+		from .tls import sessions as tls_sessions
+		pool.print_stats()
+		transfers.print_stats()
+		breakers.print_stats()
+		executor.print_stats()
+		responses.print_stats()
+		tls_sessions.print_stats()
+		captures.print_stats()
+	captures.stop()
 	
 	# Let the module decide the exit code - either by explicitly setting it, or
 	# by marking the result as partial, in which case a standard exit code is
@@ -359,4 +565,7 @@ def main():
 		sys.exit(99)
 
 if __name__ == '__main__':
+	code = forward(sys.argv[1:])
+	if code is not None:
+		sys.exit(code)
 	main()
@@ -0,0 +1,369 @@
+'''A local agent, which keeps halonctl warm between runs.
+
+Every run of ``halonctl`` normally starts from scratch; it imports
+everything, parses the configuration, builds a SOAP client for every node
+and opens new connections to them. For scripts that run it every minute,
+that's most of the time spent.
+
+Instead, ``halonctl-agent`` can be left running in the background. It
+listens on a unix socket, and the ``halonctl`` command hands its runs over
+to it, along with its standard input, output and error, and working
+directory. The agent keeps SOAP clients, kept-alive connections and
+resolved credentials around from one run to the next.
+
+Runs are handled one at a time, and interactive modules (``cmd``, ``shell``)
+and ``keyring`` always run in the client's own process, as do runs that
+need a password typed in. Pass ``--no-agent`` to run something locally
+anyway.
+
+The socket is kept in ``$XDG_RUNTIME_DIR``, or if that's not set, in the
+cache directory (see :mod:`halonctl.cache`), and its location can be changed
+with the ``HALONCTL_AGENT_SOCKET`` environment variable. It's only
+accessible to the user that started the agent, and neither end talks to the
+other unless it's run by the same user.
+
+The agent also keeps passwords from the keyring for runs it doesn't make
+itself, if ``keyring_cache`` is set; see :mod:`halonctl.credentials`.
+
+This requires Python 3.3 or later, on a platform with unix sockets.
+'''
+
+from __future__ import print_function
+import six
+import os
+import sys
+import json
+import array
+import socket
+import struct
+import argparse
+import traceback
+from . import cache
+
+#: How long to wait for an agent to answer a keyring request, in seconds
+KEYRING_TIMEOUT = 1.0
+
+class Fallback(Exception):
+	'''Raised by the agent's runner when a run should be made locally.'''
+	pass
+
+def is_supported():
+	return hasattr(socket, 'AF_UNIX') and hasattr(socket.socket, 'sendmsg')
+
+def socket_path():
+	'''Returns the path of the agent's socket.'''
+	
+	path = os.environ.get('HALONCTL_AGENT_SOCKET')
+	if path:
+		return path
+	
+	runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+	if runtime_dir and cache.is_private(runtime_dir):
+		return os.path.join(runtime_dir, u"halonctl-agent.sock")
+	path = cache.private_dir(create=True)
+	return os.path.join(path, u"agent.sock") if path else None
+
+def peer_uid(conn, path):
+	'''Returns the user id of whoever is on the other end of a connection;
+	if the platform can't tell, that of the socket file.'''
+	
+	if hasattr(socket, 'SO_PEERCRED'):
+		fmt = '3i'
+		pid, uid, gid = struct.unpack(fmt, conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize(fmt)))
+		return uid
+	return os.stat(path).st_uid
+
+def read_message(conn, fds=0):
+	'''Reads a newline-terminated JSON message from a socket, along with up
+	to ``fds`` file descriptors sent with it. Returns ``(message, fds)``, or
+	``(None, [])`` if the connection was closed.'''
+	
+	data = b''
+	received = []
+	while not data.endswith(b'\n'):
+		if fds and not received:
+			fd_size = array.array('i').itemsize
+			chunk, ancdata, flags, addr = conn.recvmsg(65536, socket.CMSG_LEN(fds * fd_size))
+			for level, type_, payload in ancdata:
+				if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+					a = array.array('i')
+					a.frombytes(payload[:len(payload) - (len(payload) % fd_size)])
+					received.extend(a)
+		else:
+			chunk = conn.recv(65536)
+		if not chunk:
+			for fd in received:
+				os.close(fd)
+			return (None, [])
+		data += chunk
+	return (json.loads(data.decode('utf-8')), received)
+
+def send_message(conn, message, fds=[]):
+	'''Sends a JSON message over a socket, along with file descriptors.'''
+	
+	data = json.dumps(message).encode('utf-8') + b'\n'
+	if fds:
+		sent = conn.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+		data = data[sent:]
+	if data:
+		conn.sendall(data)
+
+def connect(path=None):
+	'''Connects to a running agent, returning the socket, or None.'''
+	
+	if not is_supported():
+		return None
+	
+	path = path or socket_path()
+	if not path or not os.path.exists(path):
+		return None
+	
+	conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		conn.connect(path)
+		if peer_uid(conn, path) != os.getuid():
+			print(u"Not using the agent on {0}, since it's run by another user".format(path), file=sys.stderr)
+			conn.close()
+			return None
+	except (socket.error, OSError):
+		conn.close()
+		return None
+	return conn
+
+def forward(argv):
+	'''Hands a run over to a running agent, if there is one.
+	
+	Returns the run's exit code, or None if it should be made locally.'''
+	
+	if '--no-agent' in argv:
+		return None
+	
+	conn = connect()
+	if conn is None:
+		return None
+	
+	try:
+		send_message(conn, { 'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ) }, [0, 1, 2])
+		reply, _ = read_message(conn)
+	except (socket.error, ValueError):
+		reply = None
+	finally:
+		conn.close()
+	
+	if reply is None:
+		# The run may well have had side effects, so don't retry it locally
+		print(u"The agent went away in the middle of the run", file=sys.stderr)
+		return 1
+	elif reply.get('fallback'):
+		return None
+	return reply['exitcode']
+
+def keyring_request(message):
+	'''Sends a request to a running agent's keyring cache, returning its
+	reply, or None if there's no agent, or it didn't answer in time; it may be
+	busy making a run.'''
+	
+	conn = connect()
+	if conn is None:
+		return None
+	
+	try:
+		conn.settimeout(KEYRING_TIMEOUT)
+		send_message(conn, message)
+		reply, _ = read_message(conn)
+	except (socket.error, ValueError):
+		reply = None
+	finally:
+		conn.close()
+	return reply
+
+def cli():
+	'''Entry point for the ``halonctl`` command; hands the run over to a
+	running agent, or makes it locally if there isn't one.'''
+	
+	code = forward(sys.argv[1:])
+	if code is not None:
+		sys.exit(code)
+	
+	from .__main__ import main
+	main()
+
+class Agent(object):
+	'''Serves runs for clients on a unix socket, one at a time.
+	
+	:param callable runner: Called with a list of arguments for every run
+	:param credentials: The :class:`halonctl.credentials.CredentialStore`
+	                    whose keyring entries are shared with clients
+	'''
+	
+	def __init__(self, path, runner, credentials=None):
+		self.path = path
+		self.runner = runner
+		self.credentials = credentials
+		self.running = False
+	
+	def serve_forever(self):
+		if os.path.exists(self.path):
+			if connect(self.path) is not None:
+				sys.exit(u"An agent is already running on {0}".format(self.path))
+			os.remove(self.path)
+		
+		listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		old_umask = os.umask(0o077)
+		try:
+			listener.bind(self.path)
+		finally:
+			os.umask(old_umask)
+		listener.listen(16)
+		
+		self.running = True
+		try:
+			while self.running:
+				conn, _ = listener.accept()
+				try:
+					if peer_uid(conn, self.path) == os.getuid():
+						self.handle(conn)
+				except (socket.error, ValueError):
+					pass
+				finally:
+					conn.close()
+		finally:
+			listener.close()
+			os.remove(self.path)
+	
+	def handle(self, conn):
+		request, fds = read_message(conn, 3)
+		if request is None:
+			return
+		
+		try:
+			if request.get('stop'):
+				self.running = False
+				reply = { 'exitcode': 0 }
+			elif request.get('keyring'):
+				reply = self.keyring(request)
+			elif len(fds) != 3:
+				reply = { 'fallback': True }
+			else:
+				reply = self.execute(request, fds)
+		finally:
+			for fd in fds:
+				os.close(fd)
+		send_message(conn, reply)
+	
+	def keyring(self, request):
+		'''Answers a request to the keyring cache: ``get`` returns the
+		unexpired entries among a list of ``[host, username]`` keys, ``put``
+		adds entries, and ``flush`` drops the given keys, or all of them.'''
+		
+		from .credentials import entries_list, entries_dict
+		if self.credentials is None:
+			return { 'entries': [] }
+		
+		action = request['keyring']
+		if action == 'get':
+			return { 'entries': entries_list(self.credentials.entries([tuple(key) for key in request['keys']])) }
+		elif action == 'put':
+			# Entries without an expiry would be kept forever
+			entries = entries_dict(request['entries'])
+			self.credentials.update({ key: entry for key, entry in six.iteritems(entries) if entry[1] is not None })
+		elif action == 'flush':
+			keys = request.get('keys')
+			self.credentials.forget([tuple(key) for key in keys] if keys is not None else None)
+		return {}
+	
+	def execute(self, request, fds):
+		'''Makes a run with the client's standard streams, working directory
+		and environment swapped in for the agent's own.'''
+		
+		saved_fds = [os.dup(fd) for fd in (0, 1, 2)]
+		saved_cwd = os.getcwd()
+		saved_env = dict(os.environ)
+		
+		flush()
+		for i, fd in enumerate(fds):
+			os.dup2(fd, i)
+		reply = { 'exitcode': 0 }
+		try:
+			os.chdir(request['cwd'])
+			os.environ.clear()
+			os.environ.update(request['env'])
+			
+			self.runner(request['argv'])
+		except Fallback:
+			reply = { 'fallback': True }
+		except SystemExit as e:
+			if isinstance(e.code, six.string_types):
+				print(e.code, file=sys.stderr)
+				reply['exitcode'] = 1
+			else:
+				reply['exitcode'] = e.code or 0
+		except Exception:
+			traceback.print_exc()
+			reply['exitcode'] = 1
+		finally:
+			flush()
+			
+			for i, fd in enumerate(saved_fds):
+				os.dup2(fd, i)
+				os.close(fd)
+			os.chdir(saved_cwd)
+			os.environ.clear()
+			os.environ.update(saved_env)
+			
+			# Runs without keyring_cache look up entries that never expire
+			if self.credentials is not None:
+				self.credentials.forget_unexpiring()
+		return reply
+
+def flush():
+	for f in (sys.stdout, sys.stderr):
+		try:
+			f.flush()
+		except (IOError, OSError):
+			pass
+
+def stop(path=None):
+	'''Asks a running agent to exit; returns False if there's none.'''
+	
+	conn = connect(path)
+	if conn is None:
+		return False
+	try:
+		send_message(conn, { 'stop': True })
+		read_message(conn)
+	finally:
+		conn.close()
+	return True
+
+def main():
+	'''Entry point for the ``halonctl-agent`` command.'''
+	
+	parser = argparse.ArgumentParser(description=u"Keeps halonctl warm between runs.")
+	parser.add_argument('--socket', default=None,
+		help=u"listen on the specified socket")
+	parser.add_argument('--stop', action='store_true',
+		help=u"stop a running agent")
+	args = parser.parse_args()
+	
+	if not is_supported():
+		sys.exit(u"The agent requires Python 3.3 or later, and unix sockets")
+	path = args.socket or socket_path()
+	if not path:
+		sys.exit(u"There's nowhere private to put the agent's socket; use --socket")
+	
+	if args.stop:
+		if not stop(path):
+			sys.exit(u"No agent is running on {0}".format(path))
+		return
+	
+	from .__main__ import setup, run_forwarded
+	from .credentials import credentials
+	setup()
+	
+	# Runs made by the agent share its keyring entries directly
+	credentials.remote = False
+	Agent(path, run_forwarded, credentials).serve_forever()
+
+if __name__ == '__main__':
+	main()
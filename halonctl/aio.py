@@ -0,0 +1,370 @@
+'''Asyncio-based SOAP transport.
+
+This is an alternative to dispatching blocking requests into a thread pool:
+a single background thread runs an event loop, and every node's request is
+kept in flight at once, no matter how many nodes are targeted.
+
+It's selected with ``"engine": "asyncio"`` in the configuration file, or the
+``--engine asyncio`` flag, and requires Python 3.5 or later; it's only ever
+imported if it's actually selected.
+'''
+
+from __future__ import print_function
+import six
+import sys
+import ssl
+import time
+import zlib
+import asyncio
+from base64 import b64encode
+from threading import Thread, Lock
+from six.moves.urllib.parse import urlsplit
+from .util import print_ssl_error, iter_futures, DEFAULT_TIMEOUT, DEFAULT_IDLE_TIMEOUT
+from .config import config
+from .scheduler import executor, limits
+from .breaker import breakers, CLOSED
+from .responses import responses, READ_ONLY
+from .tls import sessions as tls_sessions
+from .capture import captures
+from .compression import ACCEPT_ENCODING, should_compress, compress, decompress, method_name, transfers
+
+class NoReply(EOFError):
+	'''Raised when a connection is closed, or reset, before any of the reply
+	has been read.'''
+	pass
+
+class SlowReply(Exception):
+	'''Raised when a node accepted a request, but didn't answer it in time.'''
+	pass
+
+class AsyncEngine(object):
+	'''Runs SOAP requests on an event loop in a dedicated thread.
+	
+	All of :func:`call`, :func:`dispatch` and :func:`chain` are blocking and
+	thread-safe, and return the same ``(status, response)`` tuples as the
+	threaded transport; :func:`iter_dispatch` returns them as they arrive.
+	Connections are kept alive and reused between calls.
+	'''
+	
+	def __init__(self):
+		self.loop = None
+		self.thread = None
+		self.lock = Lock()
+		self.idle = {}
+		self.ssl_contexts = {}
+		self.semaphores = {}
+	
+	def start(self):
+		'''Starts the event loop thread, if it's not already running.'''
+		
+		with self.lock:
+			if self.loop is None:
+				self.loop = asyncio.new_event_loop()
+				self.thread = Thread(target=self.loop.run_forever)
+				self.thread.daemon = True
+				self.thread.start()
+	
+	def call(self, node, context):
+		'''Sends a single prepared request context to a node.'''
+		
+		return self.dispatch({ node: context })[node]
+	
+	def dispatch(self, contexts):
+		'''Sends prepared request contexts to a number of nodes at once.
+		
+		Takes a dictionary of ``{ node: context }``, and returns one of
+		``{ node: (status, response) }``, taking as long as the slowest node.
+		'''
+		
+		self.start()
+		future = asyncio.run_coroutine_threadsafe(self.gather(contexts), self.loop)
+		replies = future.result()
+		
+		return { node: self.process_reply(node, contexts[node], reply) for node, reply in six.iteritems(replies) }
+	
+	def iter_dispatch(self, contexts, order=None):
+		'''Sends prepared request contexts to a number of nodes at once, like
+		:func:`dispatch`, but returns an iterator over ``(node, (status,
+		response))`` tuples, yielding each as soon as it's available; see
+		:func:`halonctl.util.iter_dispatch`.
+		'''
+		
+		self.start()
+		futures = {
+			asyncio.run_coroutine_threadsafe(self.post(node, context), self.loop): node
+			for node, context in six.iteritems(contexts)
+		}
+		return ((node, self.process_reply(node, contexts[node], reply)) for node, reply in iter_futures(futures, order))
+	
+	def chain(self, chains):
+		'''Sends chains of prepared request contexts to a number of nodes at
+		once; each node's requests are sent one after another.
+		
+		Takes a dictionary of ``{ node: [context, ...] }``, and returns one of
+		``{ node: [(status, response), ...] }``. If a node can't be reached,
+		the rest of its chain is skipped, with results of ``(0, None)``.
+		'''
+		
+		self.start()
+		future = asyncio.run_coroutine_threadsafe(self.gather_chains(chains), self.loop)
+		replies = future.result()
+		
+		results = {}
+		for node, chain_replies in six.iteritems(replies):
+			results[node] = [self.process_reply(node, context, reply) for context, reply in zip(chains[node], chain_replies)]
+		return results
+	
+	def process_reply(self, node, context, reply):
+		if isinstance(reply, ssl.SSLError):
+			print_ssl_error(node)
+			sys.exit(1)
+		elif reply is None:
+			return (0, None)
+		return context.process_reply(*reply)
+	
+	async def gather(self, contexts):
+		nodes = list(contexts)
+		replies = await asyncio.gather(*[self.post(node, contexts[node]) for node in nodes])
+		return dict(zip(nodes, replies))
+	
+	async def gather_chains(self, chains):
+		nodes = list(chains)
+		replies = await asyncio.gather(*[self.post_chain(node, chains[node]) for node in nodes])
+		return dict(zip(nodes, replies))
+	
+	async def post_chain(self, node, contexts):
+		replies = []
+		for context in contexts:
+			if replies and not isinstance(replies[-1], tuple):
+				replies.append(None)
+			else:
+				replies.append(await self.post(node, context))
+		return replies
+	
+	async def post(self, node, context):
+		'''Sends a request, returning ``(body, status, reason)``, None if the
+		node couldn't be reached, or an SSLError if verification failed.
+		
+		Waits for a free slot first, if the node or its cluster has a
+		concurrency limit; see :mod:`halonctl.scheduler`. Cached replies are
+		returned right away, see :mod:`halonctl.responses`.'''
+		
+		# Nodes without a WSDL can't be called, just like unreachable ones
+		if context is None:
+			return None
+		
+		method = method_name(context)
+		cached = responses.get(node, method, context.envelope)
+		if cached:
+			return cached
+		
+		# Whether or not the call goes through, the node may have acted on it
+		responses.invalidate(node, method)
+		
+		queued = time.time()
+		semaphores = [self.semaphore(key, limit) for key, limit in sorted(limits(node))]
+		for semaphore in semaphores:
+			await semaphore.acquire()
+		try:
+			executor.record_wait(node, time.time() - queued)
+			reply = await self.send(node, context)
+		finally:
+			for semaphore in semaphores:
+				semaphore.release()
+		
+		if isinstance(reply, tuple):
+			responses.set(node, method, context.envelope, *reply)
+		return reply
+	
+	def semaphore(self, key, limit):
+		if not key in self.semaphores:
+			self.semaphores[key] = asyncio.Semaphore(limit)
+		return self.semaphores[key]
+	
+	async def send(self, node, context):
+		# Probing a node whose breaker is open blocks, so do it in a thread
+		if not captures.replaying and breakers.enabled and breakers.get(node).state != CLOSED:
+			if not await self.loop.run_in_executor(None, breakers.allow, node):
+				return None
+		
+		url = urlsplit(context.client.location())
+		headers = dict(context.client.headers())
+		if node.username:
+			credentials = u"{0}:{1}".format(node.username, node.password or u"").encode('utf-8')
+			headers['Authorization'] = 'Basic ' + b64encode(credentials).decode('ascii')
+		
+		body = context.envelope
+		if isinstance(body, six.text_type):
+			body = body.encode('utf-8')
+		
+		raw_size = len(body)
+		headers['Accept-Encoding'] = ACCEPT_ENCODING
+		if should_compress(body):
+			body = compress(body)
+			headers['Content-Encoding'] = 'gzip'
+		transfers.sent(node, method_name(context), len(body), raw_size)
+		
+		try:
+			content, status, reason, encoding = await self.fetch(node, context, url, headers, body)
+			breakers.record(node, True)
+			raw_content = decompress(content, encoding)
+			transfers.received(node, method_name(context), len(content), len(raw_content))
+			return (raw_content, status, reason)
+		except ssl.SSLError as e:
+			return e
+		except SlowReply:
+			# The node is up, it's just slow to answer this call
+			breakers.record(node, True)
+			return None
+		except (OSError, EOFError, ValueError, zlib.error, asyncio.TimeoutError, asyncio.IncompleteReadError):
+			breakers.record(node, False)
+			return None
+	
+	async def fetch(self, node, context, url, headers, body):
+		'''Sends a request and returns the raw reply, as ``(content, status,
+		reason, encoding)``; calls are recorded to, or answered from, a
+		capture file if one is in use, see :mod:`halonctl.capture`.'''
+		
+		method = method_name(context)
+		if captures.replaying:
+			exchange = captures.lookup(node, method, context.envelope)
+			await asyncio.sleep(captures.delay(exchange))
+			reply = captures.reply(exchange)
+			if reply is None:
+				raise OSError(u"Not reachable in the capture")
+			return reply
+		
+		started = time.time()
+		try:
+			reply = await self.request(node, method, url, headers, body, started + config.get('timeout', DEFAULT_TIMEOUT))
+		except (OSError, EOFError, ValueError, SlowReply, asyncio.TimeoutError, asyncio.IncompleteReadError):
+			captures.record(node, method, context.envelope, None, started)
+			raise
+		captures.record(node, method, context.envelope, reply, started)
+		return reply
+	
+	async def request(self, node, method, url, headers, body, deadline):
+		'''Sends a request, and returns the raw reply. Raises
+		:class:`asyncio.TimeoutError` if a connection couldn't be made by the
+		deadline, and :class:`SlowReply` if the reply didn't arrive by then.'''
+		
+		secure = (url.scheme == 'https')
+		key = (url.hostname, url.port or (443 if secure else 80), secure, node.no_verify)
+		
+		# A kept-alive connection may have been closed by the node just as
+		# it's reused; the request may or may not have reached it by then, so
+		# only calls that don't change anything are retried on a fresh one
+		conn = self.checkout(key)
+		if conn is not None:
+			reader, writer = conn
+			try:
+				return await self.exchange_by(deadline, key, reader, writer, url, headers, body)
+			except NoReply:
+				writer.close()
+				if not method in READ_ONLY:
+					raise
+			except BaseException:
+				writer.close()
+				raise
+		
+		reader, writer = await asyncio.wait_for(asyncio.open_connection(key[0], key[1],
+			ssl=self.ssl_context(node) if secure else None), max(0, deadline - time.time()))
+		try:
+			return await self.exchange_by(deadline, key, reader, writer, url, headers, body)
+		except BaseException:
+			writer.close()
+			raise
+	
+	async def exchange_by(self, deadline, *args):
+		try:
+			return await asyncio.wait_for(self.exchange(*args), max(0, deadline - time.time()))
+		except asyncio.TimeoutError:
+			raise SlowReply(u"No reply in time")
+	
+	def checkout(self, key):
+		'''Returns a kept-alive connection, as ``(reader, writer)``, or None.
+		
+		Connections the node is known to have closed, or that have been idle
+		for longer than ``pool_idle_timeout``, are closed rather than reused.'''
+		
+		idle_timeout = config.get('pool_idle_timeout', DEFAULT_IDLE_TIMEOUT)
+		idle = self.idle.setdefault(key, [])
+		now = time.time()
+		while idle:
+			reader, writer, last_used = idle.pop()
+			if reader.at_eof() or writer.is_closing() or (idle_timeout and now - last_used > idle_timeout):
+				writer.close()
+				continue
+			return (reader, writer)
+		return None
+	
+	async def exchange(self, key, reader, writer, url, headers, body):
+		lines = [u"POST {0} HTTP/1.1".format(url.path or u"/"), u"Host: {0}".format(url.netloc)]
+		lines += [u"{0}: {1}".format(k, v.decode('latin-1') if isinstance(v, six.binary_type) else v) for k, v in six.iteritems(headers)]
+		lines += [u"Content-Length: {0}".format(len(body)), u"Connection: keep-alive", u"", u""]
+		try:
+			writer.write(u"\r\n".join(lines).encode('latin-1') + body)
+			await writer.drain()
+			status_line = await reader.readline()
+		except (OSError, EOFError) as e:
+			if isinstance(e, ssl.SSLError):
+				raise
+			raise NoReply(u"Connection lost: {0}".format(e))
+		if not status_line:
+			raise NoReply(u"Connection closed by node")
+		parts = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+		if len(parts) < 2 or not parts[1].isdigit():
+			raise ValueError(u"Malformed status line: {0!r}".format(status_line))
+		status = int(parts[1])
+		reason = parts[2] if len(parts) > 2 else u""
+		
+		response_headers = {}
+		while True:
+			line = await reader.readline()
+			if line in (b'\r\n', b'\n', b''):
+				break
+			k, v = line.decode('latin-1').split(':', 1)
+			response_headers[k.strip().lower()] = v.strip()
+		
+		keep_alive = response_headers.get('connection', '').lower() != 'close'
+		if 'chunked' in response_headers.get('transfer-encoding', '').lower():
+			content = await self.read_chunked(reader)
+		elif 'content-length' in response_headers:
+			content = await reader.readexactly(int(response_headers['content-length']))
+		else:
+			content = await reader.read()
+			keep_alive = False
+		
+		if keep_alive:
+			self.idle[key].append((reader, writer, time.time()))
+		else:
+			writer.close()
+		
+		return (content, status, reason, response_headers.get('content-encoding'))
+	
+	async def read_chunked(self, reader):
+		chunks = []
+		while True:
+			size = int((await reader.readline()).split(b';', 1)[0].strip(), 16)
+			if size == 0:
+				# Skip any trailers, up until the terminating blank line
+				while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+					pass
+				return b''.join(chunks)
+			chunks.append(await reader.readexactly(size))
+			await reader.readline()
+	
+	def ssl_context(self, node):
+		verify = False if node.no_verify else config.get('verify_ssl', True)
+		key = verify if isinstance(verify, six.string_types) else bool(verify)
+		if not key in self.ssl_contexts:
+			ctx = tls_sessions.context(key)
+			if ctx is None:
+				ctx = ssl.create_default_context(cafile=key if isinstance(key, six.string_types) else None)
+				if key is False:
+					ctx.check_hostname = False
+					ctx.verify_mode = ssl.CERT_NONE
+			self.ssl_contexts[key] = ctx
+		return self.ssl_contexts[key]
+
+engine = AsyncEngine()
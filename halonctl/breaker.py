@@ -0,0 +1,131 @@
+'''Per-node circuit breakers.
+
+Once a call to a node fails because it couldn't be reached, the node's
+breaker "opens", and further calls to it fail immediately, rather than each
+waiting for the full timeout. After ``breaker_retry_interval`` seconds, the
+next call first makes a quick TCP connection attempt to the node (waiting at
+most ``breaker_probe_timeout`` seconds); if that succeeds, the call is let
+through, and closes the breaker again if it succeeds. If the call never
+reports back, eg. because it raised something unexpected, the breaker opens
+up for another attempt once both ``breaker_retry_interval`` and the call's
+``timeout`` have passed.
+
+Only calls that couldn't connect to the node count as failures; a call that
+times out waiting for a slow reply still reached it.
+
+Breakers can be disabled altogether with ``"circuit_breaker": false``.
+'''
+
+from __future__ import print_function
+import six
+import sys
+import time
+from threading import Lock
+from .util import tcp_probe, DEFAULT_TIMEOUT
+from .config import config
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+DEFAULT_RETRY_INTERVAL = 30
+DEFAULT_PROBE_TIMEOUT = 1.0
+
+class CircuitBreaker(object):
+	'''A circuit breaker for a single node.
+	
+	:ivar str state: One of ``closed`` (calls go through), ``open`` (calls fail
+	                 immediately) or ``half-open`` (a trial call is in flight)
+	:ivar int failed_fast: The number of calls that were failed immediately
+	'''
+	
+	def __init__(self, node):
+		self.node = node
+		self.state = CLOSED
+		self.opened_at = None
+		self.trial_started = None
+		self.failed_fast = 0
+		self.lock = Lock()
+	
+	def allow(self):
+		'''Returns whether a call to the node should be attempted.'''
+		
+		with self.lock:
+			if self.state == CLOSED:
+				return True
+			
+			now = time.time()
+			retry_interval = config.get('breaker_retry_interval', DEFAULT_RETRY_INTERVAL)
+			if self.state == HALF_OPEN:
+				trial_timeout = max(retry_interval, config.get('timeout', DEFAULT_TIMEOUT))
+				waiting = now - self.trial_started < trial_timeout
+			else:
+				waiting = now - self.opened_at < retry_interval
+			if waiting:
+				self.failed_fast += 1
+				return False
+			
+			# Only one caller gets to probe; the rest keep failing fast
+			self.state = HALF_OPEN
+			self.trial_started = now
+		
+		if tcp_probe(self.node, config.get('breaker_probe_timeout', DEFAULT_PROBE_TIMEOUT)) is None:
+			self.failure()
+			with self.lock:
+				self.failed_fast += 1
+			return False
+		return True
+	
+	def success(self):
+		'''Records a call that reached the node.'''
+		with self.lock:
+			self.state = CLOSED
+			self.opened_at = None
+	
+	def failure(self):
+		'''Records a call that failed to reach the node.'''
+		with self.lock:
+			self.state = OPEN
+			self.opened_at = time.time()
+
+class BreakerRegistry(object):
+	'''Hands out one :class:`CircuitBreaker` per node, keyed by scheme and
+	host, just like connection pools.'''
+	
+	def __init__(self):
+		self.breakers = {}
+		self.lock = Lock()
+	
+	@property
+	def enabled(self):
+		return config.get('circuit_breaker', True)
+	
+	def get(self, node):
+		key = (node.scheme, node.host)
+		with self.lock:
+			if not key in self.breakers:
+				self.breakers[key] = CircuitBreaker(node)
+			return self.breakers[key]
+	
+	def allow(self, node):
+		'''Returns whether a call to the node should be attempted.'''
+		return not self.enabled or self.get(node).allow()
+	
+	def record(self, node, reached):
+		'''Records whether a call reached the node or not.'''
+		
+		if not self.enabled:
+			return
+		if reached:
+			self.get(node).success()
+		else:
+			self.get(node).failure()
+	
+	def print_stats(self, file=sys.stderr):
+		'''Prints the nodes whose breakers have been tripped.'''
+		
+		for (scheme, host), breaker in sorted(six.iteritems(self.breakers)):
+			if breaker.state != CLOSED or breaker.failed_fast:
+				print(u"{scheme}://{host}: circuit {b.state}, {b.failed_fast} calls failed fast".format(scheme=scheme, host=host, b=breaker), file=file)
+
+breakers = BreakerRegistry()
@@ -1,21 +1,191 @@
+'''Files kept between runs.
+
+Everything is kept in the current user's cache directory,
+``$XDG_CACHE_HOME/halonctl``, or ``~/.cache/halonctl`` if that's not set.
+Some of what's cached is later trusted, eg. replies to SOAP calls or the
+paths to modules, so the directory and the private directories in it are
+only ever used if they're owned by the current user, and only accessible to
+them; otherwise, nothing is read from or written to them.
+'''
+
 from __future__ import print_function
 import six
 import os
+import sys
+import stat
+import json
+import time
 import tempfile
+from threading import Lock
 
-def get_filename(name):
-	return u"halonctl_{name}".format(name=name)
+#: Directories that have been found to be private, and those that aren't
+checked = {}
+checked_lock = Lock()
+
+def get_base():
+	'''Returns the path to the current user's cache directory.'''
+	
+	base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser(u"~"), u".cache")
+	return os.path.abspath(os.path.join(base, u"halonctl"))
 
 def get_path(name):
-	return os.path.abspath(os.path.join(tempfile.gettempdir(), get_filename(name)))
+	return os.path.join(get_base(), name)
+
+def is_private(path):
+	'''Returns whether a directory is owned by the current user, and only
+	accessible to them; a directory they own, but that's accessible to
+	others, is made private.'''
+	
+	try:
+		st = os.lstat(path)
+		if not stat.S_ISDIR(st.st_mode):
+			return False
+		if not hasattr(os, 'getuid'):
+			return True
+		if st.st_uid != os.getuid():
+			return False
+		if st.st_mode & 0o077:
+			os.chmod(path, 0o700)
+		return True
+	except OSError:
+		return False
+
+def private_dir(dirname=None, create=False):
+	'''Returns the path to a private directory in the cache, or the cache
+	itself, or None if it doesn't exist, or isn't private.'''
+	
+	paths = [get_base()]
+	if dirname:
+		paths.append(os.path.join(paths[0], dirname))
+	
+	for path in paths:
+		if checked.get(path):
+			continue
+		if create and not os.path.lexists(path):
+			try:
+				os.makedirs(path, 0o700)
+			except OSError:
+				pass
+		elif not create and not os.path.lexists(path):
+			return None
+		
+		private = is_private(path)
+		with checked_lock:
+			warn = checked.get(path) is None and not private
+			checked[path] = private
+		if warn:
+			print(u"Not using {0}, since it's not a directory only you have access to".format(path), file=sys.stderr)
+		if not private:
+			return None
+	return paths[-1]
 
 def get(name):
-	path = get_path(name)
-	if os.path.exists(path):
-		with open(get_path(name), 'rU') as f:
+	path = private_dir()
+	if path is None:
+		return None
+	try:
+		with open(os.path.join(path, name), 'r') as f:
 			return f.read()
+	except (IOError, OSError):
+		return None
 
 def set(name, data):
-	path = get_path(name)
-	with open(get_path(name), 'wU') as f:
-		f.write(data)
+	path = private_dir(create=True)
+	if path is None:
+		return
+	try:
+		fd, tmp_path = tempfile.mkstemp(dir=path)
+		with os.fdopen(fd, 'w') as f:
+			f.write(data)
+		os.rename(tmp_path, os.path.join(path, name))
+	except (IOError, OSError):
+		# Check the directories over again next time, in case they're gone
+		checked.clear()
+
+def node_key(node):
+	return u"{scheme}://{host}".format(scheme=node.scheme, host=node.host)
+
+def get_health():
+	'''Returns the last known health of all probed nodes, as a dictionary of
+	``{ "scheme://host": { "up": bool, "latency": float, "checked": float } }``.'''
+	
+	try:
+		return json.loads(get(u"health.json") or u"{}")
+	except ValueError:
+		return {}
+
+def get_node_health(node, health=None):
+	'''Returns the last known health of a single node, or None.'''
+	return (health if health is not None else get_health()).get(node_key(node))
+
+def set_health(latencies):
+	'''Records probe results, as a dictionary of ``{ node: latency }``, where
+	a latency of None means the node couldn't be reached.'''
+	
+	health = get_health()
+	now = time.time()
+	for node, latency in six.iteritems(latencies):
+		health[node_key(node)] = { 'up': latency is not None, 'latency': latency, 'checked': now }
+	set(u"health.json", json.dumps(health))
+
+def get_entry(dirname, name):
+	'''Reads an entry from a private cache directory, or returns None.'''
+	
+	f = open_entry(dirname, name)
+	if f is None:
+		return None
+	with f:
+		return f.read()
+
+def open_entry(dirname, name):
+	'''Opens an entry in a private cache directory for reading, or returns
+	None; for entries that are read a piece at a time.'''
+	
+	path = private_dir(dirname)
+	if path is None:
+		return None
+	try:
+		fd = os.open(os.path.join(path, name), os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+	except OSError:
+		return None
+	
+	# Only entries that were written by the current user are trusted
+	st = os.fstat(fd)
+	if not stat.S_ISREG(st.st_mode) or (hasattr(os, 'getuid') and st.st_uid != os.getuid()):
+		os.close(fd)
+		return None
+	return os.fdopen(fd, 'rb')
+
+def set_entry(dirname, name, data):
+	'''Writes an entry to a private cache directory; the entry is replaced
+	atomically.'''
+	
+	path = private_dir(dirname, create=True)
+	if path is None:
+		return
+	try:
+		fd, tmp_path = tempfile.mkstemp(dir=path)
+		with os.fdopen(fd, 'wb') as f:
+			f.write(data)
+		os.rename(tmp_path, os.path.join(path, name))
+	except (IOError, OSError):
+		# Check the directories over again next time, in case they're gone
+		checked.clear()
+
+def remove_entries(dirname, prefix=u""):
+	'''Removes all entries whose names start with a prefix from a private
+	cache directory.'''
+	
+	path = private_dir(dirname)
+	if path is None:
+		return
+	try:
+		names = os.listdir(path)
+	except OSError:
+		return
+	for name in names:
+		if name.startswith(prefix):
+			try:
+				os.remove(os.path.join(path, name))
+			except OSError:
+				pass
@@ -0,0 +1,253 @@
+'''Recording and replaying SOAP traffic.
+
+Running halonctl with ``--record FILE`` writes every SOAP call it makes to a
+capture file: the request, the reply exactly as it came off the wire, and how
+long it took to arrive, along with the WSDL each node served. Running it again
+with ``--replay FILE`` answers the same calls from the capture instead of the
+nodes, after the same delays, so a slow session against real nodes can be
+reproduced offline, eg. to measure changes to parsing, formatting or
+dispatching against realistic replies.
+
+Calls are matched by node, method and arguments; when the same call was made
+several times, its replies are replayed in the order they were recorded, and
+the last one is reused once they run out. Calls that aren't in the capture,
+or that couldn't reach their node when it was recorded, fail as if the node
+was unreachable. Delays can be scaled with ``replay_speed``; ``2`` replays
+twice as fast, and ``0`` without any delays at all.
+
+The capture is a file of JSON lines, one per call, WSDL or node; replies are
+base64-encoded.
+'''
+
+from __future__ import print_function
+import six
+import os
+import sys
+import json
+import time
+import base64
+from io import BytesIO
+from collections import deque
+from threading import Lock
+from .config import config
+from .responses import digest, canonical
+from . import cache
+
+FORMAT = 1
+
+class CaptureError(Exception):
+	'''Raised when a capture file can't be read.'''
+	pass
+
+class Capture(object):
+	'''Records calls to, or replays them from, a capture file.
+	
+	:ivar str mode: ``record``, ``replay``, or None when neither
+	'''
+	
+	def __init__(self):
+		self.lock = Lock()
+		self.reset()
+	
+	def reset(self):
+		self.mode = None
+		self.f = None
+		self.started = None
+		self.exchanges = {}
+		self.wsdl_contents = {}
+		self.node_wsdls = {}
+		self.recorded = 0
+		self.replayed = 0
+		self.missed = 0
+	
+	@property
+	def recording(self):
+		return self.mode == 'record'
+	
+	@property
+	def replaying(self):
+		return self.mode == 'replay'
+	
+	def record_to(self, path):
+		'''Starts recording calls to a capture file, replacing it.'''
+		
+		self.stop()
+		# Replies can hold anything, eg. the node's configuration
+		fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+		if hasattr(os, 'fchmod'):
+			os.fchmod(fd, 0o600)
+		self.f = os.fdopen(fd, 'wb')
+		self.started = time.time()
+		self.mode = 'record'
+		self.write({ 'type': 'capture', 'format': FORMAT, 'started': self.started })
+	
+	def replay_from(self, path):
+		'''Starts answering calls from a capture file.'''
+		
+		self.stop()
+		with open(path, 'rb') as f:
+			lines = [line for line in f.read().decode('utf-8').splitlines() if line.strip()]
+		
+		try:
+			items = [json.loads(line) for line in lines]
+		except ValueError as e:
+			raise CaptureError(u"Invalid capture file: {0}".format(e))
+		if not items or items[0].get('type') != 'capture' or items[0].get('format') != FORMAT:
+			raise CaptureError(u"Not a capture file, or from an incompatible version of halonctl")
+		
+		for item in items[1:]:
+			if item['type'] == 'exchange':
+				self.exchanges.setdefault(item['key'], deque()).append(item)
+			elif item['type'] == 'wsdl':
+				self.wsdl_contents[item['digest']] = base64.b64decode(item['content'])
+			elif item['type'] == 'node':
+				self.node_wsdls[item['node']] = item['wsdl']
+		self.mode = 'replay'
+	
+	def stop(self):
+		'''Stops recording or replaying, and forgets about the capture.'''
+		
+		with self.lock:
+			if self.f:
+				self.f.close()
+			if self.replaying:
+				from .wsdl import wsdls
+				wsdls.uninstall()
+			self.reset()
+	
+	def write(self, item):
+		self.f.write(json.dumps(item).encode('utf-8') + b'\n')
+		self.f.flush()
+	
+	def key(self, node, method, envelope):
+		return digest(cache.node_key(node), method, canonical(envelope))
+	
+	def record(self, node, method, envelope, reply, started):
+		'''Records a call, if recording; ``reply`` is the raw reply, as
+		``(content, status, reason, encoding)``, or None if the node couldn't
+		be reached. ``started`` is when the request was sent.'''
+		
+		if not self.recording:
+			return
+		
+		elapsed = time.time() - started
+		item = {
+			'type': 'exchange',
+			'key': self.key(node, method, envelope),
+			'node': cache.node_key(node),
+			'method': method,
+			'request': envelope.decode('utf-8') if isinstance(envelope, six.binary_type) else envelope,
+			'offset': started - self.started,
+			'elapsed': elapsed,
+			'status': None,
+		}
+		if reply is not None:
+			content, status, reason, encoding = reply
+			item.update(status=int(status), reason=reason, encoding=encoding, body=base64.b64encode(content).decode('ascii'))
+		
+		with self.lock:
+			if not self.recording:
+				return
+			if not item['node'] in self.node_wsdls:
+				self.record_wsdl(node)
+			self.write(item)
+			self.recorded += 1
+	
+	def record_wsdl(self, node):
+		from .wsdl import wsdls
+		path = wsdls.node_path(node)
+		if path is None:
+			return
+		
+		wsdl_digest = os.path.splitext(os.path.basename(path))[0]
+		if not wsdl_digest in self.wsdl_contents:
+			with open(path, 'rb') as f:
+				self.wsdl_contents[wsdl_digest] = f.read()
+			self.write({ 'type': 'wsdl', 'digest': wsdl_digest, 'content': base64.b64encode(self.wsdl_contents[wsdl_digest]).decode('ascii') })
+		self.node_wsdls[cache.node_key(node)] = wsdl_digest
+		self.write({ 'type': 'node', 'node': cache.node_key(node), 'wsdl': wsdl_digest })
+	
+	def lookup(self, node, method, envelope):
+		'''Returns the next recorded reply to a call, or None if there's none.'''
+		
+		with self.lock:
+			queue = self.exchanges.get(self.key(node, method, envelope))
+			if not queue:
+				self.missed += 1
+				return None
+			self.replayed += 1
+			return queue.popleft() if len(queue) > 1 else queue[0]
+	
+	def delay(self, exchange):
+		'''Returns how long to wait before replaying a reply.'''
+		
+		speed = config.get('replay_speed', 1)
+		return exchange['elapsed'] / speed if exchange and speed else 0
+	
+	def reply(self, exchange):
+		'''Returns a recorded reply as ``(content, status, reason, encoding)``,
+		or None if the call didn't reach its node.'''
+		
+		if not exchange or exchange['status'] is None:
+			return None
+		return (base64.b64decode(exchange['body']), exchange['status'], exchange['reason'], exchange['encoding'])
+	
+	def response(self, node, method, envelope, url):
+		'''Replays a call for the threaded transport, returning a
+		:class:`requests.Response`, or None if the node is to be treated as
+		unreachable.'''
+		
+		exchange = self.lookup(node, method, envelope)
+		time.sleep(self.delay(exchange))
+		reply = self.reply(exchange)
+		return make_response(url, *reply) if reply else None
+	
+	def record_response(self, node, method, envelope, r, started):
+		'''Records a reply received by the threaded transport, and returns a
+		:class:`requests.Response` to use in its place, as it's been read.'''
+		
+		content = r.raw.read(decode_content=False)
+		r.raw.release_conn()
+		encoding = r.headers.get('Content-Encoding')
+		self.record(node, method, envelope, (content, r.status_code, r.reason, encoding), started)
+		return make_response(r.url, content, r.status_code, r.reason, encoding)
+	
+	def install_wsdls(self, nodes):
+		'''Installs the recorded WSDLs as the ones served by the given nodes,
+		until the replay is stopped; nodes that weren't recorded get the first
+		one recorded.'''
+		
+		from .wsdl import wsdls
+		if not self.wsdl_contents:
+			return False
+		
+		first = next(six.itervalues(self.node_wsdls), None) or next(six.iterkeys(self.wsdl_contents))
+		for node in nodes:
+			wsdl_digest = self.node_wsdls.get(cache.node_key(node), first)
+			wsdls.install(node, self.wsdl_contents[wsdl_digest])
+		return True
+	
+	def print_stats(self, file=sys.stderr):
+		'''Prints how many calls were recorded or replayed.'''
+		
+		if self.recorded:
+			print(u"Capture: {0} calls recorded".format(self.recorded), file=file)
+		if self.replayed or self.missed:
+			print(u"Capture: {0} calls replayed, {1} not in the capture".format(self.replayed, self.missed), file=file)
+
+def make_response(url, content, status, reason, encoding):
+	'''Builds a :class:`requests.Response` around a raw reply, decoding it
+	on the fly like a real one.'''
+	
+	import requests
+	from requests.adapters import HTTPAdapter
+	from requests.packages.urllib3.response import HTTPResponse
+	
+	headers = { 'Content-Type': 'text/xml; charset=utf-8' }
+	if encoding:
+		headers['Content-Encoding'] = encoding
+	raw = HTTPResponse(body=BytesIO(content), headers=headers, status=status, reason=reason,
+		preload_content=False, decode_content=True)
+	return HTTPAdapter().build_response(requests.Request('POST', url).prepare(), raw)
+
+captures = Capture()
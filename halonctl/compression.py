@@ -0,0 +1,108 @@
+'''HTTP compression of SOAP requests and replies.
+
+Replies are always requested compressed (``Accept-Encoding: gzip, deflate``);
+nodes that support it will compress them, others will ignore the header.
+
+Requests are only compressed if ``compress_requests`` is enabled in the
+configuration, and are at least ``compress_min_size`` bytes (1024 by default)
+large, as there's no way to know beforehand if a node will accept them.
+'''
+
+from __future__ import print_function
+import six
+import sys
+import zlib
+from threading import Lock
+from .config import config
+
+ACCEPT_ENCODING = 'gzip, deflate'
+DEFAULT_MIN_SIZE = 1024
+
+def method_name(context):
+	'''Returns the name of the SOAP method a request context is for.'''
+	method = getattr(context.client, 'method', None)
+	return getattr(method, 'name', None)
+
+def should_compress(body):
+	'''Returns whether a request body should be compressed.'''
+	return bool(config.get('compress_requests', False)) and len(body) >= config.get('compress_min_size', DEFAULT_MIN_SIZE)
+
+def compress(data):
+	'''Compresses data with gzip.'''
+	c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	return c.compress(data) + c.flush()
+
+def decompress(data, encoding):
+	'''Decompresses data according to a ``Content-Encoding`` header value.'''
+	
+	encoding = (encoding or '').strip().lower()
+	if encoding in ('gzip', 'x-gzip'):
+		return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+	elif encoding == 'deflate':
+		# Some servers send raw deflate streams, without the zlib header
+		try:
+			return zlib.decompress(data)
+		except zlib.error:
+			return zlib.decompress(data, -zlib.MAX_WBITS)
+	return data
+
+class Transfer(object):
+	'''Byte counters for a number of calls; ``wire`` counters are what was
+	actually sent or received, ``raw`` ones are before compression.'''
+	
+	def __init__(self):
+		self.calls = 0
+		self.sent_wire = 0
+		self.sent_raw = 0
+		self.received_wire = 0
+		self.received_raw = 0
+	
+	@property
+	def saved(self):
+		'''The fraction of bytes saved by compression, in either direction.'''
+		raw = self.sent_raw + self.received_raw
+		return 1.0 - float(self.sent_wire + self.received_wire) / raw if raw else 0.0
+
+class TransferStats(object):
+	'''Per-call transfer counters, keyed by node host and SOAP method.'''
+	
+	def __init__(self):
+		self.transfers = {}
+		self.lock = Lock()
+	
+	def get(self, node, method):
+		key = (node.host, method)
+		with self.lock:
+			if not key in self.transfers:
+				self.transfers[key] = Transfer()
+			return self.transfers[key]
+	
+	def sent(self, node, method, wire, raw):
+		'''Records a sent request.'''
+		t = self.get(node, method)
+		with self.lock:
+			t.calls += 1
+			t.sent_wire += wire
+			t.sent_raw += raw
+	
+	def received(self, node, method, wire, raw):
+		'''Records a received reply.'''
+		t = self.get(node, method)
+		with self.lock:
+			t.received_wire += wire
+			t.received_raw += raw
+	
+	def print_stats(self, file=sys.stderr):
+		'''Prints a per-method summary of transferred bytes.'''
+		
+		methods = {}
+		for (host, method), t in six.iteritems(self.transfers):
+			m = methods.setdefault(method, Transfer())
+			for attr in ('calls', 'sent_wire', 'sent_raw', 'received_wire', 'received_raw'):
+				setattr(m, attr, getattr(m, attr) + getattr(t, attr))
+		
+		for method, t in sorted(six.iteritems(methods), key=lambda t: t[0] or u""):
+			print(u"{method}: {t.calls} calls, sent {t.sent_wire}/{t.sent_raw} bytes, received {t.received_wire}/{t.received_raw} bytes, {saved:.0%} saved".format(
+				method=method, t=t, saved=t.saved), file=file)
+
+transfers = TransferStats()
@@ -0,0 +1,211 @@
+'''Resolving node credentials.
+
+A node without a password of its own falls back to the keyring, and then to
+its cluster, which in turn looks through all of its nodes for one that has
+one. Done on every call, that's a walk over the whole cluster per node, and a
+keyring lookup per node; with some keyring backends, like the Secret Service
+over D-Bus, each of those takes a while.
+
+Instead, every node's effective username and password is resolved once per
+run, before any calls are made, and kept in a map that's never modified, only
+replaced; the keyring entries needed to do so are looked up once each, one
+after the other, as keyring backends aren't safe to use from several threads
+at once.
+Logging in or out with ``halonctl keyring`` drops the map, as it changes the
+passwords it was resolved from.
+
+With ``"keyring_cache": seconds`` in the configuration, keyring entries are
+also kept by a running agent (see :mod:`halonctl.agent`) for that long, much
+like ``ssh-agent`` keeps keys, and runs that aren't handed over to it ask it
+for them over its socket before asking the keyring. ``halonctl keyring
+logout`` drops them from the agent.
+'''
+
+from __future__ import print_function
+import six
+import time
+from threading import Lock
+from collections import OrderedDict
+from .config import config
+
+def get_keyring_password(host, username):
+	import keyring
+	return keyring.get_password(host, username)
+
+class CredentialStore(object):
+	'''Keeps keyring entries, and the credentials resolved from them.
+	
+	:ivar dict keyring: Keyring entries looked up so far, as ``{ (host,
+	                    username): (password, expires) }``; the password is
+	                    None if there's no entry, and ``expires`` is None if it
+	                    never does
+	:ivar dict resolved: Resolved credentials, as ``{ node: (username,
+	                     password) }``
+	:ivar bool remote: Whether to share keyring entries with a running agent;
+	                   False in the agent itself
+	'''
+	
+	def __init__(self, backend=get_keyring_password):
+		self.backend = backend
+		self.remote = True
+		self.keyring = {}
+		self.resolved = {}
+		self.lock = Lock()
+		self.backend_lock = Lock()
+	
+	def is_valid(self, key, now):
+		entry = self.keyring.get(key)
+		return entry is not None and (entry[1] is None or entry[1] > now)
+	
+	def keyring_password(self, host, username):
+		'''Returns a password from the keyring, looking it up if it hasn't
+		been already, or has expired.'''
+		
+		if not host or not username:
+			return None
+		
+		key = (host, username)
+		if not self.is_valid(key, time.time()):
+			self.prefetch([key])
+		return self.keyring[key][0]
+	
+	def prefetch(self, keys):
+		'''Looks up a number of ``(host, username)`` keyring entries, skipping
+		the ones that have been already. Only one thread talks to the keyring
+		backend at a time.'''
+		
+		now = time.time()
+		pending = set(key for key in keys if not self.is_valid(key, now))
+		if not pending:
+			return
+		
+		ttl = config.get('keyring_cache', 0)
+		results = {}
+		if ttl and self.remote:
+			from .agent import keyring_request
+			reply = keyring_request({ 'keyring': 'get', 'keys': sorted(pending) })
+			if reply:
+				results = entries_dict(reply['entries'])
+				pending.difference_update(results)
+		
+		passwords = {}
+		with self.backend_lock:
+			for key in sorted(pending):
+				passwords[key] = self.backend(*key)
+		
+		expires = now + ttl if ttl else None
+		looked_up = { key: (password, expires) for key, password in six.iteritems(passwords) }
+		if ttl and looked_up and self.remote:
+			from .agent import keyring_request
+			keyring_request({ 'keyring': 'put', 'entries': entries_list(looked_up) })
+		
+		results.update(looked_up)
+		self.update(results)
+	
+	def resolve(self, nodes):
+		'''Resolves the credentials of the given nodes, and of the nodes
+		sharing clusters with them, as they may have to fall back to them.'''
+		
+		clusters = OrderedDict()
+		for node in nodes:
+			clusters.setdefault(id(node.cluster), node.cluster)
+		
+		usernames = {}
+		for cluster in six.itervalues(clusters):
+			username = cluster.username
+			for member in cluster:
+				usernames[member] = member.local_username or username
+		self.prefetch([(member.host, username) for member, username in six.iteritems(usernames)
+			if member.host and username and not member.local_password])
+		
+		resolved = {}
+		for cluster in six.itervalues(clusters):
+			passwords = [member.local_password or self.keyring_password(member.host, usernames[member]) for member in cluster]
+			shared = cluster.local_password or next((password for password in passwords if password), None)
+			for member, password in zip(cluster, passwords):
+				resolved[member] = (usernames[member], password or shared)
+		
+		with self.lock:
+			self.resolved = resolved
+	
+	def get(self, node):
+		'''Returns a node's resolved ``(username, password)``, or None if it
+		hasn't been resolved.'''
+		return self.resolved.get(node)
+	
+	def entries(self, keys):
+		'''Returns the unexpired keyring entries among the given keys, as
+		``{ key: (password, expires) }``.'''
+		
+		now = time.time()
+		return { key: self.keyring[key] for key in keys if self.is_valid(key, now) }
+	
+	def update(self, entries):
+		'''Adds keyring entries, as ``{ key: (password, expires) }``.'''
+		
+		with self.lock:
+			keyring = dict(self.keyring)
+			keyring.update(entries)
+			self.keyring = keyring
+	
+	def forget(self, keys=None):
+		'''Drops the given keyring entries, or all of them, along with any
+		credentials resolved from them.'''
+		
+		with self.lock:
+			if keys is None:
+				self.keyring = {}
+			else:
+				self.keyring = { key: entry for key, entry in six.iteritems(self.keyring) if not key in keys }
+			self.resolved = {}
+	
+	def stored(self, host, username, password):
+		'''Records that a password was stored in (or, if None, deleted from)
+		the keyring, dropping any credentials resolved from the old one.
+		
+		A running agent is given the new password if ``keyring_cache`` is set,
+		and made to forget the old one otherwise.'''
+		
+		ttl = config.get('keyring_cache', 0)
+		if password is None or not ttl:
+			self.flush([(host, username)])
+			if password is None:
+				return
+		
+		entry = { (host, username): (password, time.time() + ttl if ttl else None) }
+		self.forget([(host, username)])
+		self.update(entry)
+		if ttl and self.remote:
+			from .agent import keyring_request
+			keyring_request({ 'keyring': 'put', 'entries': entries_list(entry) })
+	
+	def flush(self, keys=None):
+		'''Drops the given keyring entries, or all of them, both here and
+		from a running agent, so that they're looked up again.'''
+		
+		self.forget(keys)
+		if self.remote:
+			from .agent import keyring_request
+			keyring_request({ 'keyring': 'flush', 'keys': [list(key) for key in keys] if keys is not None else None })
+	
+	def forget_unexpiring(self):
+		'''Drops the keyring entries that never expire; the agent only keeps
+		them for the run that looked them up.'''
+		
+		with self.lock:
+			self.keyring = { key: entry for key, entry in six.iteritems(self.keyring) if entry[1] is not None }
+			self.resolved = {}
+	
+	def clear(self):
+		'''Forgets all keyring entries and resolved credentials.'''
+		self.forget()
+
+def entries_list(entries):
+	'''Converts keyring entries to a form that can be sent as JSON.'''
+	return [[key[0], key[1], password, expires] for key, (password, expires) in six.iteritems(entries)]
+
+def entries_dict(entries):
+	'''Converts keyring entries back from :func:`entries_list`.'''
+	return { (host, username): (password, expires) for host, username, password, expires in entries }
+
+credentials = CredentialStore()
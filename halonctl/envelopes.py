@@ -0,0 +1,144 @@
+'''Precompiled SOAP request envelopes.
+
+Building an envelope through suds means walking the WSDL's schema and
+marshalling every parameter into a document tree, which is a lot of work for
+tiny, frequent calls like ``commandPoll(commandid=...)`` or ``getUptime()``.
+
+Instead, the first time an operation is called with a given set of scalar
+parameters, suds is asked to build an envelope with placeholders in place of
+the values; this is split into a template, which later calls simply fill in.
+Calls with complex parameters (dicts, lists, suds objects) always go through
+suds.
+'''
+
+from __future__ import print_function
+import six
+import numbers
+from threading import Lock
+from weakref import WeakKeyDictionary
+from xml.sax.saxutils import escape
+from suds.client import SoapClient
+
+PLACEHOLDER = u"@@halonctl:{0}@@"
+XML_ENTITIES = { '"': '&quot;', "'": '&apos;' }
+
+class PrecompiledRequest(object):
+	'''A request context built from a template.
+	
+	Quacks like the suds request contexts returned by
+	:func:`halonctl.models.Node.make_request`.
+	'''
+	
+	def __init__(self, client, envelope):
+		self.client = client
+		self.envelope = envelope
+	
+	def process_reply(self, reply, status=None, description=None):
+		return self.client.process_reply(reply, status, description)
+
+class EnvelopeCache(object):
+	'''Holds envelope templates, shared between all clients using the same
+	WSDL, and per-client, per-operation SOAP clients.'''
+	
+	def __init__(self):
+		self.templates = {}
+		self.clients = WeakKeyDictionary()
+		self.lock = Lock()
+	
+	def make_request(self, client, name_, args, kwargs):
+		'''Creates a request context for an operation on a suds client,
+		using a precompiled template if possible.'''
+		
+		if not all(is_scalar(v) for v in args) or not all(is_scalar(v) for v in six.itervalues(kwargs)):
+			return getattr(client.service, name_)(*args, **kwargs)
+		
+		names = sorted(kwargs)
+		key = (client.wsdl.url, name_, tuple(v is None for v in args), tuple((k, kwargs[k] is None) for k in names))
+		template = self.templates.get(key)
+		if template is None:
+			template = self.compile(client, name_, args, kwargs)
+			with self.lock:
+				self.templates[key] = template
+		if template is False:
+			return getattr(client.service, name_)(*args, **kwargs)
+		
+		chunks, order = template
+		values = list(args) + [kwargs[k] for k in names]
+		parts = [chunks[0]]
+		for i, chunk in zip(order, chunks[1:]):
+			parts.append(encode(values[i]))
+			parts.append(chunk)
+		
+		return PrecompiledRequest(self.soap_client(client, name_), b''.join(parts))
+	
+	def compile(self, client, name_, args, kwargs):
+		'''Builds a template for an operation, as a tuple of ``(chunks,
+		order)``; the envelope is recreated by joining the chunks together
+		with the encoded parameter values, in the given order.
+		
+		Parameters are numbered with positional ones first, followed by
+		keyword arguments sorted by name; the order they appear in in the
+		envelope is decided by the WSDL.
+		
+		Returns False if the operation can't be precompiled, in which case it
+		should always be left to suds.'''
+		
+		names = sorted(kwargs)
+		values = list(args) + [kwargs[k] for k in names]
+		placeholders = [PLACEHOLDER.format(i) if v is not None else None for i, v in enumerate(values)]
+		envelope = getattr(client.service, name_)(*placeholders[:len(args)], **dict(zip(names, placeholders[len(args):]))).envelope
+		if isinstance(envelope, six.text_type):
+			envelope = envelope.encode('utf-8')
+		
+		positions = []
+		for i, placeholder in enumerate(placeholders):
+			if placeholder is None:
+				continue
+			placeholder = placeholder.encode('utf-8')
+			pos = envelope.find(placeholder)
+			if pos == -1 or envelope.find(placeholder, pos + 1) != -1:
+				# suds dropped, mangled or repeated the parameter; let it be
+				return False
+			positions.append((pos, len(placeholder), i))
+		
+		positions.sort()
+		chunks = []
+		offset = 0
+		for pos, length, i in positions:
+			chunks.append(envelope[offset:pos])
+			offset = pos + length
+		chunks.append(envelope[offset:])
+		
+		return (chunks, [i for pos, length, i in positions])
+	
+	def soap_client(self, client, name_):
+		'''Returns a cached suds SoapClient for an operation on a client; it's
+		what knows where to send a request, with which headers, and how to
+		parse the reply.'''
+		
+		with self.lock:
+			clients = self.clients.setdefault(client, {})
+			soap_client = clients.get(name_)
+		if soap_client is None:
+			method = getattr(client.service, name_)
+			soap_client = SoapClient(method.client, method.method)
+			with self.lock:
+				soap_client = clients.setdefault(name_, soap_client)
+		return soap_client
+
+def is_scalar(value):
+	'''Returns whether a value can be written straight into a template.'''
+	return value is None or isinstance(value, (six.string_types, bool, numbers.Integral, float))
+
+def encode(value):
+	'''Encodes a parameter value the way suds would marshal it.'''
+	
+	if value is True:
+		return b'true'
+	elif value is False:
+		return b'false'
+	elif isinstance(value, six.binary_type):
+		value = value.decode('utf-8')
+	return escape(six.text_type(value), XML_ENTITIES).encode('utf-8')
+
+envelopes = EnvelopeCache()
@@ -3,6 +3,12 @@ from six.moves import StringIO
 from halonctl.modapi import Formatter
 
 class CSVFormatter(Formatter):
+	streaming = True
+	
+	def run_iter(self, data, args):
+		for row in data:
+			yield self.run([row], args)
+	
 	def format(self, data, args):
 		buf = StringIO()
 		w = csv.writer(buf)
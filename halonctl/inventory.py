@@ -0,0 +1,307 @@
+'''Selecting nodes by name, cluster, tag or host.
+
+The ``-t/--target`` flag takes a selector, which picks nodes from the
+configuration by combining any of:
+
+* ``name``: a node, by name
+* ``cluster:name``, ``tag:name``, ``host:name``: the nodes in a cluster, with
+  a tag (see the ``tags`` configuration entry) or at a host
+* ``mx-*``, ``cluster:eu-?``: glob patterns, matching any of the above
+* ``/^mx\\d+$/``, ``tag:/edge/``: regular expressions, likewise
+
+with ``a | b`` (or ``a, b``) for nodes in either, ``a & b`` for nodes in
+both, ``!a`` for nodes not in it, and parentheses. For example, ``cluster:eu-*
+& tag:edge & !mx-3*`` selects the edge nodes in every ``eu-`` cluster, except
+the ``mx-3`` ones. The ``-n`` and ``-c`` flags also take glob patterns and
+regular expressions, matching node and cluster names respectively.
+
+An :class:`Inventory` is built once per configuration, and indexes names so
+that selectors resolve in about a millisecond or less, even for ten thousand
+nodes; see ``run_inventory_bench.py``.
+'''
+
+from __future__ import print_function
+import six
+import re
+from bisect import bisect_left
+
+#: Characters that make a name a glob pattern
+GLOB_CHARS = re.compile(r'[*?[]')
+TEXT_ANCHORS = re.compile(r'\\[AZ]')
+
+TOKEN_RE = re.compile(r'''\s*(?:
+	(?P<op>[|,&!()]) |
+	(?P<atom>(?:[a-z]+:)?(?:/(?:[^/\\]|\\.)*/|[^\s|,&!()/]+))
+)''', re.X)
+
+KINDS = ['node', 'cluster', 'tag', 'host']
+
+#: How many patterns' matches to remember, per kind of name
+MEMO_SIZE = 256
+
+class SelectorError(ValueError):
+	'''Raised for selectors that are invalid, or refer to things that don't
+	exist.'''
+	pass
+
+def is_pattern(name):
+	'''Returns whether a name is a glob pattern or a regular expression,
+	rather than an exact name.'''
+	return len(name) > 1 and name.startswith('/') and name.endswith('/') or bool(GLOB_CHARS.search(name))
+
+def glob_to_regex(glob):
+	'''Translates a glob pattern into a regular expression that matches a
+	single line.'''
+	
+	parts = []
+	i = 0
+	while i < len(glob):
+		c = glob[i]
+		i += 1
+		if c == '*':
+			parts.append(u"[^\\n]*")
+		elif c == '?':
+			parts.append(u"[^\\n]")
+		elif c == '[':
+			negated = glob[i:i + 1] in ('!', '^')
+			end = glob.find(']', i + 2 if negated else i + 1)
+			if end < 0:
+				parts.append(u"\\[")
+				continue
+			chars = glob[i + 1 if negated else i:end].replace('\\', '\\\\')
+			i = end + 1
+			parts.append(u"[^\\n{0}]".format(chars) if negated else u"[{0}]".format(chars))
+		else:
+			parts.append(re.escape(c))
+	return u"^{0}$".format(u"".join(parts))
+
+class NameIndex(object):
+	'''Looks up names in a list by exact name, glob pattern or regular
+	expression, returning sets of their positions.
+	
+	Patterns are matched against all names joined into one string, so the
+	regular expression engine does the scanning, rather than a Python loop;
+	glob patterns that are just a prefix are looked up in a sorted copy.
+	'''
+	
+	def __init__(self, names, kind):
+		self.kind = kind
+		self.names = list(names)
+		self.positions = {}
+		for i, name in enumerate(self.names):
+			self.positions.setdefault(name, set()).add(i)
+		
+		self.text = u"\n".join(self.names)
+		self.lines = {}
+		offset = 0
+		for i, name in enumerate(self.names):
+			self.lines[offset] = i
+			offset += len(name) + 1
+		
+		self.sorted = sorted((name, i) for i, name in enumerate(self.names))
+		self.sorted_names = [name for name, i in self.sorted]
+		self.memo = {}
+	
+	def match(self, pattern):
+		'''Returns the positions of the names matching a pattern; exact names
+		that don't exist raise :class:`SelectorError`.'''
+		
+		if not is_pattern(pattern):
+			try:
+				return frozenset(self.positions[pattern])
+			except KeyError:
+				raise SelectorError(u"Unknown {kind}: {name}".format(kind=self.kind, name=pattern))
+		
+		if not pattern in self.memo:
+			if len(self.memo) >= MEMO_SIZE:
+				self.memo.clear()
+			self.memo[pattern] = self.scan(pattern)
+		return self.memo[pattern]
+	
+	def scan(self, pattern):
+		if pattern.startswith('/'):
+			try:
+				regex = re.compile(pattern[1:-1])
+			except re.error as e:
+				raise SelectorError(u"Invalid regular expression {0}: {1}".format(pattern, e))
+			
+			# \A and \Z would only match at the ends of the whole text, so
+			# those patterns are checked against every name on its own
+			if TEXT_ANCHORS.search(pattern):
+				return frozenset(i for i, name in enumerate(self.names) if regex.search(name))
+			
+			# A lookahead at each line start doesn't consume anything, so no
+			# name is skipped; names it ran past the end of are checked again
+			try:
+				scanner = re.compile(u"^(?=[^\\n]*?(?:{0}))".format(pattern[1:-1]), re.M)
+			except re.error:
+				return frozenset(i for i, name in enumerate(self.names) if regex.search(name))
+			candidates = (self.lines[m.start()] for m in scanner.finditer(self.text))
+			return frozenset(i for i in candidates if regex.search(self.names[i]))
+		
+		prefix = GLOB_CHARS.split(pattern, 1)[0]
+		if pattern == prefix + u"*":
+			start = bisect_left(self.sorted_names, prefix)
+			end = start
+			while end < len(self.sorted_names) and self.sorted_names[end].startswith(prefix):
+				end += 1
+			return frozenset(i for name, i in self.sorted[start:end])
+		
+		scanner = re.compile(glob_to_regex(pattern), re.M)
+		return frozenset(self.lines[m.start()] for m in scanner.finditer(self.text))
+
+class Inventory(object):
+	'''An index of configured nodes, their clusters, tags and hosts.
+	
+	:param nodes: The configured nodes, as an ordered ``{ name: node }``
+	:param clusters: The configured clusters, as ``{ name: nodelist }``
+	:param tags: The configured tags, as ``{ tag: [node names] }``
+	'''
+	
+	def __init__(self, nodes, clusters, tags={}):
+		self.build(list(nodes), [node.host or u"" for node in six.itervalues(nodes)],
+			[(name, [node.name for node in cluster]) for name, cluster in six.iteritems(clusters)], tags)
+		self.lookup = nodes.__getitem__
+	
+	@classmethod
+	def from_tables(cls, names, hosts, clusters, tags, lookup):
+		'''Builds an inventory from just the names of things, without creating
+		any nodes; see :mod:`halonctl.snapshot`.
+		
+		:param names: The names of the configured nodes, in order
+		:param hosts: Their hosts, in the same order
+		:param clusters: The configured clusters, as ``[(name, [node names])]``
+		:param tags: The configured tags, as ``{ tag: [node names] }``
+		:param lookup: Called with the name of each selected node, to get it
+		'''
+		
+		inventory = cls.__new__(cls)
+		inventory.build(names, hosts, clusters, tags)
+		inventory.lookup = lookup
+		return inventory
+	
+	def build(self, names, hosts, clusters, tags):
+		self.everything = frozenset(range(len(names)))
+		node_positions = dict((name, i) for i, name in enumerate(names))
+		
+		clusters = sorted(clusters, key=lambda cluster: cluster[0])
+		self.cluster_names = [name for name, members in clusters]
+		self.cluster_members = [frozenset(node_positions[name] for name in members if name in node_positions) for name, members in clusters]
+		
+		self.tag_names = sorted(tags)
+		self.tag_members = []
+		for tag in self.tag_names:
+			unknown = [name for name in tags[tag] if not name in node_positions]
+			if unknown:
+				raise SelectorError(u"Tag '{tag}' references nonexistent node '{name}'".format(tag=tag, name=unknown[0]))
+			self.tag_members.append(frozenset(node_positions[name] for name in tags[tag]))
+		
+		self.indexes = {
+			'node': NameIndex(names, u"node"),
+			'cluster': NameIndex(self.cluster_names, u"cluster"),
+			'tag': NameIndex(self.tag_names, u"tag"),
+			'host': NameIndex(hosts, u"host"),
+		}
+		self.groups = { 'cluster': self.cluster_members, 'tag': self.tag_members }
+	
+	def atom(self, text):
+		'''Returns the positions of the nodes a single term selects.'''
+		
+		kind, sep, name = text.partition(u":")
+		if not sep or not kind in KINDS or not name:
+			kind, name = 'node', text
+		
+		matched = self.indexes[kind].match(name)
+		if not kind in self.groups:
+			return matched
+		members = self.groups[kind]
+		if len(matched) == 1:
+			return members[next(iter(matched))]
+		return frozenset().union(*[members[i] for i in matched])
+	
+	def positions(self, selector):
+		'''Returns the positions of the nodes a selector selects.'''
+		
+		tokens = []
+		pos = 0
+		selector = selector.strip()
+		while pos < len(selector):
+			m = TOKEN_RE.match(selector, pos)
+			if not m or m.end() == pos:
+				raise SelectorError(u"Invalid selector at '{0}'".format(selector[pos:]))
+			tokens.append((u"op", m.group('op')) if m.group('op') else (u"atom", m.group('atom')))
+			pos = m.end()
+			while pos < len(selector) and selector[pos].isspace():
+				pos += 1
+		
+		parser = SelectorParser(self, tokens)
+		result = parser.union()
+		if parser.pos != len(tokens):
+			raise SelectorError(u"Unexpected '{0}' in selector".format(tokens[parser.pos][1]))
+		return result
+	
+	def select(self, *selectors):
+		'''Returns the nodes any of the given selectors select, in the order
+		they're configured.'''
+		
+		result = frozenset().union(*[self.positions(selector) for selector in selectors])
+		names = self.indexes['node'].names
+		return [self.lookup(names[i]) for i in sorted(result)]
+	
+	def expand(self, names, kind):
+		'''Replaces the patterns among a list of node or cluster names with
+		the names they match, in the order they're configured.'''
+		
+		index = self.indexes[kind]
+		result = []
+		for name in names:
+			if is_pattern(name):
+				matched = sorted(index.match(name))
+				if not matched:
+					raise SelectorError(u"No {kind} matches {pattern}".format(kind=kind, pattern=name))
+				result.extend(index.names[i] for i in matched)
+			else:
+				result.append(name)
+		return result
+
+class SelectorParser(object):
+	'''Evaluates a tokenized selector, by recursive descent.'''
+	
+	def __init__(self, inventory, tokens):
+		self.inventory = inventory
+		self.tokens = tokens
+		self.pos = 0
+	
+	def peek(self):
+		return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+	
+	def union(self):
+		result = self.intersection()
+		while self.peek()[1] in (u"|", u","):
+			self.pos += 1
+			result = result | self.intersection()
+		return result
+	
+	def intersection(self):
+		result = self.unary()
+		while self.peek()[1] == u"&":
+			self.pos += 1
+			result = result & self.unary()
+		return result
+	
+	def unary(self):
+		kind, value = self.peek()
+		if value == u"!":
+			self.pos += 1
+			return self.inventory.everything - self.unary()
+		elif value == u"(":
+			self.pos += 1
+			result = self.union()
+			if self.peek()[1] != u")":
+				raise SelectorError(u"Missing ')' in selector")
+			self.pos += 1
+			return result
+		elif kind == u"atom":
+			self.pos += 1
+			return self.inventory.atom(value)
+		raise SelectorError(u"Unexpected {0} in selector".format(u"'{0}'".format(value) if value else u"end"))
@@ -0,0 +1,237 @@
+'''A cached manifest of modules and formatters.
+
+Importing every module just to build the commandline parser is slow, as some
+of them pull in heavy dependencies of their own; most runs only ever use one
+of them. Instead, the first run imports them all, recording their names, help
+strings and the arguments they register, and caches that in a manifest (see
+:mod:`halonctl.cache`). Later runs build their parser from the manifest, and
+only import the module that's actually selected.
+
+The manifest is rebuilt whenever a file in any of the module or formatter
+directories is added, removed or changed. Modules whose arguments can't be
+recorded (eg. ones using custom argparse actions) are always imported.
+'''
+
+from __future__ import print_function
+import six
+import os
+import sys
+import json
+import pkgutil
+from . import cache
+
+DIRNAME = u"plugins"
+MANIFEST = u"manifest.json"
+
+# Argument types that can be stored in the manifest by name
+TYPES = { 'int': int, 'float': float, 'str': str }
+
+class Unrecordable(Exception):
+	'''Raised when a module registers arguments that can't be recorded.'''
+	pass
+
+def portable(kwargs):
+	'''Returns keyword arguments for an argparse call in a form that can be
+	stored as JSON.
+	
+	Types other than the builtin ones, and defaults that can't be stored,
+	are left out; the module is imported before the arguments are parsed for
+	real anyway. Anything else that can't be stored raises
+	:class:`Unrecordable`.'''
+	
+	result = {}
+	for key, value in six.iteritems(kwargs):
+		if key == 'type':
+			name = getattr(value, '__name__', None)
+			if TYPES.get(name) is value:
+				result[key] = name
+			continue
+		
+		try:
+			json.dumps(value)
+		except (TypeError, ValueError):
+			if key == 'default':
+				continue
+			raise Unrecordable(key)
+		result[key] = value
+	return result
+
+class RecordingParser(object):
+	'''Stands in for an :class:`argparse.ArgumentParser` while a module
+	registers its arguments, and records them.'''
+	
+	def __init__(self):
+		self.arguments = []
+		self.groups = []
+		self.subparsers = None
+	
+	def add_argument(self, *args, **kwargs):
+		self.arguments.append([list(args), portable(kwargs)])
+	
+	def add_argument_group(self, *args, **kwargs):
+		return self.add_group('argument', args, kwargs)
+	
+	def add_mutually_exclusive_group(self, **kwargs):
+		return self.add_group('exclusive', (), kwargs)
+	
+	def add_group(self, kind, args, kwargs):
+		self.groups.append([kind, list(args), portable(kwargs)])
+		return RecordingGroup(self, len(self.groups) - 1)
+	
+	def add_subparsers(self, **kwargs):
+		self.subparsers = RecordingSubparsers(portable(kwargs))
+		return self.subparsers
+	
+	def set_defaults(self, **kwargs):
+		# Defaults are set when the module is actually loaded
+		pass
+	
+	def spec(self):
+		return {
+			'arguments': self.arguments,
+			'groups': self.groups,
+			'subparsers': self.subparsers.spec() if self.subparsers else None,
+		}
+
+class RecordingGroup(object):
+	'''Records arguments added to an argument group, or a mutually exclusive
+	one, on the parser it belongs to.'''
+	
+	def __init__(self, parser, index):
+		self.parser = parser
+		self.index = index
+	
+	def add_argument(self, *args, **kwargs):
+		self.parser.arguments.append([list(args), portable(kwargs), self.index])
+
+class RecordingSubparsers(object):
+	def __init__(self, kwargs):
+		self.kwargs = kwargs
+		self.required = False
+		self.parsers = []
+	
+	def add_parser(self, name, **kwargs):
+		p = RecordingParser()
+		self.parsers.append([name, portable(kwargs), p])
+		return p
+	
+	def spec(self):
+		return {
+			'kwargs': self.kwargs,
+			'required': self.required,
+			'parsers': [[name, kwargs, p.spec()] for name, kwargs, p in self.parsers],
+		}
+
+def replay(parser, spec):
+	'''Registers recorded arguments on a parser.'''
+	
+	groups = []
+	for kind, args, kwargs in spec.get('groups', []):
+		if kind == 'exclusive':
+			groups.append(parser.add_mutually_exclusive_group(**kwargs))
+		else:
+			groups.append(parser.add_argument_group(*args, **kwargs))
+	
+	for argument in spec['arguments']:
+		args, kwargs = argument[:2]
+		if 'type' in kwargs:
+			kwargs = dict(kwargs, type=TYPES[kwargs['type']])
+		target = groups[argument[2]] if len(argument) > 2 else parser
+		target.add_argument(*args, **kwargs)
+	
+	if spec['subparsers']:
+		subparsers = parser.add_subparsers(**spec['subparsers']['kwargs'])
+		subparsers.required = spec['subparsers']['required']
+		for name, kwargs, subspec in spec['subparsers']['parsers']:
+			replay(subparsers.add_parser(name, **kwargs), subspec)
+
+def load_plugin(path, name):
+	'''Imports a module or formatter file from a directory.'''
+	return pkgutil.get_importer(path).find_module(name).load_module(name)
+
+def iter_plugins(path):
+	'''Yields the names of all modules or formatters in a directory.'''
+	
+	for loader, name, ispkg in pkgutil.iter_modules(path=[path]):
+		yield name
+
+def signature(paths):
+	'''Returns something that changes whenever a file in any of the given
+	directories does, or halonctl is upgraded to a different manifest format.'''
+	
+	# Looking up halonctl's own version is slow; the manifest's format can't
+	# change without this file changing along with it, though
+	st = os.stat(__file__)
+	result = [list(sys.version_info[:2]), [__file__, st.st_mtime, st.st_size]]
+	for path in paths:
+		try:
+			names = sorted(os.listdir(path))
+		except OSError:
+			continue
+		for name in names:
+			full_path = os.path.join(path, name)
+			if os.path.isdir(full_path):
+				if name == '__pycache__':
+					continue
+				full_path = os.path.join(full_path, '__init__.py')
+			elif not name.endswith('.py'):
+				continue
+			try:
+				st = os.stat(full_path)
+			except OSError:
+				continue
+			result.append([full_path, st.st_mtime, st.st_size])
+	return result
+
+def build(base_paths):
+	'''Imports all modules and formatters, and returns a manifest for them.
+	
+	Later directories take precedence over earlier ones. The imported
+	modules are returned too, as ``(manifest, { name: module })``, so that
+	they don't have to be imported again.'''
+	
+	manifest = { 'modules': {}, 'formatters': {} }
+	loaded = {}
+	for base_path in base_paths:
+		modules_path = os.path.join(base_path, 'modules')
+		for name in iter_plugins(modules_path):
+			mod = load_plugin(modules_path, name)
+			if not hasattr(mod, 'module'):
+				print(u"Ignoring invalid module (missing 'module' variable): {name}".format(name=name), file=sys.stderr)
+				continue
+			
+			try:
+				p = RecordingParser()
+				mod.module.register_arguments(p)
+				spec = p.spec()
+			except Exception:
+				spec = None
+			loaded[name.rstrip('_')] = mod.module
+			manifest['modules'][name.rstrip('_')] = { 'path': modules_path, 'file': name, 'help': mod.module.__doc__, 'spec': spec }
+		
+		formatters_path = os.path.join(base_path, 'formatters')
+		for name in iter_plugins(formatters_path):
+			manifest['formatters'][name.rstrip('_')] = { 'path': formatters_path, 'file': name }
+	return (manifest, loaded)
+
+def load(base_paths):
+	'''Returns the manifest for the given directories, building it if it's
+	missing or out of date, as ``(manifest, { name: module })``; the latter
+	holds any modules that had to be imported while building it.'''
+	
+	paths = [os.path.join(base_path, subdir) for base_path in base_paths for subdir in ('modules', 'formatters')]
+	sig = signature(paths)
+	
+	data = cache.get_entry(DIRNAME, MANIFEST)
+	if data:
+		try:
+			manifest = json.loads(data.decode('utf-8'))
+			if manifest['signature'] == json.loads(json.dumps(sig)):
+				return (manifest, {})
+		except (ValueError, KeyError):
+			pass
+	
+	manifest, loaded = build(base_paths)
+	manifest['signature'] = sig
+	cache.set_entry(DIRNAME, MANIFEST, json.dumps(manifest).encode('utf-8'))
+	return (manifest, loaded)
@@ -86,7 +86,24 @@ class Module(object):
 			return getattr(args, type(self).__name__ + '_mod').run(nodes, args)
 
 class Formatter(object):
-	'''Base class for all formatters.'''
+	'''Base class for all formatters.
+	
+	:ivar bool streaming: Set to True if :func:`run_iter` can format rows one at a time, letting output be printed as it's produced.
+	'''
+	
+	streaming = False
+	
+	def run_iter(self, data, args):
+		'''
+		Formats data from an iterator, yielding chunks of output as soon as
+		they're ready, to be written out as they are.
+		
+		The default implementation waits for all the data, then yields the
+		result of :func:`run`; formatters that can format rows independently
+		should override this, and set :attr:`streaming` to True.
+		'''
+		
+		yield self.run(list(data), args)
 	
 	def run(self, data, args):
 		'''
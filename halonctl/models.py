@@ -1,14 +1,23 @@
+'''Nodes and clusters.
+
+Creating nodes from the configuration doesn't need the network or SOAP stack,
+which take a good while to import; they're only imported once a node is
+actually contacted, so that eg. dry runs start quickly.
+'''
+
 from __future__ import print_function
 import six
-import socket
-import keyring
-import requests
-from threading import Lock
-from suds.client import Client
-from suds.transport.http import HttpAuthenticated
-from .proxies import *
-from .util import async_dispatch, nodesort, to_base64, from_base64
-from . import cache
+from .util import async_dispatch, nodesort, to_base64
+from .credentials import credentials
+
+def shared(s):
+	'''Returns an interned copy of a string, where possible; for strings that
+	most nodes have in common, like their scheme and username.'''
+	
+	try:
+		return six.moves.intern(s)
+	except TypeError:
+		return s
 
 
 
@@ -24,20 +33,23 @@ class Node(object):
 	:ivar str username: The effective username; the node's, if any, otherwise the cluster's
 	:ivar str password: The effective password; the node's or keychain's, if any, otherwise the cluster's
 	
+	Configurations can have tens of thousands of nodes, so they're kept
+	compact: there's no per-node ``__dict__``, and the SOAP client and call
+	proxy are only created once they're used.
 	'''
 	
-	name = u"noname"
-	cluster = None
-	scheme = 'http'
-	host = None
-	no_verify = False
-	
-	local_username = None
-	local_password = None
+	__slots__ = ('name', 'cluster', 'scheme', 'host', 'no_verify', 'local_username', 'local_password', '_client', '_service')
 	
-	session = requests.Session()
 	
 	
+	@property
+	def session(self):
+		'''The node's own kept-alive HTTP session.
+		
+		:rtype: :class:`halon.pool.NodeSession`
+		'''
+		from .pool import pool
+		return pool.get(self)
 	
 	@property
 	def service(self):
@@ -45,7 +57,10 @@ class Node(object):
 		
 		:rtype: :class:`halon.proxies.NodeSoapProxy`
 		'''
-		return NodeSoapProxy(self)
+		if self._service is None:
+			from .proxies import NodeSoapProxy
+			self._service = NodeSoapProxy(self)
+		return self._service
 	
 	@property
 	def url(self):
@@ -55,7 +70,10 @@ class Node(object):
 	
 	@property
 	def username(self):
-		return self.local_username or self.cluster.username
+		if self.local_username:
+			return self.local_username
+		resolved = credentials.get(self)
+		return resolved[0] if resolved else self.cluster.username
 	
 	@username.setter
 	def username(self, val):
@@ -63,7 +81,10 @@ class Node(object):
 	
 	@property
 	def password(self):
-		return self.local_password or self.keyring_password or self.cluster.password
+		if self.local_password:
+			return self.local_password
+		resolved = credentials.get(self)
+		return resolved[1] if resolved else self.keyring_password or self.cluster.password
 	
 	@password.setter
 	def password(self, val):
@@ -71,9 +92,7 @@ class Node(object):
 	
 	@property
 	def keyring_password(self):
-		if not hasattr(self, '_keyring_password') and self.host and self.username:
-			self._keyring_password = keyring.get_password(self.host, self.username)
-		return getattr(self, '_keyring_password', None)
+		return credentials.keyring_password(self.host, self.username)
 	
 	
 	
@@ -82,6 +101,13 @@ class Node(object):
 		
 		self.name = name
 		self.cluster = cluster if not cluster is None else NodeList([self])
+		self.scheme = 'http'
+		self.host = None
+		self.no_verify = False
+		self.local_username = None
+		self.local_password = None
+		self._client = None
+		self._service = None
 		
 		if data:
 			self.load_data(data)
@@ -98,7 +124,7 @@ class Node(object):
 		# Split out any scheme
 		parts = remainder.split('://', 1)
 		if len(parts) == 2:
-			self.scheme = parts[0]
+			self.scheme = shared(parts[0])
 			remainder = parts[1]
 		
 		# Split the host from the credentials
@@ -110,33 +136,42 @@ class Node(object):
 			# Credentials may or may not include the password
 			parts = remainder.split(':', 1)
 			if len(parts) == 2:
-				self.username = parts[0]
+				self.username = shared(parts[0])
 				self.password = parts[1]
 			else:
-				self.username = parts[0]
+				self.username = shared(parts[0])
 		else:
 			self.host = parts[0]
-		
+	
 	def load_wsdl(self):
-		'''Loads the cached WSDL file.
+		'''Creates the node's SOAP client from the cached WSDL file.
 		
-		This is called automatically the first time a SOAP call is attempted,
-		or you may call it yourself on startup to e.g. create a bunch of
-		clients at once over a bunch of threads.'''
+		This is called automatically the first time a SOAP call is attempted;
+		the WSDL itself is only parsed once, and shared between all nodes, see
+		:mod:`halonctl.wsdl`. Returns False if there's no WSDL for the node.'''
 		
-		if not hasattr(self, '_client'):
-			self._client = Client("file:{0}".format(cache.get_path('wsdl.xml')), location=self.url, faults=False, nosend=True)
-			self._client.set_options(cache=None)
+		if self._client is None:
+			from .wsdl import clients, wsdls
+			path = wsdls.node_path(self)
+			if path is None:
+				return False
+			self._client = clients.client(self.url, path)
+		return True
 	
 	def make_request(self, name_, *args, **kwargs):
 		'''Convenience function that creates a SOAP request context from a
 		function name and a set of parameters.
 		
 		The first call to this function is blocking, as the node's WSDL file
-		will be downloaded synchronously.'''
+		will be downloaded synchronously.
+		
+		Calls with only scalar parameters are built from precompiled envelope
+		templates, see :mod:`halonctl.envelopes`.'''
 		
-		self.load_wsdl()
-		return getattr(self._client.service, name_)(*args, **kwargs)
+		from .envelopes import envelopes
+		if not self.load_wsdl():
+			raise ValueError(u"There's no WSDL for {0}".format(self.name or self.host))
+		return envelopes.make_request(self._client, name_, args, kwargs)
 	
 	def command(self, command, *args, **kwargs):
 		'''Convenience function that executes a command on the node, and returns
@@ -158,6 +193,7 @@ class Node(object):
 		size = kwargs.get('size', (80, 24))
 		size = (kwargs.get('cols', size[0]), kwargs.get('rows', size[1]))
 		
+		from .proxies import CommandProxy
 		code, cid = self.service.commandRun(argv={'item': [to_base64(part) for part in parts]}, cols=size[0], rows=size[1])
 		return (200, CommandProxy(self, cid)) if code == 200 else (code, None)
 	
@@ -185,6 +221,7 @@ class NodeList(list):
 	name = None
 	local_username = None
 	local_password = None
+	concurrency = None
 	
 	
 	
@@ -198,8 +235,10 @@ class NodeList(list):
 	@property
 	def password(self):
 		if not self.local_password:
-			for node in [node for node in self if node.local_password or node.keyring_password]:
-				return node.password or node.keyring_password
+			for node in self:
+				password = node.local_password or node.keyring_password
+				if password:
+					return password
 		return self.local_password
 	
 	
@@ -214,6 +253,7 @@ class NodeList(list):
 		
 		:rtype: :class:`halon.proxies.NodeListSoapProxy`
 		'''
+		from .proxies import NodeListSoapProxy
 		return NodeListSoapProxy(self)
 	
 	def command(self, command, *args):
@@ -231,6 +271,8 @@ class NodeList(list):
 			self.local_username = data['username']
 		if 'password' in data:
 			self.local_password = data['password']
+		if 'concurrency' in data:
+			self.concurrency = data['concurrency']
 	
 	def __str__(self):
 		return u"{name} -> [{nodes}]".format(name=self.name, nodes=', '.join([node.name for node in self]))
@@ -4,6 +4,7 @@ import getpass
 import keyring
 from halonctl.modapi import Module
 from halonctl.util import ask_confirm
+from halonctl.credentials import credentials
 
 class KeyringStatusModule(Module):
 	'''Checks the authorization status of all nodes'''
@@ -51,6 +52,7 @@ class KeyringLoginModule(Module):
 					code = node.service.login()[0]
 					if code == 200:
 						keyring.set_password(node.host, node.username, password)
+						credentials.stored(node.host, node.username, password)
 						break
 					elif code == 401:
 						print(u"Invalid login, try again")
@@ -69,14 +71,21 @@ class KeyringLogoutModule(Module):
 	def register_arguments(self, parser):
 		parser.add_argument('-y', '--yes', action='store_true',
 			help=u"don't ask for each node")
+		parser.add_argument('--flush', action='store_true',
+			help=u"only drop passwords cached by the agent, keeping them in the keyring")
 	
 	def run(self, nodes, args):
+		if args.flush:
+			credentials.flush([(node.host, node.username) for node in nodes if node.username])
+			return
+		
 		for node in nodes:
 			if not keyring.get_password(node.host, node.username):
 				continue
 			
 			if args.yes or ask_confirm(u"Log out from {cluster} / {name} ({host})?".format(cluster=node.cluster.name, name=node.name, host=node.host)):
 				keyring.delete_password(node.host, node.username)
+				credentials.stored(node.host, node.username, None)
 
 class KeyringModule(Module):
 	'''Manages the keyring (credential store)'''
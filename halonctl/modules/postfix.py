@@ -2,6 +2,7 @@ import six
 import argparse
 from time import time
 from halonctl.modapi import Module
+from halonctl.streaming import MAIL_TYPES
 
 class PostfixQshapeModule(Module):
 	'''Simulate postfix's qshape command'''
@@ -18,13 +19,13 @@ class PostfixQshapeModule(Module):
 		field = 'msgfrom' if args.sender else 'msgto'
 		while True:
 			askMore = False
-			for node, (code, result) in six.iteritems(nodes.service.mailQueue(filter='action=DELIVER', offset=offset, limit=limit, options=None)):
+			for node, (code, result) in six.iteritems(nodes.service.stream(MAIL_TYPES).mailQueue(filter='action=DELIVER', offset=offset, limit=limit, options=None)):
 				if code != 200:
 					self.partial = True
-				elif 'item' in result['result']:
-					if len(result['result']['item']) == limit:
-						askMore = True
-					for msg in result['result']['item']:
+				else:
+					count = 0
+					for msg in result:
+						count += 1
 						minutes = int(t - getattr(msg, 'msgts0', None)) / 60
 						domain = getattr(msg, field, None)
 						domain = domain.split('@')[1] if domain else '<MAILER-DAEMON>'
@@ -47,6 +48,8 @@ class PostfixQshapeModule(Module):
 							stats[domain]['1440'].append(email)
 						else:
 							stats[domain]['1440+'].append(email)
+					if count == limit:
+						askMore = True
 			if not askMore:
 				break
 			offset = offset + limit
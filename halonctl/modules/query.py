@@ -4,6 +4,7 @@ import argparse
 from halonctl.modapi import Module
 from halonctl.util import hql_from_filters, filter_timestamp_re, ask_confirm, from_base64
 from halonctl.roles import UTCDate
+from halonctl.streaming import MAIL_TYPES
 
 class QueryModule(Module):
 	'''Queries emails and performs actions'''
@@ -120,15 +121,18 @@ class QueryModule(Module):
 		if not args.count:
 			yield fields
 		
-		source = getattr(nodes.service, 'mailHistory' if args.history else 'mailQueue')
+		# Messages are parsed as they arrive, rather than all at once, and each
+		# node's are shown as soon as all nodes before it have answered
+		service = nodes.service if args.count else nodes.service.stream(MAIL_TYPES)
+		source = getattr(service.in_order(), 'mailHistory' if args.history else 'mailQueue')
 		totalhits = 0
-		for node, (code, result) in six.iteritems(source(filter=hql, offset=args.offset or None, limit=args.limit or 100, options={'totalhits': True} if args.count else None)):
+		for node, (code, result) in source(filter=hql, offset=args.offset or None, limit=args.limit or 100, options={'totalhits': True} if args.count else None):
 			if code != 200:
 				self.partial = True
 			elif args.count:
 				totalhits += result['totalhits']
-			elif 'item' in result['result']:
-				for msg in result['result']['item']:
+			else:
+				for msg in result:
 					p = []
 					for f in fields:
 						if f == 'action': p.append(getattr(msg, 'msgaction', None))
@@ -4,10 +4,11 @@ import re
 from collections import OrderedDict
 from halonctl.modapi import Module
 from halonctl.roles import UTCDate
+from halonctl.streaming import STAT_TYPES, UnexpectedReply
 
 class StatModule(Module):
 	'''Reads stat counters'''
-
+	
 	def register_arguments(self, parser):
 		parser.add_argument('-s', '--sum', action='store_true',
 			help=u"print only the sum of all nodes")
@@ -76,17 +77,17 @@ class StatModule(Module):
 		sum_ = 0
 		subs = { '.': None, '-': '' }
 		keys = [k if k not in subs else subs[k] for k in args.key]
-		for node, (code, result) in six.iteritems(nodes.service.statList(*keys, limit=10000)):
+		for node, (code, result) in six.iteritems(nodes.service.stream(STAT_TYPES).statList(*keys, limit=10000)):
 			if code != 200:
 				self.partial = True
 				continue
 			
-			if hasattr(result, 'item'):
-				for res in result.item:
+			try:
+				for res in result:
 					sum_ += res.count
 					if not args.sum:
 						yield (node, res.key1, res.key2, res.key3, res.count, UTCDate(res.updated), UTCDate(res.created))
-			elif result:
+			except UnexpectedReply:
 				self.exitcode = 1
 				continue
 		
@@ -10,7 +10,8 @@ class StatusModule(Module):
 	def run(self, nodes, args):
 		yield (u"Cluster", u"Name", u"Address", u"Uptime", u"Status")
 		
-		for node, (code, result) in six.iteritems(nodes.service.getUptime()):
+		# Show each node as soon as it and all nodes before it have answered
+		for node, (code, result) in nodes.service.in_order().getUptime():
 			if code != 200:
 				self.partial = True
 			
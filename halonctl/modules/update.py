@@ -2,6 +2,7 @@ from __future__ import print_function
 import six
 from halonctl.modapi import Module
 from halonctl.util import ask_confirm
+from halonctl.proxies import calls
 from halonctl.roles import StatusCode, HTTPStatus
 
 class UpdateStatusCode(StatusCode):
@@ -23,14 +24,12 @@ class UpdateStatusModule(Module):
 	def run(self, nodes, args):
 		yield (u"Cluster", u"Name", u"Address", u"Version", u"Update Status")
 		
-		versions = nodes.service.getVersion()
-		
-		for node, (code, result) in six.iteritems(nodes.service.updateDownloadStatus()):
+		for node, ((_, version), (code, result)) in six.iteritems(nodes.service.chain(calls.getVersion(), calls.updateDownloadStatus())):
 			if code != 200 and code != 500:
 				self.partial = True
 			
 			status = UpdateStatusCode(int(result) if code == 200 else None)
-			yield (node.cluster, node, node.host, versions[node][1], status)
+			yield (node.cluster, node, node.host, version, status)
 
 class UpdateDownloadModule(Module):
 	'''Downloads an available update'''
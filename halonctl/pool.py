@@ -0,0 +1,168 @@
+from __future__ import print_function
+import six
+import sys
+import time
+import requests
+from threading import Lock
+from requests.adapters import HTTPAdapter
+from .config import config
+from .compression import ACCEPT_ENCODING
+from .tls import sessions as tls_sessions
+from .util import DEFAULT_IDLE_TIMEOUT
+
+DEFAULT_POOL_SIZE = 4
+
+class PoolStats(object):
+	'''Connection reuse counters for a single node.
+	
+	:ivar int hits: Requests that were sent over an already open connection
+	:ivar int misses: Requests that had to open a new connection
+	'''
+	
+	def __init__(self, hits=0, misses=0):
+		self.hits = hits
+		self.misses = misses
+	
+	@property
+	def requests(self):
+		return self.hits + self.misses
+	
+	def __add__(self, other):
+		return PoolStats(self.hits + other.hits, self.misses + other.misses)
+	
+	def __repr__(self):
+		return "PoolStats(hits={0}, misses={1})".format(self.hits, self.misses)
+
+class NodeAdapter(HTTPAdapter):
+	'''An :class:`HTTPAdapter` whose connections share an SSL context, so that
+	TLS sessions can be resumed (see :mod:`halonctl.tls`).'''
+	
+	def __init__(self, ssl_context=None, **kwargs):
+		self.ssl_context = ssl_context
+		super(NodeAdapter, self).__init__(**kwargs)
+	
+	def init_poolmanager(self, *args, **kwargs):
+		if self.ssl_context is not None:
+			kwargs['ssl_context'] = self.ssl_context
+		super(NodeAdapter, self).init_poolmanager(*args, **kwargs)
+
+class NodeSession(requests.Session):
+	'''A kept-alive HTTP session dedicated to a single node.
+	
+	Unlike a plain :class:`requests.Session`, which pools connections for up
+	to 10 hosts and evicts the least recently used one beyond that, this only
+	ever talks to a single host, and keeps up to ``pool_size`` connections to
+	it open between calls.
+	
+	Connections that have been idle for longer than ``idle_timeout`` seconds
+	are dropped before the next request, rather than risking a request on a
+	connection the node has already closed on its end.
+	'''
+	
+	def __init__(self, pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT, ssl_context=None):
+		super(NodeSession, self).__init__()
+		self.pool_size = pool_size
+		self.idle_timeout = idle_timeout
+		self.last_used = None
+		self.retired = PoolStats()
+		self.lock = Lock()
+		
+		self.headers['Accept-Encoding'] = ACCEPT_ENCODING
+		
+		adapter = NodeAdapter(ssl_context, pool_connections=1, pool_maxsize=pool_size)
+		self.mount('http://', adapter)
+		self.mount('https://', adapter)
+	
+	@property
+	def stats(self):
+		'''Connection reuse counters, including any dropped connections.
+		
+		:rtype: :class:`PoolStats`
+		'''
+		return self.retired + self._live_stats()
+	
+	def request(self, *args, **kwargs):
+		with self.lock:
+			now = time.time()
+			if self.idle_timeout and self.last_used and now - self.last_used > self.idle_timeout:
+				self.drop_connections()
+			self.last_used = now
+		
+		return super(NodeSession, self).request(*args, **kwargs)
+	
+	def drop_connections(self):
+		'''Closes all open connections, keeping their counters around.'''
+		
+		self.retired += self._live_stats()
+		for adapter in set(self.adapters.values()):
+			adapter.close()
+	
+	def _live_stats(self):
+		stats = PoolStats()
+		for adapter in set(self.adapters.values()):
+			for key in list(adapter.poolmanager.pools.keys()):
+				p = adapter.poolmanager.pools.get(key)
+				if p is not None:
+					stats += PoolStats(p.num_requests - p.num_connections, p.num_connections)
+		return stats
+
+class SessionPool(object):
+	'''Hands out one :class:`NodeSession` per node.
+	
+	Sessions are keyed by scheme and host, so that several node entries
+	pointing to the same machine share their connections. Pool sizes and idle
+	timeouts are read from the ``pool_size`` and ``pool_idle_timeout``
+	configuration keys the first time a node's session is requested.
+	
+	Sessions for nodes with the same ``verify_ssl`` setting share an SSL
+	context, and with it, resumable TLS sessions.
+	'''
+	
+	def __init__(self):
+		self.sessions = {}
+		self.lock = Lock()
+	
+	def get(self, node):
+		'''Returns the session for the given node, creating it if needed.
+		
+		:rtype: :class:`NodeSession`
+		'''
+		
+		key = (node.scheme, node.host)
+		session = self.sessions.get(key)
+		if session is None:
+			with self.lock:
+				session = self.sessions.get(key)
+				if session is None:
+					session = NodeSession(
+						pool_size=config.get('pool_size', DEFAULT_POOL_SIZE),
+						idle_timeout=config.get('pool_idle_timeout', DEFAULT_IDLE_TIMEOUT),
+						ssl_context=tls_sessions.context(False if node.no_verify else config.get('verify_ssl', True), requests.certs.where())
+					)
+					self.sessions[key] = session
+		return session
+	
+	def stats(self):
+		'''Returns connection reuse counters for every node contacted so far,
+		as a dictionary of ``{ (scheme, host): PoolStats }``.'''
+		
+		return { key: session.stats for key, session in six.iteritems(self.sessions) }
+	
+	def print_stats(self, file=sys.stderr):
+		'''Prints a short connection reuse summary.'''
+		
+		total = PoolStats()
+		for (scheme, host), stats in sorted(six.iteritems(self.stats())):
+			total += stats
+			print(u"{scheme}://{host}: {s.requests} requests, {s.hits} reused, {s.misses} new connections".format(scheme=scheme, host=host, s=stats), file=file)
+		print(u"Total: {s.requests} requests, {s.hits} reused, {s.misses} new connections".format(s=total), file=file)
+	
+	def clear(self):
+		'''Closes and forgets all sessions.'''
+		
+		with self.lock:
+			for session in six.itervalues(self.sessions):
+				session.close()
+			self.sessions.clear()
+
+pool = SessionPool()
@@ -1,14 +1,50 @@
 from __future__ import print_function
 import six
 import sys
+import time
 import signal
 import inspect
-import requests
-from halonctl.util import async_dispatch, nodesort, from_base64, to_base64, print_ssl_error
+from types import MethodType
+from halonctl.util import async_dispatch, iter_dispatch, nodesort, from_base64, to_base64, print_ssl_error, DEFAULT_TIMEOUT
 from halonctl.config import config
+from halonctl.streaming import iter_records
+from halonctl.breaker import breakers
+from halonctl.responses import responses
+from halonctl.compression import should_compress, compress, method_name, transfers
+from halonctl.capture import captures
 
 
 
+def uses_asyncio():
+	'''Returns whether the asyncio transport is selected, rather than the
+	default thread pool.'''
+	
+	return config.get('engine', 'threads') == 'asyncio'
+
+class Call(object):
+	'''A SOAP call waiting to be made, as part of a chain; see
+	:func:`NodeSoapProxy.chain`.'''
+	
+	def __init__(self, name_, args, kwargs):
+		self.name = name_
+		self.args = args
+		self.kwargs = kwargs
+	
+	def __repr__(self):
+		return "Call({0!r}, {1!r}, {2!r})".format(self.name, self.args, self.kwargs)
+
+class CallBuilder(object):
+	'''Describes SOAP calls without making them; ``calls.getVersion()``
+	returns a :class:`Call`, which can be passed to :func:`NodeSoapProxy.chain`
+	or :func:`NodeListSoapProxy.chain`.'''
+	
+	def __getattr__(self, name_):
+		def _call_builder(*args, **kwargs):
+			return Call(name_, args, kwargs)
+		return _call_builder
+
+calls = CallBuilder()
+
 class NodeSoapProxy(object):
 	'''SOAP call proxy.
 	
@@ -27,31 +63,202 @@ class NodeSoapProxy(object):
 		print(response)
 	'''
 	
+	__slots__ = ('node',)
+	
+	#: Executors for the methods called so far, shared by all proxies
+	executors = {}
+	
 	def __init__(self, node):
 		self.node = node
 	
+	def make_request(self, name_, args, kwargs):
+		'''Creates a SOAP request context for a call on the node, or returns
+		None if there's no WSDL for it; eg. if it's never been reachable.'''
+		
+		if not self.node.load_wsdl():
+			return None
+		
+		# Allow params to constructed by lambda expressions
+		args = [ a(self.node) if callable(a) else a for a in args ]
+		kwargs = { k: a(self.node) if callable(a) else a for k, a in six.iteritems(kwargs) }
+		
+		return self.node.make_request(name_, *args, **kwargs)
+	
 	def __getattr__(self, name_):
-		def _soap_proxy_executor(*args, **kwargs):
-			# Allow params to constructed by lambda expressions
-			args = [ a(self.node) if callable(a) else a for a in args ]
-			kwargs = { k: a(self.node) if callable(a) else a for k, a in six.iteritems(kwargs) }
-			
-			context = self.node.make_request(name_, *args, **kwargs)
-			try:
-				r = self.node.session.post(context.client.location(),
-					auth=(self.node.username, self.node.password),
-					headers=context.client.headers(), data=context.envelope,
-					timeout=10,
-					verify=False if self.node.no_verify else config.get('verify_ssl', True)
-				)
+		# Nodes keep their proxies, so rather than a new executor for every
+		# call, there's one per method, bound to whichever proxy it's used on
+		executor = NodeSoapProxy.executors.get(name_)
+		if executor is None:
+			def _soap_proxy_executor(self, *args, **kwargs):
+				context = self.make_request(name_, args, kwargs)
+				if context is None:
+					return (0, None)
+				if uses_asyncio():
+					from .aio import engine
+					return engine.call(self.node, context)
+				
+				cached = responses.get(self.node, name_, context.envelope)
+				if cached:
+					return context.process_reply(*cached)
+				
+				# Whether or not the call goes through, the node may have acted on it
+				responses.invalidate(self.node, name_)
+				r = self.post(context)
+				if r is None:
+					return (0, None)
+				
+				transfers.received(self.node, name_, r.raw.tell() or len(r.content), len(r.content))
+				responses.set(self.node, name_, context.envelope, r.content, r.status_code, r.reason)
 				return context.process_reply(r.content, r.status_code, r.reason)
-			except requests.exceptions.SSLError:
-				print_ssl_error(self.node)
-				sys.exit(1)
-			except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+			
+			executor = NodeSoapProxy.executors.setdefault(name_, _soap_proxy_executor)
+		return MethodType(executor, self)
+	
+	def chain(self, *calls):
+		'''Makes a number of calls back-to-back, returning a list of their
+		``(status, response)`` tuples, in order.
+		
+		If the node can't be reached, the remaining calls aren't attempted,
+		and their results are ``(0, None)`` as well.
+		
+		Example::
+		
+			from halonctl.proxies import calls
+			
+			(code1, version), (code2, status) = node.service.chain(calls.getVersion(), calls.updateDownloadStatus())
+		'''
+		
+		if uses_asyncio():
+			from .aio import engine
+			return engine.chain({ self.node: [self.make_request(c.name, c.args, c.kwargs) for c in calls] })[self.node]
+		
+		results = []
+		for c in calls:
+			if results and results[-1][0] == 0:
+				results.append((0, None))
+			else:
+				results.append(getattr(self, c.name)(*c.args, **c.kwargs))
+		return results
+	
+	def post(self, context, stream=False):
+		'''Sends a request context to the node, and returns the response, or
+		None if the node couldn't be reached.
+		
+		Large requests are compressed if enabled, see
+		:mod:`halonctl.compression`, and nodes that have recently been
+		unreachable fail immediately, see :mod:`halonctl.breaker`. Calls are
+		recorded to, or answered from, a capture file if one is in use, see
+		:mod:`halonctl.capture`.'''
+		
+		import requests
+		
+		# Replayed calls never reach the node, nor tell whether it's up
+		if not captures.replaying and not breakers.allow(self.node):
+			return None
+		
+		method = method_name(context)
+		headers = dict(context.client.headers())
+		body = context.envelope
+		raw_size = len(body)
+		if should_compress(body):
+			body = compress(body)
+			headers['Content-Encoding'] = 'gzip'
+		transfers.sent(self.node, method, len(body), raw_size)
+		
+		if captures.replaying:
+			return captures.response(self.node, method, context.envelope, context.client.location())
+		
+		started = time.time()
+		try:
+			r = self.node.session.post(context.client.location(),
+				auth=(self.node.username, self.node.password),
+				headers=headers, data=body,
+				timeout=config.get('timeout', DEFAULT_TIMEOUT), stream=stream or captures.recording,
+				verify=False if self.node.no_verify else config.get('verify_ssl', True)
+			)
+			if captures.recording:
+				r = captures.record_response(self.node, method, context.envelope, r, started)
+		except requests.exceptions.SSLError:
+			print_ssl_error(self.node)
+			sys.exit(1)
+		except requests.exceptions.ConnectionError:
+			captures.record(self.node, method, context.envelope, None, started)
+			breakers.record(self.node, False)
+			return None
+		except requests.exceptions.Timeout:
+			# The node is up, it's just slow to answer this call
+			captures.record(self.node, method, context.envelope, None, started)
+			breakers.record(self.node, True)
+			return None
+		
+		breakers.record(self.node, True)
+		return r
+	
+	def stream(self, types={}):
+		'''Returns a proxy that parses replies incrementally.
+		
+		:param dict types: Field types, see :func:`halonctl.streaming.to_value`
+		:rtype: :class:`StreamingSoapProxy`
+		'''
+		return StreamingSoapProxy(self.node, types)
+
+class StreamingSoapProxy(NodeSoapProxy):
+	'''SOAP call proxy for calls with large replies.
+	
+	Rather than parsing the whole reply into suds objects, successful calls
+	return a tuple of ``( status, records )``, where ``records`` is an
+	iterator over the items in the reply's result array, parsed as they're
+	read off the wire. Failed calls return the usual ``( status, response )``.
+	
+	Example::
+	
+		code, messages = node.service.stream(MAIL_TYPES).mailQueue(limit=10000)
+		if code == 200:
+			for msg in messages:
+				print(msg.msgfrom)
+	
+	Iterate through the records before making another call to the same
+	node, or the call will need a connection of its own.
+	
+	These calls are always made with the ``threads`` engine, even if the
+	``asyncio`` engine is selected, since records are read off the wire by
+	whichever thread iterates over them.
+	'''
+	
+	__slots__ = ('types',)
+	
+	def __init__(self, node, types={}):
+		super(StreamingSoapProxy, self).__init__(node)
+		self.types = types
+	
+	def __getattr__(self, name_):
+		def _soap_proxy_executor(*args, **kwargs):
+			context = self.make_request(name_, args, kwargs)
+			if context is None:
+				return (0, None)
+			r = self.post(context, stream=True)
+			if r is None:
 				return (0, None)
+			elif r.status_code != 200:
+				return context.process_reply(r.content, r.status_code, r.reason)
+			return (200, self.iter_reply(name_, r))
 		
 		return _soap_proxy_executor
+	
+	def iter_reply(self, name_, r):
+		r.raw.decode_content = True
+		f = CountingReader(r.raw)
+		try:
+			for record in iter_records(f, self.types):
+				yield record
+			
+			# Drain the connection, so it can be reused
+			f.read()
+			r.raw.release_conn()
+			transfers.received(self.node, name_, r.raw.tell() or f.count, f.count)
+		except BaseException:
+			r.close()
+			raise
 
 class NodeListSoapProxy(object):
 	'''Multi-node SOAP call proxy.
@@ -79,11 +286,130 @@ class NodeListSoapProxy(object):
 	def __init__(self, nodelist):
 		self.nodelist = nodelist
 	
+	def stream(self, types={}):
+		'''Returns a proxy that parses replies incrementally; see
+		:class:`StreamingSoapProxy`.
+		
+		Each node's call is made asynchronously, as usual, but their replies
+		are only read as their records are iterated over.
+		
+		:param dict types: Field types, see :func:`halonctl.streaming.to_value`
+		:rtype: :class:`StreamingNodeListSoapProxy`
+		'''
+		return StreamingNodeListSoapProxy(self.nodelist, types)
+	
+	def as_completed(self):
+		'''Returns a proxy whose calls return an iterator over ``(node,
+		(status, response))`` tuples, yielding each node's result as soon as
+		it's answered, rather than waiting for the slowest one.
+		
+		Example::
+		
+			for node, (code, result) in nodes.service.as_completed().getUptime():
+				print(node, result)
+		
+		:rtype: :class:`IteratingNodeListSoapProxy`
+		'''
+		return IteratingNodeListSoapProxy(self, ordered=False)
+	
+	def in_order(self):
+		'''Like :func:`as_completed`, but yields results in the usual
+		:func:`halonctl.util.nodesort` order; each one as soon as it and all
+		nodes before it have answered.
+		
+		:rtype: :class:`IteratingNodeListSoapProxy`
+		'''
+		return IteratingNodeListSoapProxy(self, ordered=True)
+	
+	def node_proxy(self, node):
+		'''Returns the proxy used to make a call on a single node.'''
+		return node.service
+	
+	def iter_call(self, name_, args, kwargs, order=None):
+		'''Makes a call on every node, returning an iterator over the results;
+		see :func:`halonctl.util.iter_dispatch`.'''
+		
+		if uses_asyncio():
+			from .aio import engine
+			return engine.iter_dispatch({node: node.service.make_request(name_, args, kwargs) for node in self.nodelist}, order)
+		return iter_dispatch({node: (getattr(self.node_proxy(node), name_), args, kwargs) for node in self.nodelist}, order)
+	
+	def chain(self, *calls):
+		'''Makes a chain of calls on every node; see
+		:func:`NodeSoapProxy.chain`.
+		
+		Each node's calls are made back-to-back, independently of the other
+		nodes, so this takes as long as the slowest node takes to answer all of
+		them, rather than the sum of the slowest answers to each call.
+		
+		Returns a dictionary of ``{ node: [(status, response), ...] }``.
+		'''
+		
+		if uses_asyncio():
+			from .aio import engine
+			return nodesort(engine.chain({ node: [node.service.make_request(c.name, c.args, c.kwargs) for c in calls] for node in self.nodelist }))
+		return nodesort(async_dispatch({ node: (node.service.chain, calls) for node in self.nodelist }))
+	
 	def __getattr__(self, name_):
 		def _soap_proxy_executor(*args, **kwargs):
+			if uses_asyncio():
+				from .aio import engine
+				return nodesort(engine.dispatch({node: node.service.make_request(name_, args, kwargs) for node in self.nodelist}))
 			return nodesort(async_dispatch({node: (getattr(node.service, name_), args, kwargs) for node in self.nodelist}))
 		return _soap_proxy_executor
 
+class CountingReader(object):
+	'''Wraps a file-like object, counting the bytes read from it.'''
+	
+	def __init__(self, f):
+		self.f = f
+		self.count = 0
+	
+	def read(self, *args):
+		data = self.f.read(*args)
+		self.count += len(data)
+		return data
+
+class StreamingNodeListSoapProxy(NodeListSoapProxy):
+	'''Multi-node version of :class:`StreamingSoapProxy`.
+	
+	Returns a dictionary of ``{ node: (status, records) }``.
+	'''
+	
+	def __init__(self, nodelist, types={}):
+		super(StreamingNodeListSoapProxy, self).__init__(nodelist)
+		self.types = types
+	
+	def node_proxy(self, node):
+		return node.service.stream(self.types)
+	
+	def iter_call(self, name_, args, kwargs, order=None):
+		return iter_dispatch({node: (getattr(self.node_proxy(node), name_), args, kwargs) for node in self.nodelist}, order)
+	
+	def __getattr__(self, name_):
+		def _soap_proxy_executor(*args, **kwargs):
+			return nodesort(async_dispatch({node: (getattr(self.node_proxy(node), name_), args, kwargs) for node in self.nodelist}))
+		return _soap_proxy_executor
+
+class IteratingNodeListSoapProxy(object):
+	'''Multi-node SOAP call proxy, returning results as they arrive; see
+	:func:`NodeListSoapProxy.as_completed` and
+	:func:`NodeListSoapProxy.in_order`.
+	
+	Calls are all sent right away, but results are only yielded as they're
+	iterated over.
+	'''
+	
+	def __init__(self, proxy, ordered=False):
+		self.proxy = proxy
+		self.ordered = ordered
+	
+	def __getattr__(self, name_):
+		def _soap_proxy_executor(*args, **kwargs):
+			order = nodesort(self.proxy.nodelist) if self.ordered else None
+			return self.proxy.iter_call(name_, args, kwargs, order)
+		return _soap_proxy_executor
+
 class CommandProxy(six.Iterator):
 	'''Proxy for a command executing on a remote server.
 	
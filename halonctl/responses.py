@@ -0,0 +1,161 @@
+'''Caching of read-only SOAP calls between runs.
+
+Scripts that run ``halonctl`` every minute keep asking for things that
+hardly ever change, like a node's version or configuration keys. With
+``"response_cache": true`` in the configuration, successful replies to
+read-only calls are kept on disk (see :mod:`halonctl.cache`) for a while,
+and reused as long as the same call is made to the same node, with the same
+arguments, as the same user with the same password.
+
+How long replies are kept is set per method; ``response_cache`` can also be
+a dictionary of ``{ "method": seconds }``, overriding or adding to
+:data:`DEFAULT_TTLS`. Calls that change something on a node drop the
+replies they'd affect, see :data:`INVALIDATES`, and ``--no-cache`` bypasses
+the cache altogether.
+'''
+
+from __future__ import print_function
+import six
+import sys
+import json
+import time
+import hashlib
+from threading import Lock
+from xml.etree.ElementTree import fromstring, ParseError
+from . import cache
+from .config import config
+
+#: How many seconds replies to read-only methods are kept by default
+DEFAULT_TTLS = {
+	'getVersion': 600,
+	'getSerial': 3600,
+	'getUptime': 120,
+	'configKeys': 300,
+	'updateDownloadStatus': 60,
+}
+
+#: Methods that don't change anything on a node, and can safely be sent again
+READ_ONLY = set(DEFAULT_TTLS) | set(['login', 'mailQueue', 'mailHistory', 'statList'])
+
+#: Cached methods whose replies are dropped when a method is called
+INVALIDATES = {
+	'configKeySet': ['configKeys'],
+	'updateDownloadStart': ['updateDownloadStatus'],
+	'updateDownloadCancel': ['updateDownloadStatus'],
+	'updateInstall': ['updateDownloadStatus', 'getVersion', 'getUptime'],
+}
+
+DIRNAME = u"responses"
+
+def digest(*parts):
+	h = hashlib.sha1()
+	for part in parts:
+		h.update(part if isinstance(part, six.binary_type) else six.text_type(part).encode('utf-8'))
+		h.update(b'\0')
+	return h.hexdigest()
+
+def canonical(envelope):
+	'''Returns a representation of a request envelope that doesn't depend on
+	the namespace prefixes suds happened to pick for it, which vary between
+	runs.'''
+	
+	try:
+		return repr(flatten(fromstring(envelope)))
+	except ParseError:
+		return envelope
+
+def flatten(elem):
+	# Prefixed attribute values, like xsi:type="ns0:string", lose their prefix
+	attrib = sorted((k, v.rsplit(':', 1)[-1]) for k, v in six.iteritems(elem.attrib))
+	return (elem.tag, attrib, (elem.text or u"").strip(), [flatten(child) for child in elem])
+
+class ResponseCache(object):
+	'''Stores and looks up raw replies to SOAP calls.
+	
+	:ivar bool bypass: Set to True to neither read nor write cached replies
+	'''
+	
+	def __init__(self):
+		self.bypass = False
+		self.hits = 0
+		self.misses = 0
+		self.lock = Lock()
+	
+	@property
+	def enabled(self):
+		return not self.bypass and bool(config.get('response_cache', False))
+	
+	def ttl(self, method):
+		'''Returns how long replies to a method may be kept, or None if the
+		method isn't cached.'''
+		
+		ttls = config.get('response_cache')
+		if isinstance(ttls, dict) and method in ttls:
+			return ttls[method]
+		return DEFAULT_TTLS.get(method)
+	
+	def prefix(self, node, method):
+		return u"{node}_{method}_".format(node=digest(node.scheme, node.host)[:16], method=method)
+	
+	def entry_name(self, node, method, envelope):
+		# Keyed by the password too, so a wrong one never gets a cached reply
+		# that was fetched with the right one
+		return self.prefix(node, method) + digest(node.username, digest(node.password or u""), canonical(envelope))
+	
+	def get(self, node, method, envelope):
+		'''Returns a cached reply to a call, as ``(body, status, reason)``, or
+		None if there's no fresh one.'''
+		
+		ttl = self.ttl(method)
+		if not self.enabled or not ttl:
+			return None
+		
+		data = cache.get_entry(DIRNAME, self.entry_name(node, method, envelope))
+		reply = None
+		if data:
+			header, _, body = data.partition(b'\n')
+			try:
+				meta = json.loads(header.decode('utf-8'))
+				if time.time() - meta['stored'] < ttl:
+					reply = (body, meta['status'], meta['reason'])
+			except (ValueError, KeyError):
+				pass
+		
+		with self.lock:
+			if reply:
+				self.hits += 1
+			else:
+				self.misses += 1
+		return reply
+	
+	def set(self, node, method, envelope, body, status, reason):
+		'''Stores a successful reply to a read-only call.'''
+		
+		if not self.enabled or not self.ttl(method) or status != 200:
+			return
+		
+		header = json.dumps({ 'stored': time.time(), 'status': int(status), 'reason': reason })
+		cache.set_entry(DIRNAME, self.entry_name(node, method, envelope), header.encode('utf-8') + b'\n' + body)
+	
+	def invalidate(self, node, method):
+		'''Drops any cached replies a call to a method would affect; called
+		before the call is made, since a call that times out may still have
+		reached the node.
+		
+		This is done even when the cache is bypassed, so that later runs
+		won't see stale replies.'''
+		
+		for affected in INVALIDATES.get(method, []):
+			cache.remove_entries(DIRNAME, self.prefix(node, affected))
+	
+	def clear(self):
+		'''Drops all cached replies.'''
+		cache.remove_entries(DIRNAME)
+	
+	def print_stats(self, file=sys.stderr):
+		'''Prints cache hit counters, if the cache was used.'''
+		
+		if self.hits or self.misses:
+			print(u"Response cache: {0} hits, {1} misses".format(self.hits, self.misses), file=file)
+
+responses = ResponseCache()
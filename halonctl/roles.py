@@ -1,6 +1,4 @@
 import six
-import arrow
-from dateutil import tz
 
 @six.python_2_unicode_compatible
 class Role(object):
@@ -145,4 +143,6 @@ class UTCDate(Role):
 		return self.timestamp
 	
 	def human(self):
+		import arrow
+		from dateutil import tz
 		return str(arrow.get(arrow.get(self.timestamp).naive, tz.tzoffset(None, self.timezone * 3600 if self.timezone else 0)))
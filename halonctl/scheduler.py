@@ -0,0 +1,166 @@
+'''Thread pool scheduling, with per-node and per-cluster concurrency limits.
+
+Calls to many nodes are made from a shared thread pool, which is only
+created the first time it's needed, with ``max_workers`` threads (64 by
+default). On top of that, ``node_concurrency`` and ``cluster_concurrency``
+limit how many calls may be in flight to a single node or cluster at once;
+calls beyond that are held back, without tying up a worker thread, until
+an earlier one finishes. Clusters may also set their own ``concurrency``.
+
+The time every call spends waiting for a worker thread or for a free slot
+is recorded, and printed with ``--stats``.
+'''
+
+from __future__ import print_function
+import six
+import sys
+import time
+from collections import deque
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, Future
+from .config import config
+
+DEFAULT_MAX_WORKERS = 64
+
+class WaitStats(object):
+	'''Queue wait time counters for a single node.
+	
+	:ivar int calls: The number of calls made
+	:ivar float total: The total time calls spent waiting, in seconds
+	:ivar float max: The longest time a single call spent waiting
+	'''
+	
+	def __init__(self):
+		self.calls = 0
+		self.total = 0.0
+		self.max = 0.0
+	
+	@property
+	def average(self):
+		return self.total / self.calls if self.calls else 0.0
+
+def limits(node):
+	'''Returns the concurrency limits that apply to a node, as a list of
+	``(key, limit)`` tuples; empty if the node is unrestricted.'''
+	
+	result = []
+	cluster = getattr(node, 'cluster', None)
+	if cluster is not None and cluster.name:
+		limit = getattr(cluster, 'concurrency', None) or config.get('cluster_concurrency')
+		if limit:
+			result.append((('cluster', cluster.name), limit))
+	limit = config.get('node_concurrency')
+	if limit and hasattr(node, 'host'):
+		result.append((('node', node.scheme, node.host), limit))
+	return result
+
+class Scheduler(object):
+	'''A lazily created thread pool that enforces concurrency limits.
+	
+	Quacks like a :class:`concurrent.futures.Executor` as far as
+	:func:`submit` goes; :func:`submit_for` is the same, but for a call to a
+	specific node.
+	'''
+	
+	def __init__(self):
+		self.pool = None
+		self.lock = Lock()
+		self.running = {}
+		self.pending = {}
+		self.waits = {}
+	
+	def get_pool(self):
+		'''Returns the underlying thread pool, creating it if needed.'''
+		
+		if self.pool is None:
+			with self.lock:
+				if self.pool is None:
+					self.pool = ThreadPoolExecutor(config.get('max_workers', DEFAULT_MAX_WORKERS))
+		return self.pool
+	
+	def submit(self, fn, *args, **kwargs):
+		return self.submit_for(None, fn, *args, **kwargs)
+	
+	def submit_for(self, node, fn, *args, **kwargs):
+		'''Schedules a call to a node, returning a future for its result.
+		
+		If the node is None, or isn't a node at all, no limits are applied.'''
+		
+		task = (node, limits(node), Future(), fn, args, kwargs, time.time())
+		with self.lock:
+			runnable = self.acquire(task)
+		if runnable:
+			self.get_pool().submit(self.run, task)
+		return task[2]
+	
+	def acquire(self, task):
+		'''Takes up a slot for each of a task's limits, or if any of them is
+		full, queues the task up behind it; returns whether it can be started.
+		
+		Must be called with the lock held.'''
+		
+		for key, limit in task[1]:
+			if self.running.get(key, 0) >= limit:
+				self.pending.setdefault(key, deque()).append(task)
+				return False
+		for key, limit in task[1]:
+			self.running[key] = self.running.get(key, 0) + 1
+		return True
+	
+	def release(self, task):
+		'''Frees up a task's slots, returning the pending tasks that can now
+		be started.
+		
+		Only the tasks queued up behind the freed slots are looked at; those
+		that turn out to be held back by another limit move on to its queue.'''
+		
+		runnable = []
+		with self.lock:
+			for key, limit in task[1]:
+				self.running[key] -= 1
+				queue = self.pending.get(key)
+				for i in range(len(queue) if queue else 0):
+					if self.running[key] >= limit:
+						break
+					t = queue.popleft()
+					if self.acquire(t):
+						runnable.append(t)
+				if queue is not None and not queue:
+					del self.pending[key]
+		return runnable
+	
+	def run(self, task):
+		node, _, future, fn, args, kwargs, queued = task
+		self.record_wait(node, time.time() - queued)
+		try:
+			if future.set_running_or_notify_cancel():
+				try:
+					future.set_result(fn(*args, **kwargs))
+				except BaseException as e:
+					future.set_exception(e)
+		finally:
+			for t in self.release(task):
+				self.get_pool().submit(self.run, t)
+	
+	def record_wait(self, node, wait):
+		'''Records how long a call to a node waited before being made.'''
+		
+		if not hasattr(node, 'host'):
+			return
+		
+		key = (node.scheme, node.host)
+		with self.lock:
+			if not key in self.waits:
+				self.waits[key] = WaitStats()
+			stats = self.waits[key]
+			stats.calls += 1
+			stats.total += wait
+			stats.max = max(stats.max, wait)
+	
+	def print_stats(self, file=sys.stderr):
+		'''Prints per-node queue wait times.'''
+		
+		for (scheme, host), stats in sorted(six.iteritems(self.waits)):
+			print(u"{scheme}://{host}: {s.calls} calls, waited {s.average:.3f}s on average, {s.max:.3f}s at most".format(scheme=scheme, host=host, s=stats), file=file)
+
+executor = Scheduler()
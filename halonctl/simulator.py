@@ -0,0 +1,576 @@
+'''A local stand-in for Halon nodes, for benchmarking and scale testing.
+
+The simulator serves the WSDL, and answers the SOAP calls halonctl makes
+(``login``, ``getUptime``, ``getVersion``, ``mailQueue``, ``mailHistory``,
+``statList``, ``configKeys``, ``configKeySet``, the ``command*`` and
+``update*`` families, and so on) with made-up, but consistent, data. How
+long each call takes, how many items lists hold, how large scripts and
+command output are, and how often calls fail can all be configured.
+
+A single simulator can stand in for thousands of nodes: it listens on every
+address, and tells nodes apart by the address they're contacted on. On Linux,
+all of ``127.0.0.0/8`` reaches the loopback interface, so a configuration
+with nodes spread over it can be generated::
+
+    python -m halonctl.simulator --nodes 2000 --config /tmp/simulated.json --latency 0.05
+    halonctl -C /tmp/simulated.json status
+
+Only connections from the loopback interface are accepted, unless
+``--allow-remote`` is given. By default, the WSDL used by the test suite is
+served; pass ``--wsdl`` to serve one downloaded from a real node instead.
+'''
+
+from __future__ import print_function
+import six
+import os
+import ssl
+import sys
+import zlib
+import json
+import time
+import random
+import hashlib
+import argparse
+import itertools
+from base64 import b64decode
+from collections import OrderedDict
+from threading import Thread, Lock
+from xml.etree.ElementTree import fromstring, ParseError
+from xml.sax.saxutils import escape
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from six.moves.socketserver import ThreadingMixIn
+from .util import to_base64
+from .streaming import localname
+
+BASE = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_WSDL = os.path.join(BASE, 'simulator.wsdl')
+
+SOAP_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+ENVELOPE = (u'<?xml version="1.0" encoding="UTF-8"?>'
+	u'<SOAP-ENV:Envelope xmlns:SOAP-ENV="{0}" xmlns:ns1="urn:halon">'
+	u'<SOAP-ENV:Body>{{body}}</SOAP-ENV:Body></SOAP-ENV:Envelope>').format(SOAP_NS)
+
+#: How much command output is returned by each ``commandPoll`` call
+POLL_SIZE = 4096
+
+#: Counters listed by ``statd -l``
+COUNTERS = [
+	u"mail-acc", u"mail-rej", u"mail-defer", u"mail-queue", u"mail-quarantine",
+	u"system-cpu-usage", u"system-mem-usage", u"system-disk-usage",
+	u"interface-em0-rx", u"interface-em0-tx",
+]
+
+class Fault(Exception):
+	'''Raised by an operation to answer with a SOAP fault.'''
+	pass
+
+class Settings(object):
+	'''How the simulated nodes behave.
+	
+	:ivar float latency: Seconds every call takes, at least
+	:ivar float jitter: Up to this many seconds are randomly added to that
+	:ivar int items: Items in each node's queue, history and statistics
+	:ivar int size: Bytes in each script, file and command output
+	:ivar float error_rate: Fraction of calls answered with a SOAP fault
+	:ivar float drop_rate: Fraction of calls whose connection is just closed
+	'''
+	
+	def __init__(self, latency=0.0, jitter=0.0, items=100, size=4096, error_rate=0.0, drop_rate=0.0,
+			username=u"admin", password=u"admin"):
+		self.latency = latency
+		self.jitter = jitter
+		self.items = items
+		self.size = size
+		self.error_rate = error_rate
+		self.drop_rate = drop_rate
+		self.username = username
+		self.password = password
+
+def element(name, value):
+	'''Serializes a value as an unqualified XML element; dictionaries become
+	nested elements, lists become arrays of ``item`` elements, and None
+	leaves the element out.'''
+	
+	if value is None:
+		return u""
+	elif isinstance(value, dict):
+		inner = u"".join(element(k, v) for k, v in six.iteritems(value))
+	elif isinstance(value, (list, tuple)):
+		inner = u"".join(element(u"item", v) for v in value)
+	elif isinstance(value, bool):
+		inner = u"true" if value else u"false"
+	else:
+		inner = escape(six.text_type(value))
+	return u"<{0}>{1}</{0}>".format(name, inner)
+
+def parse_value(elem):
+	'''The reverse of :func:`element`, for request parameters.'''
+	
+	children = list(elem)
+	if not children:
+		return elem.text or u""
+	elif all(localname(child.tag) == 'item' for child in children):
+		return [parse_value(child) for child in children]
+	return { localname(child.tag): parse_value(child) for child in children }
+
+def filler(rng, size):
+	'''Returns ``size`` characters of text that compresses about as well as
+	real configuration does.'''
+	
+	words = [u"if", u"else", u"Accept", u"Reject", u"Defer", u"$senderip", u"$recipientdomain", u"ScanRPD()", u"in", u"echo"]
+	parts = []
+	length = 0
+	while length < size:
+		word = rng.choice(words) + (u"\n" if rng.random() < 0.1 else u" ")
+		parts.append(word)
+		length += len(word)
+	return u"".join(parts)[:size]
+
+class SimulatedNode(object):
+	'''The state of a single simulated node. Each operation in
+	:data:`OPERATIONS` is a method, taking a dictionary of parameters and
+	returning a result, or None for operations without one.'''
+	
+	def __init__(self, host, settings):
+		self.host = host
+		self.settings = settings
+		self.lock = Lock()
+		
+		rng = random.Random(host)
+		self.started = time.time() - rng.randint(3600, 90 * 86400)
+		self.version = u"4.{0}.{1}".format(rng.randint(0, 8), rng.randint(0, 5))
+		self.serial = hashlib.sha1(host.encode('utf-8')).hexdigest()[:16].upper()
+		self.update = None
+		
+		self.queue = [self.make_mail(rng, i, u"QUEUE") for i in range(settings.items)]
+		self.history = [self.make_mail(rng, i, u"DELIVER") for i in range(settings.items)]
+		self.stats = [{
+			u"key1": u"mail", u"key2": rng.choice([u"in", u"out", u"quarantine"]), u"key3": u"domain{0}.example".format(i),
+			u"count": rng.randint(0, 100000), u"updated": int(self.started) + i, u"created": int(self.started),
+		} for i in range(settings.items)]
+		
+		self.config = OrderedDict()
+		for i in range(1, 4):
+			self.config[u"mailtransport_flow__{0}".format(i)] = [u"Flow {0}".format(i),
+				u"script \"{0}\"".format(to_base64(filler(rng, settings.size)))]
+		self.config[u"queue_flow"] = [u"Queue", u"script \"{0}\"".format(to_base64(filler(rng, settings.size)))]
+		self.config[u"file__1"] = [u"Allowlist", u"text/plain", to_base64(filler(rng, settings.size))]
+		
+		self.commands = {}
+		self.command_ids = itertools.count(1)
+	
+	def make_mail(self, rng, i, action):
+		return OrderedDict([
+			(u"id", u"{0}:{1}".format(i + 1, rng.randint(1, 9))),
+			(u"msgid", u"{0:08x}-{1:04x}".format(rng.getrandbits(32), i)),
+			(u"msgqueueid", u"{0}".format(i + 1)),
+			(u"msgfrom", u"sender{0}@example.com".format(rng.randint(1, 500))),
+			(u"msgto", u"user{0}@example.org".format(rng.randint(1, 5000))),
+			(u"msgsubject", to_base64(u"Message number {0}".format(i + 1))),
+			(u"msgts0", int(self.started) + i * 60),
+			(u"msgaction", action),
+			(u"msgactionid", rng.randint(1, 20)),
+			(u"msghelo", u"mx{0}.example.com".format(rng.randint(1, 9))),
+			(u"msgfromserver", u"192.0.2.{0}".format(rng.randint(1, 254))),
+			(u"msgquarantine", None),
+			(u"msgretries", rng.randint(0, 5)),
+			(u"msgsasl", None),
+			(u"msglistener", u"mailserver:1"),
+			(u"msgsize", rng.randint(1000, 10000000)),
+			(u"msgtransport", u"mailtransport:1"),
+		])
+	
+	def page(self, items, params):
+		offset = int(params.get('offset') or 0)
+		limit = int(params.get('limit') or len(items))
+		return items[offset:offset + limit]
+	
+	def mail_result(self, items, params):
+		options = params.get('options') or {}
+		totalhits = len(items) if options.get('totalhits') == u"true" else None
+		return OrderedDict([(u"result", self.page(items, params)), (u"totalhits", totalhits)])
+	
+	def login(self, params):
+		return None
+	
+	def getUptime(self, params):
+		return int(time.time() - self.started)
+	
+	def getVersion(self, params):
+		return self.version
+	
+	def getSerial(self, params):
+		return self.serial
+	
+	def mailQueue(self, params):
+		with self.lock:
+			return self.mail_result(list(self.queue), params)
+	
+	def mailHistory(self, params):
+		return self.mail_result(self.history, params)
+	
+	def mailQueueRetryBulk(self, params):
+		return None
+	
+	def mailQueueDeleteBulk(self, params):
+		with self.lock:
+			del self.queue[:]
+	
+	def statList(self, params):
+		keys = [(key, params.get(key)) for key in (u"key1", u"key2", u"key3") if params.get(key)]
+		return self.page([stat for stat in self.stats if all(stat[key] == value for key, value in keys)], params)
+	
+	def configKeys(self, params):
+		with self.lock:
+			return [OrderedDict([(u"name", key), (u"params", values)]) for key, values in six.iteritems(self.config)]
+	
+	def configKeySet(self, params):
+		pairs = dict((pair.get('first'), pair.get('second')) for pair in params.get('params') or [])
+		values = [pairs.get(u"name")]
+		for middle in (u"rate", u"type"):
+			if middle in pairs:
+				values.append(pairs[middle])
+		values.append(pairs.get(u"flow", pairs.get(u"data")))
+		with self.lock:
+			self.config[params['key']] = values
+	
+	def commandRun(self, params):
+		argv = [b64decode(arg).decode('utf-8', 'replace') for arg in params.get('argv') or []]
+		with self.lock:
+			cid = six.text_type(next(self.command_ids))
+			self.commands[cid] = self.command_output(argv)
+		return cid
+	
+	def command_output(self, argv):
+		'''Returns what a command prints; ``statd`` answers like the real one
+		does, anything else prints filler text.'''
+		
+		rng = random.Random(u" ".join([self.host] + argv))
+		if argv[:2] == [u"statd", u"-l"]:
+			return u"".join(u"{0}\n".format(counter) for counter in COUNTERS)
+		elif argv[:2] == [u"statd", u"-g"] and len(argv) > 2:
+			return u"".join(u"{0}={1}\n".format(counter, rng.randint(0, 100000)) for counter in COUNTERS if counter.startswith(argv[2]))
+		return filler(rng, self.settings.size)
+	
+	def commandPoll(self, params):
+		with self.lock:
+			output = self.commands.get(params.get('commandid'))
+			if not output:
+				self.commands.pop(params.get('commandid'), None)
+				raise Fault(u"No such command")
+			chunk, self.commands[params['commandid']] = output[:POLL_SIZE], output[POLL_SIZE:]
+		return [to_base64(chunk)]
+	
+	def commandPush(self, params):
+		with self.lock:
+			if not params.get('commandid') in self.commands:
+				raise Fault(u"No such command")
+			self.commands[params['commandid']] += b64decode(params.get('data') or u"").decode('utf-8', 'replace')
+	
+	def commandStop(self, params):
+		with self.lock:
+			self.commands.pop(params.get('commandid'), None)
+	
+	commandSignal = commandStop
+	
+	def commandTermsize(self, params):
+		return None
+	
+	def updateDownloadStatus(self, params):
+		with self.lock:
+			if self.update is None:
+				raise Fault(u"No pending update")
+			# Downloads make some progress every time someone looks
+			if self.update < 100:
+				self.update = min(self.update + 25, 100)
+			elif self.update == 100:
+				self.update = 102
+			return self.update
+	
+	def updateDownloadStart(self, params):
+		with self.lock:
+			if self.update is None:
+				self.update = 0
+	
+	def updateDownloadCancel(self, params):
+		with self.lock:
+			self.update = None
+	
+	def updateInstall(self, params):
+		with self.lock:
+			if self.update != 102:
+				raise Fault(u"No update ready to install")
+			self.update = None
+			major, minor, patch = self.version.split(u".")
+			self.version = u"{0}.{1}.{2}".format(major, minor, int(patch) + 1)
+			self.started = time.time()
+
+#: The SOAP operations simulated nodes answer
+OPERATIONS = [
+	'login', 'getUptime', 'getVersion', 'getSerial',
+	'mailQueue', 'mailHistory', 'mailQueueRetryBulk', 'mailQueueDeleteBulk', 'statList',
+	'configKeys', 'configKeySet',
+	'commandRun', 'commandPoll', 'commandPush', 'commandSignal', 'commandTermsize', 'commandStop',
+	'updateDownloadStatus', 'updateDownloadStart', 'updateDownloadCancel', 'updateInstall',
+]
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	
+	def setup(self):
+		# Handshakes are made here, in the connection's own thread, so that a
+		# slow client doesn't hold up the others
+		if self.server.ssl_context:
+			self.request = self.server.ssl_context.wrap_socket(self.request, server_side=True)
+		BaseHTTPRequestHandler.setup(self)
+	
+	def do_GET(self):
+		if not self.path.startswith('/remote/') or not self.path.endswith('?wsdl'):
+			return self.reply(404, b'')
+		
+		wsdl, etag = self.server.wsdl
+		if self.headers.get('If-None-Match') == etag:
+			return self.reply(304, b'')
+		self.reply(200, wsdl, { 'Content-Type': 'text/xml; charset=utf-8', 'ETag': etag })
+	
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+		if self.headers.get('Content-Encoding', '').lower() == 'gzip':
+			body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+		
+		server = self.server
+		settings = server.settings
+		delay = settings.latency + (random.uniform(0, settings.jitter) if settings.jitter else 0)
+		if delay:
+			time.sleep(delay)
+		
+		try:
+			name, params = self.parse(body)
+		except (ParseError, ValueError):
+			return self.fault(u"Malformed request", 400)
+		
+		if self.headers.get('Authorization') != server.authorization:
+			server.count(name, 'unauthorized')
+			return self.reply(401, b'', { 'WWW-Authenticate': 'Basic realm="Halon"' })
+		
+		node = server.node(self.headers.get('Host', ''))
+		r = random.random()
+		if r < settings.drop_rate:
+			server.count(name, 'dropped')
+			self.close_connection = True
+			return
+		elif r < settings.drop_rate + settings.error_rate:
+			server.count(name, 'failed')
+			return self.fault(u"Simulated failure")
+		elif not name in OPERATIONS:
+			server.count(name, 'failed')
+			return self.fault(u"Unknown operation {0}".format(name))
+		
+		try:
+			result = getattr(node, name)(params)
+		except Fault as e:
+			server.count(name, 'failed')
+			return self.fault(six.text_type(e))
+		
+		server.count(name, 'ok')
+		inner = element(u"result", result) if result is not None else u""
+		self.envelope(200, u"<ns1:{0}Response>{1}</ns1:{0}Response>".format(name, inner))
+	
+	def parse(self, body):
+		'''Returns the operation and parameters of a request envelope.'''
+		
+		root = fromstring(body)
+		body = root.find('{{{0}}}Body'.format(SOAP_NS))
+		if body is None or not len(body):
+			raise ValueError("No operation in the request")
+		op = body[0]
+		return (localname(op.tag), { localname(child.tag): parse_value(child) for child in op })
+	
+	def fault(self, message, status=500):
+		self.envelope(status, u"<SOAP-ENV:Fault><faultcode>SOAP-ENV:Server</faultcode>"
+			u"<faultstring>{0}</faultstring></SOAP-ENV:Fault>".format(escape(message)))
+	
+	def envelope(self, status, body):
+		data = ENVELOPE.format(body=body).encode('utf-8')
+		headers = { 'Content-Type': 'text/xml; charset=utf-8' }
+		if 'gzip' in self.headers.get('Accept-Encoding', '') and len(data) >= 1024:
+			c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+			data = c.compress(data) + c.flush()
+			headers['Content-Encoding'] = 'gzip'
+		self.reply(status, data, headers)
+	
+	def reply(self, status, data, headers={}):
+		self.send_response(status)
+		for key, value in six.iteritems(headers):
+			self.send_header(key, value)
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+	
+	def log_message(self, *args):
+		pass
+
+class Simulator(ThreadingMixIn, HTTPServer):
+	'''An HTTP server standing in for any number of nodes.
+	
+	:param tuple address: The ``(host, port)`` to listen on
+	:param Settings settings: How the nodes behave
+	:param str wsdl: Path to the WSDL file to serve
+	:param str certfile: Serve HTTPS with the certificate and key in this file
+	:param bool allow_remote: Accept connections from other hosts
+	'''
+	
+	daemon_threads = True
+	allow_reuse_address = True
+	request_queue_size = 1024
+	
+	def __init__(self, address, settings=None, wsdl=DEFAULT_WSDL, certfile=None, allow_remote=False):
+		HTTPServer.__init__(self, address, SimulatorHandler)
+		self.settings = settings or Settings()
+		self.allow_remote = allow_remote
+		self.nodes = {}
+		self.calls = {}
+		self.lock = Lock()
+		
+		with open(wsdl, 'rb') as f:
+			content = f.read()
+		self.wsdl = (content, u'"{0}"'.format(hashlib.sha1(content).hexdigest()))
+		
+		credentials = u"{0}:{1}".format(self.settings.username, self.settings.password).encode('utf-8')
+		self.authorization = u"Basic {0}".format(to_base64(credentials))
+		
+		self.ssl_context = None
+		if certfile:
+			self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+			self.ssl_context.load_cert_chain(certfile)
+	
+	@property
+	def port(self):
+		return self.server_address[1]
+	
+	def verify_request(self, request, client_address):
+		return self.allow_remote or client_address[0].startswith('127.') or client_address[0] == '::1'
+	
+	def handle_error(self, request, client_address):
+		# Clients hanging up, or failing a handshake, are nothing to report
+		if not isinstance(sys.exc_info()[1], (IOError, OSError)):
+			HTTPServer.handle_error(self, request, client_address)
+	
+	def node(self, host):
+		'''Returns the simulated node for a Host header, creating it the first
+		time it's contacted.'''
+		
+		with self.lock:
+			if not host in self.nodes:
+				self.nodes[host] = SimulatedNode(host, self.settings)
+			return self.nodes[host]
+	
+	def count(self, name, outcome):
+		with self.lock:
+			counts = self.calls.setdefault(name, {})
+			counts[outcome] = counts.get(outcome, 0) + 1
+	
+	def start(self):
+		'''Starts serving in a background thread.'''
+		
+		thread = Thread(target=self.serve_forever, kwargs={ 'poll_interval': 0.1 })
+		thread.daemon = True
+		thread.start()
+		return thread
+	
+	def print_stats(self, file=sys.stderr):
+		'''Prints per-operation call counters.'''
+		
+		print(u"{0} nodes contacted".format(len(self.nodes)), file=file)
+		for name, counts in sorted(six.iteritems(self.calls)):
+			print(u"{0}: {1}".format(name, u", ".join(u"{0} {1}".format(n, outcome) for outcome, n in sorted(six.iteritems(counts)))), file=file)
+
+def loopback_address(i):
+	'''Returns the i:th address in 127.0.0.0/8, skipping ones that end in 0
+	or 255.'''
+	
+	i = (i // 254) * 256 + (i % 254) + 1
+	return u"127.{0}.{1}.{2}".format((i >> 16) & 255, (i >> 8) & 255, i & 255)
+
+def generate_config(count, port, cluster_size=50, scheme='http', username=u"admin", password=u"admin", host=None):
+	'''Returns a configuration for ``count`` simulated nodes, grouped into
+	clusters of ``cluster_size``.
+	
+	Nodes are spread over the loopback network, unless ``host`` is given,
+	in which case they're all contacted there.'''
+	
+	width = len(str(count))
+	nodes = OrderedDict()
+	clusters = OrderedDict()
+	for i in range(count):
+		name = u"node{0:0{1}}".format(i + 1, width)
+		address = host or loopback_address(i)
+		nodes[name] = u"{scheme}://{address}:{port}".format(scheme=scheme, address=address, port=port)
+		cluster = u"cluster{0:0{1}}".format(i // cluster_size + 1, len(str(count // cluster_size + 1)))
+		clusters.setdefault(cluster, { 'username': username, 'password': password, 'nodes': [] })['nodes'].append(name)
+	
+	config = OrderedDict([('nodes', nodes), ('clusters', clusters)])
+	if scheme == 'https':
+		config['verify_ssl'] = False
+	return config
+
+def main():
+	parser = argparse.ArgumentParser(description=u"Simulates Halon nodes, for benchmarking and scale testing.")
+	parser.add_argument('-b', '--bind', default='0.0.0.0',
+		help=u"address to listen on (default: all)")
+	parser.add_argument('-p', '--port', type=int, default=8080,
+		help=u"port to listen on (default: 8080)")
+	parser.add_argument('--allow-remote', action='store_true',
+		help=u"accept connections from other hosts")
+	parser.add_argument('--wsdl', default=DEFAULT_WSDL,
+		help=u"WSDL file to serve")
+	parser.add_argument('--certfile',
+		help=u"serve HTTPS, with the certificate and key in this file")
+	parser.add_argument('--latency', type=float, default=0.0, metavar='SECONDS',
+		help=u"time every call takes, at least (default: 0)")
+	parser.add_argument('--jitter', type=float, default=0.0, metavar='SECONDS',
+		help=u"random extra time added to each call (default: 0)")
+	parser.add_argument('--items', type=int, default=100, metavar='N',
+		help=u"items in each node's queue, history and statistics (default: 100)")
+	parser.add_argument('--size', type=int, default=4096, metavar='BYTES',
+		help=u"size of each script, file and command output (default: 4096)")
+	parser.add_argument('--error-rate', type=float, default=0.0, metavar='FRACTION',
+		help=u"fraction of calls answered with a fault (default: 0)")
+	parser.add_argument('--drop-rate', type=float, default=0.0, metavar='FRACTION',
+		help=u"fraction of calls whose connection is closed unanswered (default: 0)")
+	parser.add_argument('--username', default=u"admin",
+		help=u"username nodes accept (default: admin)")
+	parser.add_argument('--password', default=u"admin",
+		help=u"password nodes accept (default: admin)")
+	parser.add_argument('--config', metavar='PATH',
+		help=u"write a halonctl configuration for the simulated nodes here")
+	parser.add_argument('--nodes', type=int, default=10, metavar='N',
+		help=u"number of nodes in the configuration (default: 10)")
+	parser.add_argument('--cluster-size', type=int, default=50, metavar='N',
+		help=u"number of nodes per cluster in the configuration (default: 50)")
+	args = parser.parse_args()
+	
+	settings = Settings(latency=args.latency, jitter=args.jitter, items=args.items, size=args.size,
+		error_rate=args.error_rate, drop_rate=args.drop_rate, username=args.username, password=args.password)
+	server = Simulator((args.bind, args.port), settings, args.wsdl, args.certfile, args.allow_remote)
+	
+	if args.config:
+		# Spreading nodes over the loopback network only works if they're all being listened on
+		host = None if args.bind in ('', '0.0.0.0') else args.bind
+		config = generate_config(args.nodes, server.port, args.cluster_size,
+			'https' if args.certfile else 'http', args.username, args.password, host)
+		with open(args.config, 'w') as f:
+			json.dump(config, f, indent=4)
+		print(u"Wrote a configuration for {0} nodes to {1}".format(args.nodes, args.config), file=sys.stderr)
+	
+	print(u"Listening on {0}:{1}".format(args.bind, server.port), file=sys.stderr)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		server.print_stats()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,512 @@
+'''Compiled snapshots of the configuration.
+
+Parsing a large ``halonctl.json`` and creating a node for every entry in it
+takes a while, and it grows with the size of the fleet, even for runs that
+target only a single cluster. Instead, each configuration file is compiled
+into a snapshot, kept in the cache (see :mod:`halonctl.cache`), the first
+time it's used, and whenever its modification time, size or inode changes:
+
+* a header, holding the settings and the names of the clusters
+* a section per cluster, holding its settings and nodes
+* the nodes, hashed by name into sections of about :data:`BUCKET_SIZE`
+* a list of all nodes' names and hosts
+* the tags
+
+Each of them is ``marshal``-ed separately, and read only once it's needed;
+nodes and clusters are likewise only created as they're looked up. Targeting
+a cluster reads the header and that cluster's section, and naming a node
+reads the section it's hashed into, however many nodes there are in total.
+Selectors (see :mod:`halonctl.inventory`) read the list and every cluster's
+section, but still only create the nodes they select.
+
+The configuration can also be split into fragments, in a directory next to
+the configuration file and named after it, eg. ``halonctl.d/`` for
+``halonctl.json``. Each ``*.json`` file in it has ``nodes``, ``clusters``
+and ``tags`` entries of its own, like the configuration file, and is compiled
+into a snapshot of its own, so that only the files that changed are parsed
+again. A cluster can only list nodes from the same file, and names have to
+be unique across all files.
+'''
+
+from __future__ import print_function
+import six
+import os
+import sys
+import json
+import struct
+import marshal
+import hashlib
+import zlib
+from threading import Lock, RLock
+from collections import OrderedDict
+from six.moves.collections_abc import Mapping, MutableMapping
+from . import cache
+from .models import Node, NodeList
+from .inventory import Inventory, SelectorError
+
+DIRNAME = u"snapshots"
+
+#: Changed whenever the format of snapshots does
+VERSION = 1
+
+MAGIC = b"halonctl-snapshot\n"
+LENGTH = struct.Struct('>I')
+
+#: How many nodes to hash into each section, on average
+BUCKET_SIZE = 256
+
+#: Top-level entries that describe nodes, rather than settings
+INVENTORY_KEYS = ['nodes', 'clusters', 'tags']
+
+class ConfigError(ValueError):
+	'''Raised for configurations that refer to things that don't exist.'''
+	pass
+
+class ConfigSyntaxError(ConfigError):
+	'''Raised for configuration files that aren't valid JSON.'''
+	pass
+
+def entry_name(path):
+	h = hashlib.sha1()
+	for part in (path, VERSION, sys.version_info[:2]):
+		h.update(six.text_type(part).encode('utf-8'))
+		h.update(b'\0')
+	return h.hexdigest()
+
+def source_of(path):
+	'''Returns what a snapshot of a file is validated against.'''
+	
+	st = os.stat(path)
+	return [st.st_mtime, st.st_size, st.st_ino]
+
+def fragment_paths(path):
+	'''Returns the fragments belonging to a configuration file, in the order
+	they're read.'''
+	
+	dirname = os.path.splitext(path)[0] + u".d"
+	try:
+		names = sorted(name for name in os.listdir(dirname) if name.endswith(u".json"))
+	except OSError:
+		return []
+	return [os.path.join(dirname, name) for name in names]
+
+def bucket_of(nid, buckets):
+	return zlib.crc32(nid.encode('utf-8')) % buckets
+
+def parse(f, name=None):
+	try:
+		return json.load(f, object_pairs_hook=OrderedDict)
+	except ValueError as e:
+		raise ConfigSyntaxError(u"{0}: {1}".format(name, e) if name else six.text_type(e))
+
+def compile_config(conf, source=None, name=None):
+	'''Compiles a parsed configuration file into a snapshot.
+	
+	:param conf: The parsed configuration
+	:param source: What to validate the snapshot against, see :func:`source_of`
+	:param name: The name of the fragment it is, if it is one
+	'''
+	
+	def fail(message):
+		raise ConfigError(u"{0}: {1}".format(name, message) if name else message)
+	
+	if name:
+		unknown = [key for key in conf if not key in INVENTORY_KEYS]
+		if unknown:
+			fail(u"Only {0} can be set in a fragment, not '{1}'".format(u", ".join(INVENTORY_KEYS), unknown[0]))
+	
+	nodes = conf.get('nodes') or {}
+	for nid, data in six.iteritems(nodes):
+		if not isinstance(data, six.string_types):
+			fail(u"Node '{nid}' should be a string".format(nid=nid))
+	
+	# A node belongs to the last cluster listing it, as it always has
+	owners = {}
+	members = []
+	for cid, data in six.iteritems(conf.get('clusters') or {}):
+		nids = data.get('nodes', []) if isinstance(data, dict) else data
+		for nid in nids:
+			if not nid in nodes:
+				fail(u"Cluster '{cid}' references nonexistent node '{nid}'".format(cid=cid, nid=nid))
+			owners[nid] = cid
+		settings = OrderedDict((key, value) for key, value in six.iteritems(data) if key != 'nodes') if isinstance(data, dict) else {}
+		members.append((cid, settings, nids))
+	
+	sections = []
+	offset = [0]
+	def add(value):
+		data = marshal.dumps(value)
+		sections.append(data)
+		offset[0] += len(data)
+		return [offset[0] - len(data), len(data)]
+	
+	names = list(nodes)
+	buckets = [{} for i in range(len(names) // BUCKET_SIZE + 1)]
+	for nid in names:
+		buckets[bucket_of(nid, len(buckets))][nid] = [nodes[nid], owners.get(nid)]
+	
+	header = {
+		'version': VERSION,
+		'source': source,
+		'settings': json.dumps(OrderedDict((key, value) for key, value in six.iteritems(conf) if not key in INVENTORY_KEYS)),
+		'count': len(names),
+		'clusters': [[cid] + add([json.dumps(settings), [[nid, nodes[nid], owners[nid]] for nid in nids]])
+			for cid, settings, nids in members],
+		'buckets': [add(bucket) for bucket in buckets],
+		'nodes': add([names, [Node(nodes[nid]).host or u"" for nid in names]]),
+		'tags': add([[tag, list(nids)] for tag, nids in six.iteritems(conf.get('tags') or {})]),
+	}
+	header = marshal.dumps(header)
+	return b"".join([MAGIC, LENGTH.pack(len(header)), header] + sections)
+
+class Snapshot(object):
+	'''A compiled configuration file, whose sections are read as they're
+	needed.
+	
+	:ivar OrderedDict settings: Settings, ie. everything but the nodes,
+	                            clusters and tags
+	:ivar OrderedDict clusters: Where the clusters' sections are
+	:ivar int count: The number of nodes
+	'''
+	
+	def __init__(self, f, path=None):
+		if f.read(len(MAGIC)) != MAGIC:
+			raise ValueError(u"Not a snapshot")
+		length, = LENGTH.unpack(f.read(LENGTH.size))
+		header = marshal.loads(f.read(length))
+		if header['version'] != VERSION:
+			raise ValueError(u"Unsupported snapshot version")
+		
+		self.f = f
+		self.path = path
+		self.base = len(MAGIC) + LENGTH.size + length
+		self.source = header['source']
+		self.settings = json.loads(header['settings'], object_pairs_hook=OrderedDict)
+		self.clusters = OrderedDict((cid, (offset, length)) for cid, offset, length in header['clusters'])
+		self.count = header['count']
+		self.locations = { 'nodes': header['nodes'], 'tags': header['tags'] }
+		self.buckets = header['buckets']
+		self.bucket_sections = {}
+		self.lock = Lock()
+		self.table = None
+	
+	def section(self, location):
+		offset, length = location
+		with self.lock:
+			self.f.seek(self.base + offset)
+			return marshal.loads(self.f.read(length))
+	
+	def cluster(self, cid):
+		'''Returns a cluster's settings and nodes, as ``(settings, [(name,
+		data, owner)])``, where the owner is the cluster the node belongs to.'''
+		
+		settings, members = self.section(self.clusters[cid])
+		return (json.loads(settings), members)
+	
+	def find(self, nid):
+		'''Returns a node's data and the cluster it belongs to, as ``(data,
+		owner)``, or None if there's no such node.'''
+		
+		i = bucket_of(nid, len(self.buckets))
+		bucket = self.bucket_sections.get(i)
+		if bucket is None:
+			bucket = self.bucket_sections[i] = self.section(self.buckets[i])
+		return bucket.get(nid)
+	
+	def nodes(self):
+		'''Returns the names and hosts of all nodes, as ``(names, hosts)``.'''
+		
+		if self.table is None:
+			self.table = self.section(self.locations['nodes'])
+		return self.table
+	
+	def tags(self):
+		return self.section(self.locations['tags'])
+	
+	def close(self):
+		self.f.close()
+
+def load(path, name=None):
+	'''Returns the snapshot of a configuration file, compiling it first if
+	there's no up to date one; ``name`` is the fragment's name, if it's one.'''
+	
+	source = source_of(path)
+	entry = entry_name(path)
+	
+	f = cache.open_entry(DIRNAME, entry)
+	if f is not None:
+		try:
+			snapshot = Snapshot(f, path)
+			if snapshot.source == source:
+				return snapshot
+		except (ValueError, EOFError, TypeError, KeyError, struct.error):
+			pass
+		f.close()
+	
+	with open(path, 'r') as f:
+		data = compile_config(parse(f, name), source, name)
+	cache.set_entry(DIRNAME, entry, data)
+	return Snapshot(six.BytesIO(data), path)
+
+class Configuration(object):
+	'''A configuration file and its fragments, whose nodes and clusters are
+	created as they're looked up; they're kept for as long as the files
+	don't change.
+	
+	:ivar OrderedDict settings: The configuration file's settings, along with
+	                            ``nodes``, see :class:`ConfiguredNodeData`
+	:ivar int count: The number of configured nodes
+	'''
+	
+	def __init__(self, snapshots):
+		self.snapshots = snapshots
+		self.settings = OrderedDict(snapshots[0].settings)
+		self.settings['nodes'] = ConfiguredNodeData(self)
+		self.count = sum(snapshot.count for snapshot in snapshots)
+		
+		self.cluster_snapshots = OrderedDict()
+		for snapshot in snapshots:
+			for cid in snapshot.clusters:
+				if cid in self.cluster_snapshots:
+					raise ConfigError(u"Cluster '{cid}' is configured more than once".format(cid=cid))
+				self.cluster_snapshots[cid] = snapshot
+		
+		self.node_objects = {}
+		self.cluster_objects = {}
+		self.node_names = None
+		self.inventory = None
+		self.lock = RLock()
+	
+	def is_current(self, paths):
+		'''Returns whether the configuration still consists of the given
+		files, and none of them have changed.'''
+		
+		try:
+			return [snapshot.path for snapshot in self.snapshots] == paths and \
+				all(snapshot.source == source_of(snapshot.path) for snapshot in self.snapshots)
+		except OSError:
+			return False
+	
+	def cluster(self, cid):
+		'''Returns a cluster, creating it and its nodes if it hasn't been
+		already; raises KeyError if there's no such cluster.'''
+		
+		with self.lock:
+			cluster = self.cluster_objects.get(cid)
+			if cluster is None:
+				settings, members = self.cluster_snapshots[cid].cluster(cid)
+				cluster = self.cluster_objects[cid] = NodeList()
+				cluster.name = cid
+				cluster.load_data(settings)
+				for nid, data, owner in members:
+					node = self.node_objects.get(nid)
+					if node is None:
+						node = self.node_objects[nid] = Node(data, nid, cluster if owner == cid else None)
+					elif owner == cid:
+						node.cluster = cluster
+					if owner != cid:
+						self.cluster(owner)
+					cluster.append(node)
+			return cluster
+	
+	def names(self):
+		'''Returns the names of all nodes, in order.'''
+		
+		with self.lock:
+			if self.node_names is None:
+				names = []
+				seen = set()
+				for snapshot in self.snapshots:
+					table = snapshot.nodes()[0]
+					if len(self.snapshots) > 1:
+						duplicates = seen.intersection(table)
+						if duplicates:
+							raise ConfigError(u"Node '{nid}' is configured more than once".format(nid=sorted(duplicates)[0]))
+						seen.update(table)
+					names.extend(table)
+				self.node_names = names
+			return self.node_names
+	
+	def find(self, nid):
+		found = [entry for entry in (snapshot.find(nid) for snapshot in self.snapshots) if entry is not None]
+		if len(found) > 1:
+			raise ConfigError(u"Node '{nid}' is configured more than once".format(nid=nid))
+		return found[0] if found else None
+	
+	def node(self, nid):
+		'''Returns a node, creating it (and its cluster) if it hasn't been
+		already; raises KeyError if there's no such node.'''
+		
+		with self.lock:
+			node = self.node_objects.get(nid)
+			if node is None:
+				entry = self.find(nid)
+				if entry is None:
+					raise KeyError(nid)
+				data, owner = entry
+				if owner is not None:
+					self.cluster(owner)
+					node = self.node_objects[nid]
+				else:
+					node = self.node_objects[nid] = Node(data, nid)
+			return node
+	
+	def has_node(self, nid):
+		with self.lock:
+			return nid in self.node_objects or self.find(nid) is not None
+	
+	def get_inventory(self):
+		'''Returns an :class:`halonctl.inventory.Inventory` of all configured
+		nodes, without creating any of them until they're selected; raises
+		:class:`ConfigError` for tags that list nonexistent nodes.'''
+		
+		with self.lock:
+			if self.inventory is None:
+				self.names()
+				names, hosts = [], []
+				clusters, tags = [], OrderedDict()
+				for snapshot in self.snapshots:
+					table = snapshot.nodes()
+					names.extend(table[0])
+					hosts.extend(table[1])
+					for cid in snapshot.clusters:
+						clusters.append((cid, [nid for nid, data, owner in snapshot.cluster(cid)[1]]))
+					for tag, nids in snapshot.tags():
+						tags.setdefault(tag, []).extend(nids)
+				try:
+					self.inventory = Inventory.from_tables(names, hosts, clusters, tags, self.node)
+				except SelectorError as e:
+					raise ConfigError(six.text_type(e))
+			return self.inventory
+	
+	def close(self):
+		for snapshot in self.snapshots:
+			snapshot.close()
+
+class ConfiguredNodes(MutableMapping):
+	'''The configured nodes of a run, as an ordered ``{ name: node }``; nodes
+	are created as they're looked up. Nodes that aren't configured can be
+	added as well, for the run only.'''
+	
+	def __init__(self, configuration):
+		self.configuration = configuration
+		self.extra = OrderedDict()
+	
+	def __getitem__(self, nid):
+		if nid in self.extra:
+			return self.extra[nid]
+		return self.configuration.node(nid)
+	
+	def __setitem__(self, nid, node):
+		self.extra[nid] = node
+	
+	def __delitem__(self, nid):
+		del self.extra[nid]
+	
+	def __contains__(self, nid):
+		return nid in self.extra or self.configuration.has_node(nid)
+	
+	def __iter__(self):
+		for nid in self.configuration.names():
+			if not nid in self.extra:
+				yield nid
+		for nid in self.extra:
+			yield nid
+	
+	def __len__(self):
+		return self.configuration.count + len(self.extra)
+
+class ConfiguredNodeData(Mapping):
+	'''The configured nodes as they're written in the configuration, as an
+	ordered ``{ name: "username:password@host" }``; nothing is read until
+	they're looked up. It's kept in the settings as ``nodes``, for modules
+	that look at ``config['nodes']``.'''
+	
+	def __init__(self, configuration):
+		self.configuration = configuration
+	
+	def __getitem__(self, nid):
+		entry = self.configuration.find(nid)
+		if entry is None:
+			raise KeyError(nid)
+		return entry[0]
+	
+	def __contains__(self, nid):
+		return self.configuration.find(nid) is not None
+	
+	def __iter__(self):
+		return iter(self.configuration.names())
+	
+	def __len__(self):
+		return self.configuration.count
+
+class ConfiguredClusters(Mapping):
+	'''The configured clusters, as an ordered ``{ name: nodelist }``; clusters
+	are created as they're looked up.'''
+	
+	def __init__(self, configuration):
+		self.configuration = configuration
+	
+	def __getitem__(self, cid):
+		return self.configuration.cluster(cid)
+	
+	def __contains__(self, cid):
+		return cid in self.configuration.cluster_snapshots
+	
+	def __iter__(self):
+		return iter(self.configuration.cluster_snapshots)
+	
+	def __len__(self):
+		return len(self.configuration.cluster_snapshots)
+
+class ConfigurationCache(object):
+	'''Keeps loaded configurations, so that an agent (see
+	:mod:`halonctl.agent`) reuses their nodes from one run to the next, along
+	with their SOAP clients and resolved credentials.
+	
+	:ivar Configuration current: The configuration last loaded
+	'''
+	
+	def __init__(self):
+		self.loaded = {}
+		self.current = None
+	
+	def load(self, f):
+		'''Loads the configuration in an open file, and its fragments, from
+		their snapshots where possible.
+		
+		Files that aren't on disk, like stdin, are parsed every time.'''
+		
+		path = getattr(f, 'name', None)
+		if not isinstance(path, six.string_types) or not os.path.isfile(path):
+			data = compile_config(parse(f))
+			self.current = Configuration([Snapshot(six.BytesIO(data))])
+			return self.current
+		
+		path = os.path.abspath(path)
+		paths = [path] + fragment_paths(path)
+		configuration = self.loaded.get(path)
+		if configuration is None or not configuration.is_current(paths):
+			if configuration is not None:
+				configuration.close()
+			snapshots = []
+			try:
+				for i, p in enumerate(paths):
+					snapshots.append(load(p, os.path.basename(p) if i else None))
+				configuration = self.loaded[path] = Configuration(snapshots)
+			except Exception:
+				for snapshot in snapshots:
+					snapshot.close()
+				self.loaded.pop(path, None)
+				raise
+		
+		self.current = configuration
+		return configuration
+	
+	def clear(self):
+		for configuration in six.itervalues(self.loaded):
+			configuration.close()
+		self.loaded = {}
+		self.current = None
+
+configurations = ConfigurationCache()
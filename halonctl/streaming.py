@@ -0,0 +1,102 @@
+'''Incremental parsing of large SOAP replies.
+
+Replies to calls like ``mailQueue``, ``mailHistory`` or ``statList`` can be
+many megabytes in size; building a suds object for every item in them takes
+a long time, and keeps the whole reply in memory at once.
+
+Instead, replies can be parsed as they're read off the wire, yielding each
+item in the reply's result array as a lightweight :class:`Record` as soon as
+it's been received, and then throwing it away.
+'''
+
+from __future__ import print_function
+import six
+from xml.etree.ElementTree import iterparse
+
+class UnexpectedReply(ValueError):
+	'''Raised by :func:`iter_records` for replies whose result is a single
+	value, rather than an array.'''
+	pass
+
+#: Field types for items in ``mailQueue`` and ``mailHistory`` replies
+MAIL_TYPES = {
+	'msgts0': int,
+	'msgactionid': int,
+	'msgretries': int,
+	'msgsize': int,
+}
+
+#: Field types for items in ``statList`` replies
+STAT_TYPES = {
+	'count': int,
+	'updated': int,
+	'created': int,
+}
+
+#: How deep a call's result is nested, in Envelope > Body > Response > result
+RESULT_DEPTH = 4
+
+class Record(dict):
+	'''A parsed item; a dictionary that also allows its fields to be read as
+	attributes, like suds objects, eg. ``getattr(msg, 'msgfrom', None)``.'''
+	
+	__slots__ = ()
+	
+	def __getattr__(self, name):
+		try:
+			return self[name]
+		except KeyError:
+			raise AttributeError(name)
+
+def localname(tag):
+	'''Strips the namespace from an ElementTree tag.'''
+	return tag.rsplit('}', 1)[-1]
+
+def to_value(elem, types):
+	'''Converts an element into a Python value.
+	
+	Leaf elements are converted according to ``types``, a dictionary of
+	``{ name: callable }``, or left as strings; elements containing only
+	``item`` elements become lists, and all others become records.
+	'''
+	
+	name = localname(elem.tag)
+	children = list(elem)
+	if not children:
+		if elem.text is None or not name in types:
+			return elem.text
+		return types[name](elem.text)
+	elif all(localname(child.tag) == 'item' for child in children):
+		return [to_value(child, types) for child in children]
+	return Record((localname(child.tag), to_value(child, types)) for child in children)
+
+def iter_records(f, types={}):
+	'''Parses a SOAP reply from a file-like object, yielding each item in its
+	result array as soon as it's been read.
+	
+	The result array is taken to be the shallowest element in the reply
+	containing ``item`` elements; nested arrays are returned as lists. Raises
+	:class:`UnexpectedReply` once the reply has been read, if there's no array
+	in it, but a non-empty result value.
+	'''
+	
+	stack = []
+	depth = None
+	value = None
+	for event, elem in iterparse(f, events=('start', 'end')):
+		if event == 'start':
+			stack.append(elem)
+			if depth is None and localname(elem.tag) == 'item':
+				depth = len(stack)
+		else:
+			if len(stack) == depth and localname(elem.tag) == 'item':
+				yield to_value(elem, types)
+				
+				# Detach the item from its parent, or it'd be kept around
+				stack[-2].remove(elem)
+			elif len(stack) == RESULT_DEPTH and not len(elem) and (elem.text or u"").strip():
+				value = elem.text
+			stack.pop()
+	
+	if depth is None and value is not None:
+		raise UnexpectedReply(u"Expected an array, got {0!r}".format(value))
@@ -0,0 +1,167 @@
+'''TLS session resumption.
+
+A full TLS handshake costs a couple of round trips and some expensive public
+key operations, for every new connection to a node. Every SSL context handed
+out by :data:`sessions` remembers the last session (or session ticket) it got
+from each host, and offers it the next time it connects there, which lets the
+host skip most of the handshake.
+
+Sessions are only kept in memory, as Python's :mod:`ssl` module has no way to
+save them; to reuse them between runs, leave an agent running (see
+:mod:`halonctl.agent`). Reuse can be disabled with
+``"tls_session_reuse": false``; either way, ``--stats`` shows how many
+handshakes with each host were full, and how many were resumed.
+'''
+
+from __future__ import print_function
+import six
+import sys
+import ssl
+from threading import Lock
+from .config import config
+
+def is_supported():
+	return hasattr(ssl, 'SSLSession')
+
+# Older versions of Python lack some of these; the classes built on them are
+# only ever used if sessions are supported
+SSLSocket = getattr(ssl, 'SSLSocket', object)
+SSLObject = getattr(ssl, 'SSLObject', object)
+SSLContext = getattr(ssl, 'SSLContext', object)
+
+class HandshakeStats(object):
+	'''Handshake counters for a single host.
+	
+	:ivar int full: Handshakes that had to be made from scratch
+	:ivar int resumed: Handshakes that resumed an earlier session
+	'''
+	
+	def __init__(self):
+		self.full = 0
+		self.resumed = 0
+
+class SessionSocket(SSLSocket):
+	def read(self, *args, **kwargs):
+		data = super(SessionSocket, self).read(*args, **kwargs)
+		self.context.cache.save(self)
+		return data
+
+class SessionObject(SSLObject):
+	def read(self, *args, **kwargs):
+		data = super(SessionObject, self).read(*args, **kwargs)
+		self.context.cache.save(self)
+		return data
+
+class SessionContext(SSLContext):
+	'''An SSL context that offers hosts the sessions it got from them on
+	earlier connections, both for plain sockets (used by :mod:`requests`) and
+	memory BIOs (used by :mod:`asyncio`).'''
+	
+	sslsocket_class = SessionSocket
+	sslobject_class = SessionObject
+	
+	def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True, suppress_ragged_eofs=True, server_hostname=None, session=None):
+		host = server_hostname or sock.getpeername()[0]
+		if session is None and not server_side:
+			session = self.cache.lookup(self, host)
+		conn = super(SessionContext, self).wrap_socket(sock, server_side=server_side,
+			do_handshake_on_connect=do_handshake_on_connect, suppress_ragged_eofs=suppress_ragged_eofs,
+			server_hostname=server_hostname, session=session)
+		conn.host = None if server_side else host
+		return conn
+	
+	def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+		if session is None and not server_side and server_hostname:
+			session = self.cache.lookup(self, server_hostname)
+		conn = super(SessionContext, self).wrap_bio(incoming, outgoing, server_side=server_side,
+			server_hostname=server_hostname, session=session)
+		conn.host = None if server_side else server_hostname
+		return conn
+
+class SessionCache(object):
+	'''Hands out SSL contexts, and keeps track of the sessions they've made.
+	
+	A connection's session is picked up as data is read from it, rather than
+	right after the handshake; with TLS 1.3, the ticket needed to resume a
+	session only arrives after that.
+	'''
+	
+	def __init__(self):
+		self.contexts = {}
+		self.sessions = {}
+		self.stats = {}
+		self.lock = Lock()
+	
+	@property
+	def enabled(self):
+		return config.get('tls_session_reuse', True)
+	
+	def context(self, verify, cafile=None):
+		'''Returns the shared SSL context for a ``verify_ssl`` setting.
+		
+		Certificates are verified against ``cafile`` if ``verify`` is True
+		and it's given, or against the system's certificates otherwise.
+		Returns None if sessions can't be resumed on this version of Python.'''
+		
+		if not is_supported():
+			return None
+		
+		verify = verify if isinstance(verify, six.string_types) else bool(verify)
+		key = (verify, cafile if verify is True else None)
+		with self.lock:
+			if not key in self.contexts:
+				ctx = SessionContext(ssl.PROTOCOL_TLS_CLIENT)
+				if verify is False:
+					ctx.check_hostname = False
+					ctx.verify_mode = ssl.CERT_NONE
+				elif verify is True and not cafile:
+					ctx.load_default_certs()
+				else:
+					ctx.load_verify_locations(cafile=cafile if verify is True else verify)
+				ctx.cache = self
+				ctx.key = key
+				self.contexts[key] = ctx
+			return self.contexts[key]
+	
+	def lookup(self, context, host):
+		'''Returns the session to offer a host, or None.'''
+		
+		if not self.enabled:
+			return None
+		with self.lock:
+			return self.sessions.get((context.key, host))
+	
+	def save(self, conn):
+		'''Counts a connection's handshake, and keeps its session around once
+		it can be resumed.'''
+		
+		if conn.host is None or getattr(conn, 'saved', False):
+			return
+		
+		with self.lock:
+			if not getattr(conn, 'counted', False):
+				stats = self.stats.setdefault(conn.host, HandshakeStats())
+				if conn.session_reused:
+					stats.resumed += 1
+				else:
+					stats.full += 1
+				conn.counted = True
+			
+			session = conn.session
+			if session is not None and (session.has_ticket or conn.version() != 'TLSv1.3'):
+				self.sessions[(conn.context.key, conn.host)] = session
+				conn.saved = True
+	
+	def clear(self):
+		'''Forgets all sessions.'''
+		
+		with self.lock:
+			self.sessions.clear()
+	
+	def print_stats(self, file=sys.stderr):
+		'''Prints per-host handshake counters.'''
+		
+		for host, stats in sorted(six.iteritems(self.stats)):
+			print(u"{host}: {s.full} full TLS handshakes, {s.resumed} resumed".format(host=host, s=stats), file=file)
+
+sessions = SessionCache()
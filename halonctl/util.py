@@ -3,16 +3,21 @@ import six
 import sys
 import os
 import re
+import time
+import socket
 import datetime
-import arrow
 from base64 import b64decode, b64encode
+from six.moves.urllib.parse import urlsplit
 from collections import OrderedDict
-from concurrent.futures import ThreadPoolExecutor, wait
-from dateutil import tz
-from natsort import natsorted
+from concurrent.futures import wait, as_completed
 from .config import config
+from .scheduler import executor
 
-executor = ThreadPoolExecutor(64)
+#: How many seconds to wait for a node to answer, unless configured otherwise
+DEFAULT_TIMEOUT = 10
+
+#: How many seconds a kept-alive connection may sit idle, unless configured otherwise
+DEFAULT_IDLE_TIMEOUT = 60
 
 def async_dispatch(tasks):
 	'''Dispatches jobs into a thread pool.
@@ -22,19 +27,51 @@ def async_dispatch(tasks):
 	    { 'key': (callable, args, kwargs) }
 	
 	And dispatch it into a thread pool, completing the tasks asynchronously,
-	and returning the results. This will take as long as the slowest job.'''
+	and returning the results. This will take as long as the slowest job.
+	
+	If the keys are nodes, the concurrency limits described in
+	:mod:`halonctl.scheduler` apply.'''
 	
 	futures = {
-		executor.submit(v[0], *(v[1] if len(v) >= 2 else []), **(v[2] if len(v) >= 3 else {})): k
+		executor.submit_for(k, v[0], *(v[1] if len(v) >= 2 else []), **(v[2] if len(v) >= 3 else {})): k
 		for k, v in six.iteritems(tasks)
 	}
 	done, not_done = wait(futures)
 	
 	return { futures[future]: future.result() for future in done }
 
+def iter_dispatch(tasks, order=None):
+	'''Dispatches jobs into a thread pool, like :func:`async_dispatch`, but
+	returns an iterator over ``(key, result)`` tuples instead, yielding each
+	result as soon as it's available.
+	
+	Results are yielded in the order they complete, unless ``order`` is given
+	as a list of keys, in which case they're yielded in that order; each one
+	as soon as it and all results before it are done.'''
+	
+	futures = {
+		executor.submit_for(k, v[0], *(v[1] if len(v) >= 2 else []), **(v[2] if len(v) >= 3 else {})): k
+		for k, v in six.iteritems(tasks)
+	}
+	return iter_futures(futures, order)
+
+def iter_futures(futures, order=None):
+	'''Yields ``(key, result)`` tuples from a dictionary of ``{ future: key }``;
+	see :func:`iter_dispatch`.'''
+	
+	if order is None:
+		for future in as_completed(futures):
+			yield (futures[future], future.result())
+	else:
+		by_key = { k: future for future, k in six.iteritems(futures) }
+		for k in order:
+			yield (k, by_key[k].result())
+
 def nodesort(nodes):
 	'''Sorts a list or dictionary of nodes, by cluster and name.'''
 	
+	from natsort import natsorted
+	
 	if hasattr(nodes, 'items'):
 		return OrderedDict(natsorted(list(nodes.items()), key=lambda t: [t[0].cluster.name, t[0].name]))
 	return natsorted(nodes, key=lambda t: [t.cluster.name, t.name])
@@ -71,6 +108,9 @@ def ask_confirm(prompt, default=True):
 
 def get_date(s, timezone=0):
 	'''Returns a timezone-adjusted date as an arrow object.'''
+	
+	import arrow
+	from dateutil import tz
 	return arrow.get(arrow.get(s).naive, tz.tzoffset(None, timezone*60*60 if timezone else 0))
 
 filter_timestamp_re = re.compile(r'\{([^}]*)\}')
@@ -173,6 +213,27 @@ def group_by(data, key, unique):
 			d[k] = row
 	return d
 
+def node_address(node):
+	'''Returns a node's ``(host, port)``, with the port defaulting to the
+	scheme's default port; IPv6 addresses are given without brackets.'''
+	
+	url = urlsplit(node.url)
+	return (url.hostname, url.port or (443 if node.scheme == 'https' else 80))
+
+def tcp_probe(node, timeout=1.0):
+	'''Checks if a node is accepting connections.
+	
+	Returns the time it took to connect, in seconds, or None if a connection
+	couldn't be made within the given timeout.'''
+	
+	start = time.time()
+	try:
+		s = socket.create_connection(node_address(node), timeout)
+		s.close()
+		return time.time() - start
+	except (socket.error, socket.timeout, ValueError):
+		return None
+
 def print_ssl_error(node):
 	print(u"ERROR: Couldn't contact '{nid}': SSL verification failed!".format(nid=node.name), file=sys.stderr)
 	print(u"", file=sys.stderr)
@@ -0,0 +1,372 @@
+'''Downloading, caching and parsing of the WSDL.
+
+WSDL files downloaded from nodes are kept in a private cache directory (see
+:mod:`halonctl.cache`), named by a digest of their content, along with an
+index of which node served which one. That way, nodes running different
+versions each keep using their own WSDL, eg. in the middle of an upgrade; up
+to ``wsdl_versions`` (4 by default) different files are kept around.
+
+Every 12 hours, each node is asked whether its WSDL has changed, with a
+conditional request that only costs a full download if it actually has. Nodes
+that have never been asked are given the first WSDL any of them serves; it's
+requested from a few of them at once, and the slower ones are abandoned.
+
+Every node talks the same SOAP API, so rather than having suds parse the
+cached WSDL over again for every node, it's parsed once per process, and each
+node gets a lightweight client sharing the parsed service model, the first
+time it makes a call.
+
+The parsed model is also pickled into a private cache directory (see
+:mod:`halonctl.cache`), keyed by the WSDL's content and the versions of suds
+and Python, so later runs can skip parsing the schema altogether. Since
+unpickling something can run arbitrary code, it's only ever read back from
+the current user's own cache directory, if it's private, and from files
+they own; otherwise, the WSDL is parsed over again.
+'''
+
+from __future__ import print_function
+import six
+import os
+import sys
+import json
+import time
+import hashlib
+import requests
+import suds
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+from threading import Lock, Event
+from six.moves import cPickle as pickle
+from suds.cache import Cache
+from suds.client import Client, ServiceSelector
+from suds.options import Options
+from suds.transport.http import HttpAuthenticated
+from .util import async_dispatch, print_ssl_error, DEFAULT_TIMEOUT
+from .scheduler import executor
+from .config import config
+from . import cache
+
+DIRNAME = u"definitions"
+WSDL_DIRNAME = u"wsdl"
+INDEX = u"index.json"
+
+MAX_AGE = 12 * 60 * 60
+DEFAULT_VERSIONS = 4
+
+#: How many nodes to download a new WSDL from at once
+FETCH_CONCURRENCY = 4
+CHUNK_SIZE = 64 * 1024
+
+def last_latency(node, health=None):
+	'''Returns how long it took to connect to a node the last time it was
+	probed, or infinity if it wasn't reachable or hasn't been probed.'''
+	
+	h = cache.get_node_health(node, health)
+	return h['latency'] if h and h['up'] else float('inf')
+
+class WsdlStore(object):
+	'''Keeps track of the WSDL files served by nodes.
+	
+	The index is a dictionary of ``{ "latest": digest, "nodes": { "scheme://host":
+	{ "digest": str, "etag": str, "modified": str, "checked": float } } }``.
+	'''
+	
+	def __init__(self):
+		self.index = None
+		self.installed = {}
+		self.lock = Lock()
+	
+	def path(self, digest):
+		return os.path.join(cache.get_path(WSDL_DIRNAME), u"{0}.xml".format(digest))
+	
+	def load_index(self):
+		data = cache.get_entry(WSDL_DIRNAME, INDEX)
+		try:
+			index = json.loads(data.decode('utf-8')) if data else {}
+		except ValueError:
+			index = {}
+		index.setdefault('latest', None)
+		index.setdefault('nodes', {})
+		return index
+	
+	def get_index(self):
+		if self.index is None:
+			with self.lock:
+				if self.index is None:
+					self.index = self.load_index()
+		return self.index
+	
+	def node_path(self, node):
+		'''Returns the path to the WSDL file to use for a node, or None if
+		there's none at all.'''
+		
+		if cache.private_dir(WSDL_DIRNAME) is None:
+			return None
+		
+		installed = self.installed.get(cache.node_key(node))
+		if installed:
+			return self.path(installed) if os.path.exists(self.path(installed)) else None
+		
+		index = self.get_index()
+		entry = index['nodes'].get(cache.node_key(node))
+		for digest in (entry['digest'] if entry else None, index['latest']):
+			if digest and os.path.exists(self.path(digest)):
+				return self.path(digest)
+		return None
+	
+	def fetch(self, node, verify, entry=None, cancel=None):
+		'''Downloads a node's WSDL, unless it's the same as in the given index
+		entry. Returns a new index entry, or None if the node couldn't be
+		reached, or the download was cancelled by setting ``cancel``.'''
+		
+		headers = {}
+		if entry and entry.get('etag'):
+			headers['If-None-Match'] = entry['etag']
+		if entry and entry.get('modified'):
+			headers['If-Modified-Since'] = entry['modified']
+		
+		try:
+			r = requests.get(u"{scheme}://{host}/remote/?wsdl".format(scheme=node.scheme, host=node.host),
+				headers=headers, stream=True, timeout=config.get('timeout', DEFAULT_TIMEOUT),
+				verify=False if node.no_verify else verify)
+			try:
+				if r.status_code == 304 and entry:
+					return dict(entry)
+				elif r.status_code != 200:
+					return None
+				
+				chunks = []
+				for chunk in r.iter_content(CHUNK_SIZE):
+					if cancel is not None and cancel.is_set():
+						return None
+					chunks.append(chunk)
+				content = b''.join(chunks)
+			finally:
+				r.close()
+		except requests.exceptions.SSLError:
+			print_ssl_error(node)
+			sys.exit(1)
+		except requests.exceptions.RequestException:
+			return None
+		
+		digest = hashlib.sha1(content).hexdigest()
+		if not os.path.exists(self.path(digest)):
+			cache.set_entry(WSDL_DIRNAME, u"{0}.xml".format(digest), content)
+		return { 'digest': digest, 'etag': r.headers.get('ETag'), 'modified': r.headers.get('Last-Modified') }
+	
+	def fetch_first(self, nodes, verify):
+		'''Downloads the WSDL from whichever of the given nodes serves it
+		first, trying them in order, a few at a time. Returns a new index
+		entry, or None if none of them could be reached.'''
+		
+		candidates = deque(nodes)
+		cancel = Event()
+		futures = set()
+		def submit():
+			node = candidates.popleft()
+			futures.add(executor.submit_for(node, self.fetch, node, verify, None, cancel))
+		
+		for i in range(min(FETCH_CONCURRENCY, len(candidates))):
+			submit()
+		try:
+			while futures:
+				done, _ = wait(futures, return_when=FIRST_COMPLETED)
+				for future in done:
+					futures.remove(future)
+					result = future.result()
+					if result is not None:
+						return result
+					if candidates:
+						submit()
+			return None
+		finally:
+			# Downloads still in flight stop at their next chunk
+			cancel.set()
+			for future in futures:
+				future.cancel()
+	
+	def refresh(self, nodes, verify, down=()):
+		'''Makes sure there's an up-to-date WSDL for every node; nodes that
+		are known to be down aren't asked, but still need one.
+		
+		Returns False if there's no WSDL at all to use for some of them.'''
+		
+		index = self.load_index()
+		now = time.time()
+		
+		def entry(node):
+			e = index['nodes'].get(cache.node_key(node))
+			return e if e and os.path.exists(self.path(e['digest'])) else None
+		
+		up = [node for node in nodes if not node in down]
+		unknown = [node for node in up if entry(node) is None]
+		stale = [node for node in up if not node in unknown and now - entry(node)['checked'] > MAX_AGE]
+		
+		# Most nodes will still be serving the same WSDL as last time; if a
+		# node can't be reached, keep using what it served before
+		results = async_dispatch({ node: (self.fetch, (node, verify, entry(node))) for node in stale })
+		for node, result in six.iteritems(results):
+			if result is not None:
+				self.record(index, node, result, now)
+		
+		if unknown:
+			# Try the nodes that answered the fastest last time first
+			health = cache.get_health()
+			result = self.fetch_first(sorted(unknown, key=lambda node: last_latency(node, health)), verify)
+			if result is not None:
+				for node in unknown:
+					self.record(index, node, result, now)
+		
+		self.prune(index)
+		cache.set_entry(WSDL_DIRNAME, INDEX, json.dumps(index).encode('utf-8'))
+		with self.lock:
+			self.index = index
+		
+		return all(self.node_path(node) for node in nodes)
+	
+	def install(self, node, content):
+		'''Uses a WSDL for a node instead of the one it serves, until
+		:func:`uninstall` is called; see :mod:`halonctl.capture`. It's kept
+		out of the index, so later runs go back to the node's own.'''
+		
+		digest = hashlib.sha1(content).hexdigest()
+		if not os.path.exists(self.path(digest)):
+			cache.set_entry(WSDL_DIRNAME, u"{0}.xml".format(digest), content)
+		with self.lock:
+			self.installed[cache.node_key(node)] = digest
+	
+	def uninstall(self):
+		'''Goes back to the WSDL each node serves.'''
+		
+		with self.lock:
+			self.installed = {}
+	
+	def record(self, index, node, entry, now):
+		entry = dict(entry, checked=now)
+		previous = index['nodes'].get(cache.node_key(node))
+		if not previous or previous['digest'] != entry['digest']:
+			index['latest'] = entry['digest']
+		index['nodes'][cache.node_key(node)] = entry
+	
+	def prune(self, index):
+		'''Drops all but the most recently seen WSDL versions.'''
+		
+		seen = {}
+		for entry in six.itervalues(index['nodes']):
+			seen[entry['digest']] = max(seen.get(entry['digest'], 0), entry['checked'])
+		if index['latest']:
+			seen[index['latest']] = float('inf')
+		keep = set(sorted(seen, key=lambda digest: seen[digest], reverse=True)[:max(1, config.get('wsdl_versions', DEFAULT_VERSIONS))])
+		
+		index['nodes'] = { key: entry for key, entry in six.iteritems(index['nodes']) if entry['digest'] in keep }
+		path = cache.private_dir(WSDL_DIRNAME)
+		if path is None:
+			return
+		try:
+			names = os.listdir(path)
+		except OSError:
+			return
+		for name in names:
+			if name.endswith(u".xml") and not name[:-4] in keep:
+				cache.remove_entries(WSDL_DIRNAME, name)
+	
+	def clear(self):
+		'''Removes all downloaded WSDL files.'''
+		
+		with self.lock:
+			self.index = None
+			self.installed = {}
+		cache.remove_entries(WSDL_DIRNAME)
+
+class DefinitionsCache(Cache):
+	'''A suds object cache for a single WSDL document, identified by a digest
+	of its content.
+	
+	Entries are kept in a private cache directory, and nothing is unpickled
+	from one that isn't; see :func:`halonctl.cache.open_entry`.'''
+	
+	def __init__(self, digest):
+		self.digest = digest
+	
+	def entry_name(self, id):
+		h = hashlib.sha1()
+		for part in (self.digest, id, suds.__version__, sys.version_info[:2]):
+			h.update(six.text_type(part).encode('utf-8'))
+			h.update(b'\0')
+		return h.hexdigest()
+	
+	def get(self, id):
+		data = cache.get_entry(DIRNAME, self.entry_name(id))
+		if data:
+			try:
+				return pickle.loads(data)
+			except Exception:
+				pass
+		return None
+	
+	def put(self, id, object):
+		try:
+			cache.set_entry(DIRNAME, self.entry_name(id), pickle.dumps(object, pickle.HIGHEST_PROTOCOL))
+		except Exception:
+			# Not being able to cache it only makes the next run slower
+			pass
+		return object
+	
+	def purge(self, id):
+		cache.remove_entries(DIRNAME, self.entry_name(id))
+	
+	def clear(self):
+		cache.remove_entries(DIRNAME)
+
+class ClientFactory(object):
+	'''Parses each WSDL file once, and hands out per-node clients built on
+	top of it.'''
+	
+	def __init__(self):
+		self.bases = {}
+		self.lock = Lock()
+	
+	def base_client(self, path):
+		'''Returns a client for a WSDL file, parsing it if it hasn't been
+		already, or if it's changed since.'''
+		
+		st = os.stat(path)
+		key = (st.st_mtime, st.st_size)
+		with self.lock:
+			if self.bases.get(path, (None, None))[0] != key:
+				with open(path, 'rb') as f:
+					digest = hashlib.sha1(f.read()).hexdigest()
+				base = Client("file:{0}".format(path), faults=False, nosend=True, cache=DefinitionsCache(digest), cachingpolicy=1)
+				base.set_options(cache=None)
+				self.bases[path] = (key, base)
+			return self.bases[path][1]
+	
+	def client(self, location, path):
+		'''Returns a new client sharing the parsed WSDL, sending requests to
+		the given location.
+		
+		This is what :func:`suds.client.Client.clone` does, except that the
+		options are set anew rather than deep-copied, which is both faster
+		and works around recursion errors in some versions of suds.'''
+		
+		base = self.base_client(path)
+		client = Client.__new__(Client)
+		client.options = Options()
+		client.options.transport = HttpAuthenticated()
+		client.set_options(faults=False, nosend=True, cache=None, location=location)
+		client.wsdl = base.wsdl
+		client.factory = base.factory
+		client.service = ServiceSelector(client, base.wsdl.services)
+		client.sd = base.sd
+		client.messages = dict(tx=None, rx=None)
+		return client
+	
+	def clear(self):
+		'''Forgets the parsed WSDL, and removes any pickled copies of it.'''
+		
+		with self.lock:
+			self.bases.clear()
+		cache.remove_entries(DIRNAME)
+
+wsdls = WsdlStore()
+clients = ClientFactory()
@@ -0,0 +1,83 @@
+'''Times loading the configuration, parsed in full versus from a snapshot.
+
+For each fleet size, a configuration is generated with clusters of 100 nodes
+(see :func:`halonctl.simulator.generate_config`), and the median time to load
+it and pick one cluster, one node or a selector from it is printed, as is
+the time it takes to compile the snapshot in the first place.
+
+    python run_config_bench.py [sizes] [iterations]
+'''
+
+from __future__ import print_function
+import os
+import sys
+import json
+import shutil
+import timeit
+import tempfile
+from collections import OrderedDict
+from halonctl.models import Node, NodeList
+from halonctl.simulator import generate_config
+from halonctl.snapshot import configurations
+
+def median(values):
+	values = sorted(values)
+	return values[len(values) // 2]
+
+def create_all(conf):
+	'''Creates every node and cluster up front, the way configurations were
+	loaded before snapshots.'''
+	
+	nodes = OrderedDict([(name, Node(data, name)) for name, data in conf.get('nodes', {}).items()])
+	clusters = {}
+	for name, data in conf.get('clusters', {}).items():
+		cluster = NodeList()
+		cluster.name = name
+		cluster.load_data(data)
+		for nid in data['nodes'] if isinstance(data, dict) else data:
+			nodes[nid].cluster = cluster
+			cluster.append(nodes[nid])
+		clusters[name] = cluster
+	return (nodes, clusters)
+
+def parsed(path, pick):
+	with open(path, 'r') as f:
+		conf = json.load(f, object_pairs_hook=OrderedDict)
+	nodes, clusters = create_all(conf)
+	return pick(nodes, clusters)
+
+def snapshot(path, pick):
+	configurations.loaded.clear()
+	with open(path, 'r') as f:
+		configuration = configurations.load(f)
+	return pick(configuration)
+
+if __name__ == '__main__':
+	sizes = [int(size) for size in sys.argv[1].split(',')] if len(sys.argv) > 1 else [1000, 10000, 50000]
+	number = int(sys.argv[2]) if len(sys.argv) > 2 else 9
+	
+	tempdir = tempfile.mkdtemp()
+	os.environ['XDG_CACHE_HOME'] = tempdir
+	try:
+		print(u"{0:>8}{1:>12}{2:>12}{3:>12}{4:>12}{5:>12}".format(u"Nodes", u"Compile", u"Parsed", u"Cluster", u"Node", u"Selector"))
+		for size in sizes:
+			path = os.path.join(tempdir, u"halonctl-{0}.json".format(size))
+			conf = generate_config(size, 8080, 100)
+			conf['tags'] = { 'canary': list(conf['nodes'])[::100] }
+			with open(path, 'w') as f:
+				json.dump(conf, f)
+			
+			cluster = list(conf['clusters'])[len(conf['clusters']) // 2]
+			node = list(conf['nodes'])[size // 2]
+			
+			compiled = median(timeit.repeat(lambda: os.utime(path, None) or snapshot(path, lambda c: c), number=1, repeat=3))
+			times = [
+				median(timeit.repeat(lambda: parsed(path, lambda nodes, clusters: clusters[cluster]), number=1, repeat=number)),
+				median(timeit.repeat(lambda: snapshot(path, lambda c: c.cluster(cluster)), number=1, repeat=number)),
+				median(timeit.repeat(lambda: snapshot(path, lambda c: c.node(node)), number=1, repeat=number)),
+				median(timeit.repeat(lambda: snapshot(path, lambda c: c.get_inventory().select(u"tag:canary & {0}*".format(node[:-2]))), number=1, repeat=number)),
+			]
+			print(u"{0:>8}{1:>12}".format(size, u"{0:.1f} ms".format(compiled * 1e3)) + u"".join(u"{0:>12}".format(u"{0:.1f} ms".format(t * 1e3)) for t in times))
+	finally:
+		configurations.clear()
+		shutil.rmtree(tempdir)
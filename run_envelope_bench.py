@@ -0,0 +1,41 @@
+'''Compares envelope building through suds against precompiled templates.
+
+Uses the cached WSDL if there is one (ie. halonctl has been run against a real
+node), otherwise the one the simulator serves; a path can also be given.
+
+    python run_envelope_bench.py [path/to/wsdl.xml] [iterations]
+'''
+
+from __future__ import print_function
+import os
+import sys
+import timeit
+from suds.client import Client
+from halonctl.envelopes import EnvelopeCache
+from halonctl.simulator import DEFAULT_WSDL
+from halonctl import cache
+
+CALLS = [
+	('getUptime', (), {}),
+	('login', (), {}),
+	('commandPoll', (), {'commandid': '1234'}),
+	('statList', ('mail', None, None), {'limit': 10000}),
+]
+
+if __name__ == '__main__':
+	path = sys.argv[1] if len(sys.argv) > 1 else cache.get_path('wsdl.xml')
+	if not os.path.exists(path):
+		path = DEFAULT_WSDL
+	number = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+	
+	client = Client("file:{0}".format(os.path.abspath(path)), location="http://localhost/remote/", faults=False, nosend=True)
+	client.set_options(cache=None)
+	envelopes = EnvelopeCache()
+	
+	print(u"WSDL: {0}".format(path))
+	print(u"{0:<16}{1:>14}{2:>14}{3:>10}".format(u"Call", u"suds (us)", u"template (us)", u"Speedup"))
+	for name, args, kwargs in CALLS:
+		suds_time = timeit.timeit(lambda: getattr(client.service, name)(*args, **kwargs), number=number)
+		template_time = timeit.timeit(lambda: envelopes.make_request(client, name, args, kwargs), number=number)
+		print(u"{0:<16}{1:>14.1f}{2:>14.1f}{3:>9.1f}x".format(name,
+			suds_time / number * 1e6, template_time / number * 1e6, suds_time / template_time))
@@ -0,0 +1,55 @@
+'''Times building an inventory, and resolving selectors against it.
+
+Generates a configuration with the given number of nodes, spread over 100
+clusters and 100 tags, and prints the median time each selector takes.
+
+    python run_inventory_bench.py [nodes] [iterations]
+'''
+
+from __future__ import print_function
+import sys
+import timeit
+from halonctl.__main__ import process_config
+from halonctl.inventory import Inventory
+
+SELECTORS = [
+	'mx-00042',
+	'cluster:c042',
+	'tag:t042',
+	'mx-0004*',
+	'mx-*7',
+	'cluster:c0?? & tag:t01*',
+	r'/^mx-\d{4}1$/',
+	'host:10.0.1.*',
+	'cluster:c04* & !tag:t042',
+	'(tag:t00* | tag:t01*) & !cluster:/^c0[5-9]\d$/',
+]
+
+def make_config(count):
+	return {
+		'nodes': { 'mx-{0:05d}'.format(i): 'admin@10.{0}.{1}.{2}'.format(i // 65536, i // 256 % 256, i % 256) for i in range(count) },
+		'clusters': { 'c{0:03d}'.format(c): ['mx-{0:05d}'.format(i) for i in range(c, count, 100)] for c in range(100) },
+		'tags': { 't{0:03d}'.format(t): ['mx-{0:05d}'.format(i) for i in range(count) if i // 7 % 100 == t] for t in range(100) },
+	}
+
+def median(values):
+	values = sorted(values)
+	return values[len(values) // 2]
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+	number = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+	
+	conf = make_config(count)
+	nodes, clusters = process_config(conf)
+	build = median(timeit.repeat(lambda: Inventory(nodes, clusters, conf['tags']), number=1, repeat=5))
+	inventory = Inventory(nodes, clusters, conf['tags'])
+	
+	print(u"{0} nodes, index built in {1:.1f} ms".format(count, build * 1e3))
+	print(u"{0:<48}{1:>8}{2:>12}{3:>12}".format(u"Selector", u"Nodes", u"First (us)", u"Median (us)"))
+	for selector in SELECTORS:
+		for index in inventory.indexes.values():
+			index.memo.clear()
+		first = timeit.timeit(lambda: inventory.select(selector), number=1)
+		times = timeit.repeat(lambda: inventory.select(selector), number=1, repeat=number)
+		print(u"{0:<48}{1:>8}{2:>12.1f}{3:>12.1f}".format(selector, len(inventory.select(selector)), first * 1e6, median(times) * 1e6))
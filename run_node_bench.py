@@ -0,0 +1,87 @@
+'''Compares the memory use and attribute access of nodes against an earlier
+revision's, where nodes each had a ``__dict__`` and a new call proxy was made
+every time ``node.service`` was used.
+
+The earlier :mod:`halonctl.models` is read out of git; by default, from the
+last revision before nodes were slotted.
+
+    python run_node_bench.py [nodes] [revision]
+'''
+
+from __future__ import print_function
+import os
+import sys
+import types
+import timeit
+import tracemalloc
+import subprocess
+from halonctl import models
+
+# Imported by node.service; imported up front, so it's not counted as nodes' memory
+from halonctl import proxies
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+
+#: The last revision with the old Node
+BASELINE = '31e8c23'
+
+ATTRIBUTES = [
+	('name', lambda node: node.name),
+	('host', lambda node: node.host),
+	('cluster', lambda node: node.cluster),
+	('username', lambda node: node.username),
+	('password', lambda node: node.password),
+	('url', lambda node: node.url),
+	('service', lambda node: node.service),
+	('service.getUptime', lambda node: node.service.getUptime),
+]
+
+def load_models(revision):
+	'''Imports :mod:`halonctl.models` as it was in an earlier revision.'''
+	
+	source = subprocess.check_output(['git', 'show', '{0}:halonctl/models.py'.format(revision)], cwd=BASE)
+	module = types.ModuleType('halonctl.models_{0}'.format(revision))
+	module.__package__ = 'halonctl'
+	exec(compile(source, 'models.py@{0}'.format(revision), 'exec'), module.__dict__)
+	return module
+
+def make_nodes(module, count):
+	cluster = module.NodeList()
+	cluster.name = u"cluster"
+	for i in range(count):
+		cluster.append(module.Node(u"admin:secret@10.{0}.{1}.{2}".format(i // 65536, i // 256 % 256, i % 256), u"node{0}".format(i), cluster))
+	return cluster
+
+def memory(module, count):
+	'''Returns how many bytes each node takes, before and after its proxy
+	has been used.'''
+	
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	nodes = make_nodes(module, count)
+	created = tracemalloc.get_traced_memory()[0]
+	for node in nodes:
+		node.service.getUptime
+	used = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return ((created - before) / float(count), (used - before) / float(count))
+
+def access(module, get, number=200000):
+	node = make_nodes(module, 1)[0]
+	return min(timeit.repeat(lambda: get(node), number=number, repeat=5)) / number
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+	revision = sys.argv[2] if len(sys.argv) > 2 else BASELINE
+	
+	old = load_models(revision)
+	print(u"{0} nodes, against {1}".format(count, revision))
+	print(u"{0:<20}{1:>12}{2:>12}{3:>10}".format(u"Bytes per node", revision, u"Current", u"Saved"))
+	for label, old_bytes, new_bytes in zip([u"created", u"service used"], memory(old, count), memory(models, count)):
+		print(u"{0:<20}{1:>12.0f}{2:>12.0f}{3:>9.0f}%".format(label, old_bytes, new_bytes, (1 - new_bytes / old_bytes) * 100))
+	
+	print(u"")
+	print(u"{0:<20}{1:>12}{2:>12}{3:>10}".format(u"Access (ns)", revision, u"Current", u"Speedup"))
+	for label, get in ATTRIBUTES:
+		old_time, new_time = access(old, get), access(models, get)
+		print(u"{0:<20}{1:>12.1f}{2:>12.1f}{3:>9.1f}x".format(label, old_time * 1e9, new_time * 1e9, old_time / new_time))
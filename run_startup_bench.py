@@ -0,0 +1,91 @@
+'''Measures how long halonctl takes to start, for runs that never contact a node.
+
+Each scenario is run in a fresh interpreter a number of times, and the median
+wall time is reported, followed by the time spent importing each package, as
+reported by ``python -X importtime`` (Python 3.7+). Time is attributed to the
+package a module belongs to, not counting other packages it imports in turn.
+
+    python run_startup_bench.py [runs] [packages to list]
+'''
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from collections import defaultdict
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = [
+	('version', ['--version']),
+	('dry', ['-C', '{config}', '--dry', 'status']),
+	('arg error', ['-C', '{config}', 'query', '-n', 'x']),
+	('help', ['query', '-h']),
+]
+
+#: Packages that only runs contacting a node should ever need
+NETWORK = ['requests', 'urllib3', 'suds', 'keyring', 'arrow', 'dateutil', 'natsort', 'pkg_resources']
+
+def command(args, config, importtime=False):
+	cmd = [sys.executable] + (['-X', 'importtime'] if importtime else [])
+	return cmd + ['-m', 'halonctl', '--no-agent'] + [arg.format(config=config) for arg in args]
+
+def run(cmd, env):
+	with open(os.devnull, 'w') as devnull:
+		start = time.time()
+		subprocess.call(cmd, cwd=BASE, env=env, stdout=devnull, stderr=devnull)
+		return time.time() - start
+
+def import_times(cmd, env):
+	'''Returns ``{ package: seconds }`` for a run.'''
+	
+	p = subprocess.Popen(cmd, cwd=BASE, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	_, err = p.communicate()
+	
+	times = defaultdict(float)
+	for line in err.decode('utf-8', 'replace').splitlines():
+		if not line.startswith('import time:') or 'self [us]' in line:
+			continue
+		self_us, _, name = line[len('import time:'):].split('|')
+		times[name.strip().split('.')[0]] += int(self_us) / 1e6
+	return times
+
+if __name__ == '__main__':
+	runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+	top = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+	
+	# Keep halonctl's caches (eg. the module manifest) away from the real ones
+	tempdir = tempfile.mkdtemp()
+	env = dict(os.environ, XDG_CACHE_HOME=tempdir, HALONCTL_AGENT_SOCKET=os.path.join(tempdir, 'none.sock'))
+	config = os.path.join(tempdir, 'halonctl.json')
+	with open(config, 'w') as f:
+		json.dump({
+			'nodes': { 'node{0}'.format(i): 'admin@10.0.{0}.{1}'.format(i // 256, i % 256) for i in range(100) },
+			'clusters': { 'all': ['node{0}'.format(i) for i in range(100)] },
+		}, f)
+	
+	try:
+		results = []
+		for name, args in SCENARIOS:
+			run(command(args, config), env)	# Builds the manifest on the first run
+			walls = sorted(run(command(args, config), env) for i in range(runs))
+			imports = import_times(command(args, config, True), env) if sys.version_info >= (3, 7) else {}
+			results.append((name, walls[len(walls) // 2], imports))
+		
+		print(u"Python {0}, median of {1} runs".format(sys.version.split()[0], runs))
+		print(u"{0:<12}{1:>12}{2:>14}  {3}".format(u"Scenario", u"Wall (ms)", u"Imports (ms)", u"Network stack"))
+		for name, wall, imports in results:
+			loaded = [pkg for pkg in NETWORK if pkg in imports]
+			print(u"{0:<12}{1:>12.1f}{2:>14.1f}  {3}".format(name, wall * 1e3, sum(imports.values()) * 1e3, u", ".join(loaded) or u"-"))
+		
+		for name, wall, imports in results:
+			print(u"")
+			print(u"Slowest imports for '{0}' (ms):".format(name))
+			for pkg, seconds in sorted(imports.items(), key=lambda t: t[1], reverse=True)[:top]:
+				print(u"  {0:<24}{1:>8.1f}".format(pkg, seconds * 1e3))
+	finally:
+		shutil.rmtree(tempdir)
@@ -10,7 +10,8 @@ setup(name='halonctl',
 	packages=['halonctl', 'halonctl.modules', 'halonctl.formatters'],
 	entry_points={
 		'console_scripts': [
-			'halonctl = halonctl.__main__:main'
+			'halonctl = halonctl.agent:cli',
+			'halonctl-agent = halonctl.agent:main'
 		]
 	},
 	license='BSD',
@@ -41,9 +42,10 @@ setup(name='halonctl',
 		'prettytable',	# Fancy ASCII tables, feat. Py3 compatibility
 		'blessings',	# Portable TTY abstractions
 		'requests',		# "HTTP for Humans"
-		'six',			# Python 2/3 compatibility utilities
+		'six>=1.13',	# Python 2/3 compatibility utilities
 	],
 	package_data={
-		'': ['*.json']
+		'': ['*.json'],
+		'halonctl': ['simulator.wsdl']
 	},
 )
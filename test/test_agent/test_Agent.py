@@ -0,0 +1,144 @@
+import os
+import time
+import shutil
+import unittest
+import tempfile
+import threading
+from halonctl.agent import Agent, Fallback, is_supported, forward, stop, socket_path, keyring_request
+from halonctl import agent, cache
+from halonctl.credentials import CredentialStore
+from halonctl.config import config
+
+def runner(argv):
+	if argv == ['local']:
+		raise Fallback()
+	elif argv == ['fail']:
+		raise SystemExit(u"Something went wrong")
+	raise SystemExit(int(argv[0]))
+
+def keyring(passwords):
+	lookups = []
+	def backend(host, username):
+		lookups.append((host, username))
+		return passwords.get((host, username))
+	return backend, lookups
+
+@unittest.skipUnless(is_supported(), "unix sockets are not supported")
+class TestAgent(unittest.TestCase):
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmpdir, 'agent.sock')
+		os.environ['HALONCTL_AGENT_SOCKET'] = self.path
+		
+		self.shared = CredentialStore(backend=None)
+		self.shared.remote = False
+		self.agent = Agent(self.path, runner, self.shared)
+		self.thread = threading.Thread(target=self.agent.serve_forever)
+		self.thread.start()
+		while not self.agent.running:
+			pass
+	
+	def tearDown(self):
+		stop(self.path)
+		self.thread.join()
+		del os.environ['HALONCTL_AGENT_SOCKET']
+		config.pop('keyring_cache', None)
+		shutil.rmtree(self.tmpdir)
+	
+	def test_exitcode(self):
+		self.assertEqual(forward(['0']), 0)
+		self.assertEqual(forward(['3']), 3)
+		self.assertEqual(forward(['fail']), 1)
+	
+	def test_fallback(self):
+		self.assertEqual(forward(['local']), None)
+		self.assertEqual(forward(['--no-agent']), None)
+	
+	def test_other_user(self):
+		peer_uid = agent.peer_uid
+		agent.peer_uid = lambda conn, path: os.getuid() + 1
+		try:
+			self.assertEqual(forward(['0']), None)
+		finally:
+			agent.peer_uid = peer_uid
+		self.assertEqual(forward(['0']), 0)
+	
+	def test_stop(self):
+		self.assertTrue(stop(self.path))
+		self.thread.join()
+		self.assertFalse(os.path.exists(self.path))
+		self.assertEqual(forward(['0']), None)
+	
+	def test_keyring_cache(self):
+		config['keyring_cache'] = 60
+		backend, lookups = keyring({ ('h1', 'admin'): 'secret' })
+		
+		self.assertEqual(CredentialStore(backend).keyring_password('h1', 'admin'), 'secret')
+		self.assertEqual(CredentialStore(backend).keyring_password('h1', 'admin'), 'secret')
+		self.assertEqual(lookups, [('h1', 'admin')])
+		self.assertEqual(self.shared.entries([('h1', 'admin')])[('h1', 'admin')][0], 'secret')
+		
+		CredentialStore(backend).flush([('h1', 'admin')])
+		self.assertEqual(self.shared.entries([('h1', 'admin')]), {})
+		self.assertEqual(CredentialStore(backend).keyring_password('h1', 'admin'), 'secret')
+		self.assertEqual(len(lookups), 2)
+	
+	def test_keyring_expiry(self):
+		config['keyring_cache'] = 60
+		backend, lookups = keyring({ ('h1', 'admin'): 'secret' })
+		self.shared.update({ ('h1', 'admin'): ('old', time.time() - 1) })
+		
+		self.assertEqual(CredentialStore(backend).keyring_password('h1', 'admin'), 'secret')
+		self.assertEqual(lookups, [('h1', 'admin')])
+	
+	def test_keyring_disabled(self):
+		backend, lookups = keyring({ ('h1', 'admin'): 'secret' })
+		self.assertEqual(CredentialStore(backend).keyring_password('h1', 'admin'), 'secret')
+		self.assertEqual(self.shared.keyring, {})
+	
+	def test_keyring_stored(self):
+		config['keyring_cache'] = 60
+		backend, lookups = keyring({})
+		CredentialStore(backend).stored('h1', 'admin', 'new')
+		self.assertEqual(CredentialStore(backend).keyring_password('h1', 'admin'), 'new')
+		
+		CredentialStore(backend).stored('h1', 'admin', None)
+		self.assertIsNone(CredentialStore(backend).keyring_password('h1', 'admin'))
+		self.assertEqual(lookups, [('h1', 'admin')])
+	
+	def test_keyring_stored_uncached(self):
+		backend, lookups = keyring({})
+		self.shared.update({ ('h1', 'admin'): ('old', time.time() + 60) })
+		CredentialStore(backend).stored('h1', 'admin', 'new')
+		self.assertEqual(self.shared.keyring, {})
+	
+	def test_keyring_unexpiring(self):
+		config['keyring_cache'] = 60
+		keyring_request({ 'keyring': 'put', 'entries': [['h1', 'admin', 'secret', None]] })
+		self.assertEqual(self.shared.keyring, {})
+		
+		self.shared.update({ ('h2', 'admin'): ('secret', None) })
+		self.assertEqual(forward(['0']), 0)
+		self.assertEqual(self.shared.keyring, {})
+
+class TestSocketPath(unittest.TestCase):
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.environ = dict(os.environ)
+		os.environ.pop('HALONCTL_AGENT_SOCKET', None)
+		os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmpdir, 'cache')
+	
+	def tearDown(self):
+		os.environ.clear()
+		os.environ.update(self.environ)
+		cache.checked.clear()
+		shutil.rmtree(self.tmpdir)
+	
+	def test_runtime_dir(self):
+		os.environ['XDG_RUNTIME_DIR'] = self.tmpdir
+		os.chmod(self.tmpdir, 0o700)
+		self.assertEqual(socket_path(), os.path.join(self.tmpdir, 'halonctl-agent.sock'))
+	
+	def test_cache_dir(self):
+		os.environ.pop('XDG_RUNTIME_DIR', None)
+		self.assertEqual(socket_path(), os.path.join(self.tmpdir, 'cache', 'halonctl', 'agent.sock'))
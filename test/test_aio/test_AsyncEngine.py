@@ -0,0 +1,175 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from threading import Thread
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from six.moves.socketserver import ThreadingMixIn
+from halonctl.models import Node
+from halonctl.aio import AsyncEngine
+from halonctl.responses import responses
+from halonctl.breaker import breakers, CLOSED
+from halonctl.config import config
+
+class EchoHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers['Content-Length']))
+		if body == b'malformed':
+			self.wfile.write(b'HTTP/1.1\r\n\r\n')
+			self.close_connection = True
+			return
+		elif body == b'close':
+			self.close_connection = True
+		elif body == b'slow':
+			time.sleep(0.5)
+		
+		if self.headers.get('SOAPAction') != '"test"':
+			self.send_response(400)
+		else:
+			self.send_response(200 if self.headers.get('Authorization') else 401)
+		if body == b'chunked':
+			self.send_header('Transfer-Encoding', 'chunked')
+			self.end_headers()
+			self.wfile.write(b'3\r\nchu\r\n4\r\nnked\r\n0\r\n\r\n')
+		else:
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+	
+	def log_message(self, *args):
+		pass
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+class FakeMethod(object):
+	def __init__(self, name):
+		self.name = name
+
+class FakeClient(object):
+	def __init__(self, url, method=None):
+		self.url = url
+		self.method = FakeMethod(method)
+	
+	def location(self):
+		return self.url
+	
+	def headers(self):
+		return {'Content-Type': 'text/xml; charset=utf-8', 'SOAPAction': b'"test"'}
+
+class FakeContext(object):
+	def __init__(self, url, envelope, method=None):
+		self.client = FakeClient(url, method)
+		self.envelope = envelope
+	
+	def process_reply(self, content, status, reason):
+		return (status, content)
+
+class TestAsyncEngine(unittest.TestCase):
+	def setUp(self):
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), EchoHandler)
+		self.thread = Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+		self.host = '127.0.0.1:{0}'.format(self.server.server_address[1])
+		self.engine = AsyncEngine()
+	
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+	
+	def test_call(self):
+		node = Node("admin:password@" + self.host, 'n1')
+		self.assertEqual(self.engine.call(node, FakeContext(node.url, b'hello')), (200, b'hello'))
+	
+	def test_dispatch(self):
+		nodes = [Node("admin:password@" + self.host, 'n{0}'.format(i)) for i in range(20)]
+		contexts = { node: FakeContext(node.url, node.name.encode('utf-8')) for node in nodes }
+		results = self.engine.dispatch(contexts)
+		self.assertEqual(results, { node: (200, node.name.encode('utf-8')) for node in nodes })
+	
+	def test_reuses_connections(self):
+		node = Node("admin:password@" + self.host, 'n1')
+		self.engine.call(node, FakeContext(node.url, b'1'))
+		self.engine.call(node, FakeContext(node.url, b'2'))
+		self.assertEqual(sum(len(idle) for idle in self.engine.idle.values()), 1)
+	
+	def test_chunked(self):
+		node = Node("admin:password@" + self.host, 'n1')
+		self.assertEqual(self.engine.call(node, FakeContext(node.url, b'chunked')), (200, b'chunked'))
+	
+	def test_no_credentials(self):
+		node = Node(self.host, 'n1')
+		self.assertEqual(self.engine.call(node, FakeContext(node.url, b'x'))[0], 401)
+	
+	def test_unreachable(self):
+		node = Node("admin@127.0.0.1:1", 'n1')
+		self.assertEqual(self.engine.call(node, FakeContext(node.url, b'x')), (0, None))
+	
+	def test_slow_reply(self):
+		node = Node("admin:password@" + self.host, 'n1')
+		config['timeout'] = 0.2
+		try:
+			self.assertEqual(self.engine.call(node, FakeContext(node.url, b'slow')), (0, None))
+		finally:
+			config.clear()
+		self.assertEqual(breakers.get(node).state, CLOSED)
+		self.assertEqual(self.engine.call(node, FakeContext(node.url, b'1')), (200, b'1'))
+	
+	def test_chain(self):
+		nodes = [Node("admin:password@" + self.host, 'n{0}'.format(i)) for i in range(5)]
+		chains = { node: [FakeContext(node.url, b'1'), FakeContext(node.url, b'2')] for node in nodes }
+		results = self.engine.chain(chains)
+		self.assertEqual(results, { node: [(200, b'1'), (200, b'2')] for node in nodes })
+	
+	def test_chain_unreachable(self):
+		node = Node("admin@127.0.0.1:1", 'n1')
+		chains = { node: [FakeContext(node.url, b'1'), FakeContext(node.url, b'2')] }
+		self.assertEqual(self.engine.chain(chains), { node: [(0, None), (0, None)] })
+	
+	def test_iter_dispatch(self):
+		nodes = [Node("admin:password@" + self.host, 'n{0}'.format(i)) for i in range(5)]
+		contexts = { node: FakeContext(node.url, node.name.encode('utf-8')) for node in nodes }
+		results = list(self.engine.iter_dispatch(contexts, nodes))
+		self.assertEqual(results, [(node, (200, node.name.encode('utf-8'))) for node in nodes])
+	
+	def test_malformed_status(self):
+		node = Node("admin:password@" + self.host, 'n1')
+		self.assertEqual(self.engine.call(node, FakeContext(node.url, b'malformed')), (0, None))
+	
+	def test_closed_connection(self):
+		node = Node("admin:password@" + self.host, 'n1')
+		self.assertEqual(self.engine.call(node, FakeContext(node.url, b'close')), (200, b'close'))
+		time.sleep(0.1)
+		self.assertEqual(self.engine.call(node, FakeContext(node.url, b'2')), (200, b'2'))
+	
+	def test_idle_timeout(self):
+		node = Node("admin:password@" + self.host, 'n1')
+		self.engine.call(node, FakeContext(node.url, b'1'))
+		idle = [conns for conns in self.engine.idle.values() if conns][0]
+		reader, writer, last_used = idle.pop()
+		idle.append((reader, writer, last_used - 3600))
+		
+		self.assertEqual(self.engine.call(node, FakeContext(node.url, b'2')), (200, b'2'))
+		self.assertTrue(writer.is_closing())
+		self.assertEqual(len(idle), 1)
+	
+	def test_invalidates_before_sending(self):
+		tempdir = tempfile.mkdtemp()
+		os.environ['XDG_CACHE_HOME'] = tempdir
+		config['response_cache'] = True
+		try:
+			node = Node("admin@127.0.0.1:1", 'n1')
+			responses.set(node, 'configKeys', b'<envelope/>', b'<reply/>', 200, 'OK')
+			self.assertIsNotNone(responses.get(node, 'configKeys', b'<envelope/>'))
+			
+			# The node may have acted on the call, even though it never answered
+			self.assertEqual(self.engine.call(node, FakeContext(node.url, b'x', 'configKeySet')), (0, None))
+			self.assertIsNone(responses.get(node, 'configKeys', b'<envelope/>'))
+		finally:
+			config.clear()
+			del os.environ['XDG_CACHE_HOME']
+			shutil.rmtree(tempdir)
@@ -0,0 +1,77 @@
+import socket
+import unittest
+from halonctl.breaker import CircuitBreaker, BreakerRegistry, CLOSED, OPEN
+from halonctl.config import config
+from halonctl.models import Node
+
+class TestCircuitBreaker(unittest.TestCase):
+	def setUp(self):
+		self.listener = socket.socket()
+		self.listener.bind(('127.0.0.1', 0))
+		self.listener.listen(5)
+		self.up = Node("127.0.0.1:{0}".format(self.listener.getsockname()[1]), 'up')
+		self.down = Node("127.0.0.1:1", 'down')
+	
+	def tearDown(self):
+		self.listener.close()
+		config.clear()
+	
+	def test_closed(self):
+		breaker = CircuitBreaker(self.up)
+		self.assertTrue(breaker.allow())
+		self.assertTrue(breaker.allow())
+	
+	def test_fails_fast_after_failure(self):
+		breaker = CircuitBreaker(self.up)
+		breaker.failure()
+		self.assertEqual(breaker.state, OPEN)
+		self.assertFalse(breaker.allow())
+		self.assertFalse(breaker.allow())
+		self.assertEqual(breaker.failed_fast, 2)
+	
+	def test_probe_succeeds(self):
+		config['breaker_retry_interval'] = 0
+		breaker = CircuitBreaker(self.up)
+		breaker.failure()
+		self.assertTrue(breaker.allow())
+		
+		# Only the caller that probed gets through until the call completes
+		self.assertFalse(breaker.allow())
+		breaker.success()
+		self.assertEqual(breaker.state, CLOSED)
+		self.assertTrue(breaker.allow())
+	
+	def test_abandoned_trial(self):
+		config['breaker_retry_interval'] = 0
+		config['timeout'] = 0
+		breaker = CircuitBreaker(self.up)
+		breaker.failure()
+		self.assertTrue(breaker.allow())
+		
+		# The trial call never reported back, so another one is let through
+		self.assertTrue(breaker.allow())
+	
+	def test_probe_fails(self):
+		config['breaker_retry_interval'] = 0
+		breaker = CircuitBreaker(self.down)
+		breaker.failure()
+		self.assertFalse(breaker.allow())
+		self.assertEqual(breaker.state, OPEN)
+
+class TestBreakerRegistry(unittest.TestCase):
+	def tearDown(self):
+		config.clear()
+	
+	def test_per_node(self):
+		registry = BreakerRegistry()
+		n1, n2 = Node("0.0.0.1", 'n1'), Node("0.0.0.2", 'n2')
+		registry.record(n1, False)
+		self.assertFalse(registry.allow(n1))
+		self.assertTrue(registry.allow(n2))
+	
+	def test_disabled(self):
+		config['circuit_breaker'] = False
+		registry = BreakerRegistry()
+		node = Node("0.0.0.1", 'n1')
+		registry.record(node, False)
+		self.assertTrue(registry.allow(node))
@@ -0,0 +1,51 @@
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+from halonctl import cache
+
+class TestCache(unittest.TestCase):
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		os.environ['XDG_CACHE_HOME'] = self.tempdir
+		self.base = os.path.join(self.tempdir, 'halonctl')
+	
+	def tearDown(self):
+		del os.environ['XDG_CACHE_HOME']
+		cache.checked.clear()
+		shutil.rmtree(self.tempdir)
+	
+	def test_entries(self):
+		self.assertIsNone(cache.get_entry('things', 'a'))
+		cache.set_entry('things', 'a', b'data')
+		self.assertEqual(cache.get_entry('things', 'a'), b'data')
+		for path in (self.base, os.path.join(self.base, 'things')):
+			self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o700)
+		
+		cache.remove_entries('things')
+		self.assertIsNone(cache.get_entry('things', 'a'))
+	
+	def test_made_private(self):
+		os.makedirs(os.path.join(self.base, 'things'))
+		os.chmod(self.base, 0o755)
+		cache.set_entry('things', 'a', b'data')
+		self.assertEqual(stat.S_IMODE(os.stat(self.base).st_mode), 0o700)
+		self.assertEqual(cache.get_entry('things', 'a'), b'data')
+	
+	@unittest.skipUnless(hasattr(os, 'geteuid') and os.geteuid() == 0, "needs to be able to chown")
+	def test_not_owned(self):
+		os.makedirs(os.path.join(self.base, 'things'))
+		with open(os.path.join(self.base, 'things', 'a'), 'wb') as f:
+			f.write(b'planted')
+		os.chown(os.path.join(self.base, 'things'), os.getuid() + 1, -1)
+		
+		self.assertIsNone(cache.get_entry('things', 'a'))
+		cache.set_entry('things', 'b', b'data')
+		self.assertFalse(os.path.exists(os.path.join(self.base, 'things', 'b')))
+	
+	def test_not_a_directory(self):
+		os.makedirs(self.base)
+		os.symlink(self.tempdir, os.path.join(self.base, 'things'))
+		cache.set_entry('things', 'a', b'data')
+		self.assertIsNone(cache.get_entry('things', 'a'))
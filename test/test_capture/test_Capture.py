@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from halonctl.simulator import Simulator, Settings
+from halonctl.capture import captures, CaptureError
+from halonctl.config import config
+from halonctl.models import Node
+from halonctl.wsdl import wsdls
+
+class TestCapture(unittest.TestCase):
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		os.environ['XDG_CACHE_HOME'] = self.tempdir
+		self.path = os.path.join(self.tempdir, u"capture.jsonl")
+		
+		self.server = Simulator(('127.0.0.1', 0), Settings(items=25, latency=0.1))
+		self.server.start()
+		self.node = Node(u"admin:admin@127.0.0.1:{0}".format(self.server.port), u"n1")
+		wsdls.refresh([self.node], True)
+	
+	def tearDown(self):
+		captures.stop()
+		config.pop('replay_speed', None)
+		config.pop('engine', None)
+		self.server.shutdown()
+		self.server.server_close()
+		wsdls.clear()
+		del os.environ['XDG_CACHE_HOME']
+		shutil.rmtree(self.tempdir)
+	
+	def record(self, *calls):
+		'''Records calls, then takes the node offline and starts replaying them.'''
+		
+		captures.record_to(self.path)
+		results = [call() for call in calls]
+		captures.stop()
+		
+		self.server.shutdown()
+		wsdls.clear()
+		captures.replay_from(self.path)
+		self.assertTrue(captures.install_wsdls([self.node]))
+		return results
+	
+	def test_replay(self):
+		first, second = self.record(self.node.service.getUptime, self.node.service.getVersion)
+		
+		start = time.time()
+		self.assertEqual(self.node.service.getUptime(), first)
+		self.assertGreaterEqual(time.time() - start, 0.1)
+		self.assertEqual(self.node.service.getVersion(), second)
+		self.assertEqual((captures.replayed, captures.missed), (2, 0))
+	
+	def test_order(self):
+		self.record(lambda: self.node.service.getUptime(), lambda: time.sleep(1.1), lambda: self.node.service.getUptime())
+		
+		first, second, third = [self.node.service.getUptime()[1] for i in range(3)]
+		self.assertGreater(second, first)
+		self.assertEqual(third, second)
+	
+	def test_missing(self):
+		self.record(self.node.service.getUptime)
+		self.assertEqual(self.node.service.getVersion(), (0, None))
+		self.assertEqual(captures.missed, 1)
+	
+	def test_streaming(self):
+		records, = self.record(lambda: list(self.node.service.stream().statList(None, None, None, limit=100)[1]))
+		
+		code, replayed = self.node.service.stream().statList(None, None, None, limit=100)
+		self.assertEqual(code, 200)
+		self.assertEqual(list(replayed), records)
+		self.assertEqual(len(records), 25)
+	
+	def test_speed(self):
+		config['replay_speed'] = 0
+		self.record(self.node.service.getUptime)
+		
+		start = time.time()
+		self.assertEqual(self.node.service.getUptime()[0], 200)
+		self.assertLess(time.time() - start, 0.1)
+	
+	@unittest.skipIf(sys.version_info < (3, 5), "asyncio engine requires Python 3.5+")
+	def test_asyncio(self):
+		config['engine'] = 'asyncio'
+		first, = self.record(self.node.service.getUptime)
+		self.assertEqual(self.node.service.getUptime(), first)
+		self.assertEqual(self.node.service.getVersion(), (0, None))
+	
+	def test_invalid(self):
+		with open(self.path, 'w') as f:
+			f.write(u"{}\n")
+		self.assertRaises(CaptureError, captures.replay_from, self.path)
+	
+	def test_private(self):
+		captures.record_to(self.path)
+		captures.stop()
+		self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+	
+	def test_wsdl_not_kept(self):
+		self.record(self.node.service.getUptime)
+		self.assertIsNotNone(wsdls.node_path(self.node))
+		captures.stop()
+		self.assertIsNone(wsdls.node_path(self.node))
+		self.assertEqual(wsdls.load_index()['nodes'], {})
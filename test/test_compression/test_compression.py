@@ -0,0 +1,48 @@
+import zlib
+import unittest
+from halonctl.compression import compress, decompress, should_compress, TransferStats
+from halonctl.config import config
+from halonctl.models import Node
+
+class TestCompression(unittest.TestCase):
+	def tearDown(self):
+		config.clear()
+	
+	def test_roundtrip(self):
+		data = b'<item>abc</item>' * 100
+		self.assertLess(len(compress(data)), len(data))
+		self.assertEqual(decompress(compress(data), 'gzip'), data)
+	
+	def test_deflate(self):
+		data = b'<item>abc</item>' * 100
+		self.assertEqual(decompress(zlib.compress(data), 'deflate'), data)
+		
+		c = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+		self.assertEqual(decompress(c.compress(data) + c.flush(), 'deflate'), data)
+	
+	def test_identity(self):
+		self.assertEqual(decompress(b'abc', None), b'abc')
+		self.assertEqual(decompress(b'abc', 'identity'), b'abc')
+	
+	def test_should_compress(self):
+		self.assertFalse(should_compress(b'x' * 4096))
+		config['compress_requests'] = True
+		self.assertTrue(should_compress(b'x' * 4096))
+		self.assertFalse(should_compress(b'x' * 10))
+		config['compress_min_size'] = 10
+		self.assertTrue(should_compress(b'x' * 10))
+
+class TestTransferStats(unittest.TestCase):
+	def test_counters(self):
+		stats = TransferStats()
+		node = Node("0.0.0.1", 'n1')
+		stats.sent(node, 'configKeys', 100, 100)
+		stats.received(node, 'configKeys', 250, 1000)
+		stats.sent(node, 'configKeys', 100, 100)
+		stats.received(node, 'configKeys', 250, 1000)
+		
+		t = stats.get(node, 'configKeys')
+		self.assertEqual(t.calls, 2)
+		self.assertEqual(t.received_wire, 500)
+		self.assertEqual(t.received_raw, 2000)
+		self.assertAlmostEqual(t.saved, 1.0 - 700.0 / 2200.0)
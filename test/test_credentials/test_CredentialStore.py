@@ -0,0 +1,87 @@
+import time
+import unittest
+from threading import Lock, Thread
+from halonctl.credentials import credentials
+from halonctl.models import Node, NodeList
+
+class FakeKeyring(object):
+	def __init__(self, passwords, delay=0):
+		self.passwords = passwords
+		self.delay = delay
+		self.lookups = []
+		self.active = 0
+		self.most_active = 0
+		self.lock = Lock()
+	
+	def __call__(self, host, username):
+		with self.lock:
+			self.active += 1
+			self.most_active = max(self.most_active, self.active)
+		time.sleep(self.delay)
+		with self.lock:
+			self.active -= 1
+			self.lookups.append((host, username))
+		return self.passwords.get((host, username))
+
+class TestCredentialStore(unittest.TestCase):
+	def setUp(self):
+		self.old_backend = credentials.backend
+		self.keyring = credentials.backend = FakeKeyring({ ('0.0.0.2', 'admin'): 'secret' })
+		credentials.clear()
+		
+		self.cluster = NodeList()
+		self.cluster.load_data({ 'username': 'admin' })
+		for i in range(1, 5):
+			self.cluster.append(Node("http://0.0.0.{0}".format(i), 'n{0}'.format(i), self.cluster))
+	
+	def tearDown(self):
+		credentials.backend = self.old_backend
+		credentials.clear()
+	
+	def test_fallback(self):
+		credentials.resolve(self.cluster)
+		for node in self.cluster:
+			self.assertEqual(node.username, 'admin')
+			self.assertEqual(node.password, 'secret')
+	
+	def test_local_password(self):
+		self.cluster[0].password = 'mine'
+		credentials.resolve(self.cluster[:1])
+		self.assertEqual(self.cluster[0].password, 'mine')
+		self.assertEqual(self.cluster[1].password, 'secret')
+		self.assertEqual(self.cluster[3].password, 'mine')
+		self.assertNotIn(('0.0.0.1', 'admin'), self.keyring.lookups)
+	
+	def test_unresolved(self):
+		self.assertEqual(self.cluster[3].password, 'secret')
+	
+	def test_lookups(self):
+		credentials.resolve([self.cluster[0]])
+		self.assertEqual(sorted(self.keyring.lookups), [('0.0.0.{0}'.format(i), 'admin') for i in range(1, 5)])
+		
+		for i in range(3):
+			credentials.resolve(self.cluster)
+			[node.password for node in self.cluster]
+		self.assertEqual(len(self.keyring.lookups), 4)
+	
+	def test_serialized(self):
+		self.keyring.delay = 0.05
+		threads = [Thread(target=credentials.resolve, args=([node],)) for node in self.cluster]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(self.keyring.most_active, 1)
+		self.assertEqual(self.cluster[0].password, 'secret')
+	
+	def test_stored(self):
+		credentials.resolve(self.cluster)
+		del self.keyring.passwords[('0.0.0.2', 'admin')]
+		credentials.stored('0.0.0.2', 'admin', None)
+		credentials.stored('0.0.0.4', 'admin', 'other')
+		self.assertEqual(self.cluster[0].password, 'other')
+		self.assertEqual(self.cluster[1].password, 'other')
+		
+		credentials.resolve(self.cluster)
+		self.assertEqual([node.password for node in self.cluster], ['other'] * 4)
+		self.assertEqual(len(self.keyring.lookups), 5)
@@ -0,0 +1,58 @@
+import unittest
+from suds.client import Client
+from halonctl.envelopes import EnvelopeCache, PrecompiledRequest
+from halonctl.simulator import DEFAULT_WSDL as WSDL_PATH
+
+def make_client(location="http://0.0.0.1/remote/"):
+	client = Client("file:{0}".format(WSDL_PATH), location=location, faults=False, nosend=True)
+	client.set_options(cache=None)
+	return client
+
+class TestEnvelopeCache(unittest.TestCase):
+	def setUp(self):
+		self.client = make_client()
+		self.cache = EnvelopeCache()
+	
+	def assertSameAsSuds(self, name, *args, **kwargs):
+		context = self.cache.make_request(self.client, name, args, kwargs)
+		self.assertIsInstance(context, PrecompiledRequest)
+		self.assertEqual(context.envelope, getattr(self.client.service, name)(*args, **kwargs).envelope)
+		return context
+	
+	def test_no_params(self):
+		self.assertSameAsSuds('getUptime')
+		self.assertSameAsSuds('getUptime')
+	
+	def test_string_param(self):
+		self.assertSameAsSuds('commandPoll', commandid='abc')
+		self.assertSameAsSuds('commandPoll', commandid='def')
+	
+	def test_escaping(self):
+		self.assertSameAsSuds('mailQueueDeleteBulk', filter=u'from~%@halon.se to<x> & "y"')
+		self.assertSameAsSuds('mailQueueDeleteBulk', filter=u'subject~今日は')
+	
+	def test_mixed_params(self):
+		self.assertSameAsSuds('statList', 'a', None, '', limit=10000)
+		self.assertSameAsSuds('statList', 'b', 'c', None, limit=10)
+		self.assertSameAsSuds('commandTermsize', commandid='1', cols=80, rows=24)
+		self.assertSameAsSuds('mailQueueRetryBulk', filter='x', duplicate=True)
+		self.assertSameAsSuds('mailQueueRetryBulk', filter='x', duplicate=False)
+	
+	def test_templates_are_shared(self):
+		self.cache.make_request(self.client, 'commandPoll', (), {'commandid': '1'})
+		self.cache.make_request(make_client("http://0.0.0.2/remote/"), 'commandPoll', (), {'commandid': '2'})
+		self.assertEqual(len(self.cache.templates), 1)
+	
+	def test_location(self):
+		context = self.cache.make_request(make_client("http://0.0.0.2/remote/"), 'getUptime', (), {})
+		self.assertEqual(context.client.location(), "http://0.0.0.2/remote/")
+	
+	def test_complex_params_fall_back(self):
+		context = self.cache.make_request(self.client, 'mailQueue', (), {'filter': '', 'options': {'totalhits': True}})
+		self.assertNotIsInstance(context, PrecompiledRequest)
+		self.assertEqual(len(self.cache.templates), 0)
+	
+	def test_process_reply(self):
+		context = self.assertSameAsSuds('getUptime')
+		reply = b'<?xml version="1.0" encoding="UTF-8"?><SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ns1="urn:halon"><SOAP-ENV:Body><ns1:getUptimeResponse><result>1337</result></ns1:getUptimeResponse></SOAP-ENV:Body></SOAP-ENV:Envelope>'
+		self.assertEqual(context.process_reply(reply, 200, 'OK'), (200, 1337))
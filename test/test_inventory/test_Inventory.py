@@ -0,0 +1,88 @@
+import unittest
+from halonctl.inventory import Inventory, SelectorError, glob_to_regex, is_pattern
+from halonctl.__main__ import process_config
+
+CONFIG = {
+	'nodes': {
+		'mx-eu-1': 'admin@10.0.0.1',
+		'mx-eu-2': 'admin@10.0.0.2',
+		'mx-us-1': 'admin@10.1.0.1',
+		'mx-us-2': 'admin@10.1.0.2',
+		'edge1': 'admin@10.2.0.1',
+	},
+	'clusters': {
+		'eu': ['mx-eu-1', 'mx-eu-2'],
+		'us': ['mx-us-1', 'mx-us-2'],
+		'edge': ['edge1'],
+	},
+	'tags': {
+		'canary': ['mx-eu-2', 'mx-us-2'],
+		'public': ['edge1', 'mx-us-1'],
+	},
+}
+
+class TestInventory(unittest.TestCase):
+	def setUp(self):
+		nodes, clusters = process_config(CONFIG)
+		self.inventory = Inventory(nodes, clusters, CONFIG['tags'])
+	
+	def select(self, *selectors):
+		return sorted(node.name for node in self.inventory.select(*selectors))
+	
+	def test_names(self):
+		self.assertEqual(self.select('mx-eu-1'), ['mx-eu-1'])
+		self.assertEqual(self.select('cluster:us'), ['mx-us-1', 'mx-us-2'])
+		self.assertEqual(self.select('tag:canary'), ['mx-eu-2', 'mx-us-2'])
+		self.assertEqual(self.select('host:10.2.0.1'), ['edge1'])
+	
+	def test_globs(self):
+		self.assertEqual(self.select('mx-*'), ['mx-eu-1', 'mx-eu-2', 'mx-us-1', 'mx-us-2'])
+		self.assertEqual(self.select('mx-??-2'), ['mx-eu-2', 'mx-us-2'])
+		self.assertEqual(self.select('mx-[e]*'), ['mx-eu-1', 'mx-eu-2'])
+		self.assertEqual(self.select('mx-[^e]*'), ['mx-us-1', 'mx-us-2'])
+		self.assertEqual(self.select('cluster:e*'), ['edge1', 'mx-eu-1', 'mx-eu-2'])
+		self.assertEqual(self.select('host:10.1.*'), ['mx-us-1', 'mx-us-2'])
+		self.assertEqual(self.select('zz*'), [])
+	
+	def test_regex(self):
+		self.assertEqual(self.select(r'/\d$/'), ['edge1', 'mx-eu-1', 'mx-eu-2', 'mx-us-1', 'mx-us-2'])
+		self.assertEqual(self.select(r'/^mx-(eu|us)-1$/'), ['mx-eu-1', 'mx-us-1'])
+		self.assertEqual(self.select('tag:/^c/'), ['mx-eu-2', 'mx-us-2'])
+		self.assertEqual(self.select(r'/(?i)EDGE/'), ['edge1'])
+	
+	def test_regex_text_anchors(self):
+		self.assertEqual(self.select(r'/\Amx/'), ['mx-eu-1', 'mx-eu-2', 'mx-us-1', 'mx-us-2'])
+		self.assertEqual(self.select(r'/-2\Z/'), ['mx-eu-2', 'mx-us-2'])
+	
+	def test_operators(self):
+		self.assertEqual(self.select('cluster:eu | edge1'), ['edge1', 'mx-eu-1', 'mx-eu-2'])
+		self.assertEqual(self.select('cluster:eu,edge1'), ['edge1', 'mx-eu-1', 'mx-eu-2'])
+		self.assertEqual(self.select('mx-* & tag:canary'), ['mx-eu-2', 'mx-us-2'])
+		self.assertEqual(self.select('mx-*&!tag:canary'), ['mx-eu-1', 'mx-us-1'])
+		self.assertEqual(self.select('!mx-*'), ['edge1'])
+		self.assertEqual(self.select('(cluster:eu | cluster:us) & !(tag:canary | tag:public)'), ['mx-eu-1'])
+		self.assertEqual(self.select('cluster:eu', 'cluster:edge'), ['edge1', 'mx-eu-1', 'mx-eu-2'])
+	
+	def test_order(self):
+		names = [node.name for node in self.inventory.select('edge1 | mx-eu-2 | mx-eu-1')]
+		self.assertEqual(names, [name for name in CONFIG['nodes'] if name in ('edge1', 'mx-eu-1', 'mx-eu-2')])
+	
+	def test_errors(self):
+		for selector in ['nope', 'tag:nope', 'cluster:eu &', '(cluster:eu', 'cluster:eu)', '/[/', '& edge1', '']:
+			self.assertRaises(SelectorError, self.inventory.select, selector)
+	
+	def test_unknown_tag_node(self):
+		nodes, clusters = process_config(CONFIG)
+		self.assertRaises(SelectorError, Inventory, nodes, clusters, { 'broken': ['nope'] })
+	
+	def test_expand(self):
+		self.assertEqual(self.inventory.expand(['edge1', 'mx-us-*'], 'node'), ['edge1', 'mx-us-1', 'mx-us-2'])
+		self.assertEqual(self.inventory.expand(['/^e/'], 'cluster'), ['edge', 'eu'])
+		self.assertRaises(SelectorError, self.inventory.expand, ['zz*'], 'node')
+	
+	def test_patterns(self):
+		self.assertTrue(is_pattern('mx-*'))
+		self.assertTrue(is_pattern('/mx/'))
+		self.assertFalse(is_pattern('mx-1'))
+		self.assertFalse(is_pattern('/'))
+		self.assertEqual(glob_to_regex('a[!b]*'), u'^a[^\\nb][^\\n]*$')
@@ -0,0 +1,28 @@
+import os
+import sys
+import json
+import unittest
+import subprocess
+
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+# Configuration handling, argument parsing and dry runs must not need these
+HEAVY = ['requests', 'urllib3', 'suds', 'keyring', 'arrow', 'dateutil', 'natsort', 'pkg_resources']
+
+SCRIPT = u'''
+import sys, json
+from halonctl.__main__ import process_config, apply_filter, make_parser
+from halonctl import __main__ as m
+m.manifest.update({ 'modules': {}, 'formatters': {} })
+parser, subparsers = make_parser()
+nodes, clusters = process_config({ 'nodes': { 'a': 'admin@a', 'b': 'admin@b' }, 'clusters': { 'c': ['a', 'b'] } })
+print(apply_filter(nodes, clusters, [], ['c'], '1'))
+print(json.dumps(sorted(set(name.split('.')[0] for name in sys.modules))))
+'''
+
+@unittest.skipIf(sys.version_info < (3, 7), "module attributes can't be computed on demand")
+class TestImports(unittest.TestCase):
+	def test_no_network_stack(self):
+		out = subprocess.check_output([sys.executable, '-c', SCRIPT], cwd=BASE)
+		loaded = json.loads(out.decode('utf-8').splitlines()[-1])
+		self.assertEqual([name for name in HEAVY if name in loaded], [])
@@ -0,0 +1,44 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from halonctl.__main__ import probe_nodes
+from halonctl.breaker import breakers
+from halonctl.models import Node
+from halonctl import cache
+
+class TestProbeNodes(unittest.TestCase):
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		os.environ['XDG_CACHE_HOME'] = self.tempdir
+		
+		self.listener = socket.socket()
+		self.listener.bind(('127.0.0.1', 0))
+		self.listener.listen(5)
+		self.up = Node("127.0.0.1:{0}".format(self.listener.getsockname()[1]), 'up')
+		self.down = Node("127.0.0.1:1", 'down')
+	
+	def tearDown(self):
+		self.listener.close()
+		del os.environ['XDG_CACHE_HOME']
+		shutil.rmtree(self.tempdir)
+		breakers.breakers.clear()
+	
+	def test_down_nodes(self):
+		self.assertEqual(probe_nodes([self.up, self.down], 0.5), [self.down])
+		self.assertTrue(breakers.allow(self.up))
+		self.assertFalse(breakers.allow(self.down))
+	
+	def test_health_cache(self):
+		probe_nodes([self.up, self.down], 0.5)
+		
+		health = cache.get_health()
+		self.assertTrue(cache.get_node_health(self.up, health)['up'])
+		self.assertIsNotNone(cache.get_node_health(self.up, health)['latency'])
+		self.assertFalse(cache.get_node_health(self.down, health)['up'])
+		self.assertIsNone(cache.get_node_health(self.down, health)['latency'])
+	
+	def test_no_cache(self):
+		self.assertEqual(cache.get_health(), {})
+		self.assertIsNone(cache.get_node_health(self.up))
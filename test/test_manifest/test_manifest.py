@@ -0,0 +1,104 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import unittest
+from halonctl import manifest
+
+MODULE = u'''
+from halonctl.modapi import Module
+
+class TestModule(Module):
+	"""Does {0} things"""
+	
+	def register_arguments(self, parser):
+		parser.add_argument('-n', '--count', type=int, default=1)
+		parser.add_argument('names', nargs='*')
+
+module = TestModule()
+'''
+
+class TestManifest(unittest.TestCase):
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		os.environ['XDG_CACHE_HOME'] = self.tempdir
+		
+		self.base = os.path.join(self.tempdir, 'plugins')
+		os.makedirs(os.path.join(self.base, 'modules'))
+		os.makedirs(os.path.join(self.base, 'formatters'))
+		self.write_module(u"test")
+		with open(os.path.join(self.base, 'formatters', 'plain.py'), 'w') as f:
+			f.write(u"formatter = None\n")
+	
+	def tearDown(self):
+		del os.environ['XDG_CACHE_HOME']
+		shutil.rmtree(self.tempdir)
+	
+	def write_module(self, adjective):
+		path = os.path.join(self.base, 'modules', 'thing_.py')
+		with open(path, 'w') as f:
+			f.write(MODULE.format(adjective))
+		# Make sure the change is noticed, even on coarse filesystem clocks
+		os.utime(path, (time.time() + 10, time.time() + 10))
+	
+	def test_build(self):
+		m, loaded = manifest.load([self.base])
+		self.assertEqual(list(m['modules'].keys()), ['thing'])
+		self.assertEqual(list(m['formatters'].keys()), ['plain'])
+		self.assertEqual(m['modules']['thing']['help'], u"Does test things")
+		self.assertIn('thing', loaded)
+	
+	def test_cached(self):
+		manifest.load([self.base])
+		m, loaded = manifest.load([self.base])
+		self.assertEqual(loaded, {})
+		self.assertEqual(m['modules']['thing']['help'], u"Does test things")
+	
+	def test_rebuild(self):
+		manifest.load([self.base])
+		self.write_module(u"other")
+		m, loaded = manifest.load([self.base])
+		self.assertIn('thing', loaded)
+		self.assertEqual(m['modules']['thing']['help'], u"Does other things")
+	
+	def test_replay(self):
+		m, loaded = manifest.load([self.base])
+		parser = argparse.ArgumentParser()
+		manifest.replay(parser, m['modules']['thing']['spec'])
+		args = parser.parse_args(['-n', '3', 'a', 'b'])
+		self.assertEqual(args.count, 3)
+		self.assertEqual(args.names, ['a', 'b'])
+	
+	def test_subcommands(self):
+		p = manifest.RecordingParser()
+		sp = p.add_subparsers(dest='sub')
+		sp.required = True
+		sp.add_parser('one', help=u"First").add_argument('-y', action='store_true')
+		sp.add_parser('two')
+		
+		parser = argparse.ArgumentParser()
+		manifest.replay(parser, p.spec())
+		self.assertTrue(parser.parse_args(['one', '-y']).y)
+		self.assertEqual(parser.parse_args(['two']).sub, 'two')
+	
+	def test_unrecordable(self):
+		class Action(argparse.Action):
+			pass
+		p = manifest.RecordingParser()
+		self.assertRaises(manifest.Unrecordable, p.add_argument, '-x', action=Action)
+		p.add_argument('-t', type=lambda s: s, default=object())
+		self.assertEqual(p.spec()['arguments'], [[['-t'], {}]])
+	
+	def test_groups(self):
+		p = manifest.RecordingParser()
+		group = p.add_mutually_exclusive_group()
+		group.add_argument('-u', dest='tz', action='store_const', const=0)
+		group.add_argument('-t', dest='tz', type=float)
+		p.add_argument_group(u"Other").add_argument('--other')
+		
+		parser = argparse.ArgumentParser()
+		manifest.replay(parser, p.spec())
+		self.assertEqual(parser.parse_args(['-t', '2']).tz, 2.0)
+		self.assertEqual(parser.parse_args(['--other', 'x']).other, 'x')
+		self.assertRaises(SystemExit, parser.parse_args, ['-u', '-t', '2'])
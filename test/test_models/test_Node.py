@@ -39,3 +39,27 @@ class TestNode(unittest.TestCase):
 		self.assertEqual(self.node.host, '0.0.0.0')
 		self.assertEqual(self.node.username, 'admin')
 		self.assertIsNone(self.node.password)
+	
+	def test_slots(self):
+		self.assertFalse(hasattr(self.node, '__dict__'))
+		with self.assertRaises(AttributeError):
+			self.node.foo = 1
+	
+	def test_lazy_state(self):
+		self.assertIsNone(self.node._client)
+		self.assertIsNone(self.node._service)
+		service = self.node.service
+		self.assertIs(self.node.service, service)
+		self.assertIs(service.node, self.node)
+		self.assertIsNone(self.node._client)
+	
+	def test_shared_executors(self):
+		other = Node("0.0.0.1")
+		self.assertIs(self.node.service.getUptime.__func__, other.service.getUptime.__func__)
+		self.assertIs(other.service.getUptime.__self__, other.service)
+	
+	def test_shared_strings(self):
+		self.node.load_data("https://ad" + "min@0.0.0.0")
+		other = Node("https://admin@0.0.0.1")
+		self.assertIs(self.node.username, other.username)
+		self.assertIs(self.node.scheme, other.scheme)
@@ -0,0 +1,64 @@
+import unittest
+from threading import Thread
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from halonctl.models import Node
+from halonctl.pool import SessionPool
+from halonctl.config import config
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	
+	def do_GET(self):
+		self.send_response(200)
+		self.send_header('Content-Length', '2')
+		self.end_headers()
+		self.wfile.write(b'OK')
+	
+	def log_message(self, *args):
+		pass
+
+class TestSessionPool(unittest.TestCase):
+	def setUp(self):
+		self.server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+		self.thread = Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+		self.host = '127.0.0.1:{0}'.format(self.server.server_address[1])
+		self.pool = SessionPool()
+	
+	def tearDown(self):
+		self.pool.clear()
+		self.server.shutdown()
+		self.server.server_close()
+		config.clear()
+	
+	def test_one_session_per_node(self):
+		n1, n2 = Node("0.0.0.1", 'n1'), Node("0.0.0.2", 'n2')
+		self.assertIs(self.pool.get(n1), self.pool.get(n1))
+		self.assertIsNot(self.pool.get(n1), self.pool.get(n2))
+	
+	def test_same_host_shares_session(self):
+		self.assertIs(self.pool.get(Node("0.0.0.1", 'n1')), self.pool.get(Node("0.0.0.1", 'n2')))
+	
+	def test_configured_size(self):
+		config.update({'pool_size': 7, 'pool_idle_timeout': 5})
+		session = self.pool.get(Node("0.0.0.1", 'n1'))
+		self.assertEqual(session.pool_size, 7)
+		self.assertEqual(session.idle_timeout, 5)
+	
+	def test_hits_and_misses(self):
+		node = Node(self.host, 'n1')
+		session = self.pool.get(node)
+		for i in range(3):
+			session.get(node.url)
+		self.assertEqual(session.stats.misses, 1)
+		self.assertEqual(session.stats.hits, 2)
+	
+	def test_idle_connections_are_dropped(self):
+		node = Node(self.host, 'n1')
+		session = self.pool.get(node)
+		session.get(node.url)
+		session.last_used -= session.idle_timeout + 1
+		session.get(node.url)
+		self.assertEqual(session.stats.misses, 2)
+		self.assertEqual(session.stats.hits, 0)
@@ -0,0 +1,39 @@
+import unittest
+from halonctl.models import Node, NodeList
+from halonctl.proxies import NodeSoapProxy, Call, calls
+
+class FakeProxy(NodeSoapProxy):
+	def __init__(self, node, replies):
+		super(FakeProxy, self).__init__(node)
+		self.replies = replies
+		self.made = []
+	
+	def __getattr__(self, name_):
+		def _fake_executor(*args, **kwargs):
+			self.made.append(Call(name_, args, kwargs))
+			return self.replies.pop(0)
+		return _fake_executor
+
+class TestChain(unittest.TestCase):
+	def setUp(self):
+		self.node = Node("http://0.0.0.1", 'n1')
+	
+	def test_calls(self):
+		call = calls.getVersion(1, a=2)
+		self.assertEqual(call.name, 'getVersion')
+		self.assertEqual(call.args, (1,))
+		self.assertEqual(call.kwargs, {'a': 2})
+	
+	def test_chain(self):
+		proxy = FakeProxy(self.node, [(200, u"4.0"), (200, 100)])
+		self.assertEqual(proxy.chain(calls.getVersion(), calls.updateDownloadStatus()), [(200, u"4.0"), (200, 100)])
+		self.assertEqual([c.name for c in proxy.made], ['getVersion', 'updateDownloadStatus'])
+	
+	def test_chain_continues_after_error(self):
+		proxy = FakeProxy(self.node, [(500, u"Error"), (200, 100)])
+		self.assertEqual(proxy.chain(calls.getVersion(), calls.updateDownloadStatus()), [(500, u"Error"), (200, 100)])
+	
+	def test_chain_stops_when_unreachable(self):
+		proxy = FakeProxy(self.node, [(0, None), (200, 100)])
+		self.assertEqual(proxy.chain(calls.getVersion(), calls.updateDownloadStatus()), [(0, None), (0, None)])
+		self.assertEqual(len(proxy.made), 1)
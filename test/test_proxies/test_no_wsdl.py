@@ -0,0 +1,24 @@
+import os
+import shutil
+import tempfile
+import unittest
+from halonctl.models import Node
+from halonctl.proxies import NodeSoapProxy
+
+class TestNoWsdl(unittest.TestCase):
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		os.environ['XDG_CACHE_HOME'] = self.tempdir
+		self.node = Node("http://0.0.0.1", 'n1')
+	
+	def tearDown(self):
+		del os.environ['XDG_CACHE_HOME']
+		shutil.rmtree(self.tempdir)
+	
+	def test_unreachable(self):
+		self.assertIsNone(NodeSoapProxy(self.node).make_request('getVersion', (), {}))
+		self.assertEqual(NodeSoapProxy(self.node).getVersion(), (0, None))
+		self.assertEqual(NodeSoapProxy(self.node).stream().mailQueue(), (0, None))
+	
+	def test_make_request(self):
+		self.assertRaises(ValueError, self.node.make_request, 'getVersion')
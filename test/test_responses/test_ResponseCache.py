@@ -0,0 +1,79 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from halonctl.responses import ResponseCache, canonical
+from halonctl.config import config
+from halonctl.models import Node
+
+class TestResponseCache(unittest.TestCase):
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		os.environ['XDG_CACHE_HOME'] = self.tempdir
+		
+		config['response_cache'] = True
+		self.cache = ResponseCache()
+		self.node = Node("http://admin@0.0.0.1", 'n1')
+	
+	def tearDown(self):
+		del os.environ['XDG_CACHE_HOME']
+		shutil.rmtree(self.tempdir)
+		config.clear()
+	
+	def test_roundtrip(self):
+		self.assertIsNone(self.cache.get(self.node, 'getVersion', b'<envelope/>'))
+		self.cache.set(self.node, 'getVersion', b'<envelope/>', b'<reply/>', 200, 'OK')
+		self.assertEqual(self.cache.get(self.node, 'getVersion', b'<envelope/>'), (b'<reply/>', 200, 'OK'))
+		self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+	
+	def test_disabled(self):
+		config['response_cache'] = False
+		self.cache.set(self.node, 'getVersion', b'<envelope/>', b'<reply/>', 200, 'OK')
+		config['response_cache'] = True
+		self.assertIsNone(self.cache.get(self.node, 'getVersion', b'<envelope/>'))
+	
+	def test_bypass(self):
+		self.cache.set(self.node, 'getVersion', b'<envelope/>', b'<reply/>', 200, 'OK')
+		self.cache.bypass = True
+		self.assertIsNone(self.cache.get(self.node, 'getVersion', b'<envelope/>'))
+	
+	def test_not_read_only(self):
+		self.cache.set(self.node, 'configKeySet', b'<envelope/>', b'<reply/>', 200, 'OK')
+		self.assertIsNone(self.cache.get(self.node, 'configKeySet', b'<envelope/>'))
+	
+	def test_errors_not_cached(self):
+		self.cache.set(self.node, 'getVersion', b'<envelope/>', b'<fault/>', 500, 'Error')
+		self.assertIsNone(self.cache.get(self.node, 'getVersion', b'<envelope/>'))
+	
+	def test_keyed_by_arguments_and_user(self):
+		self.cache.set(self.node, 'configKeys', b'<a/>', b'<reply/>', 200, 'OK')
+		self.assertIsNone(self.cache.get(self.node, 'configKeys', b'<b/>'))
+		self.assertIsNone(self.cache.get(Node("http://other@0.0.0.1", 'n1'), 'configKeys', b'<a/>'))
+	
+	def test_keyed_by_password(self):
+		self.node.password = u"right"
+		self.cache.set(self.node, 'configKeys', b'<a/>', b'<reply/>', 200, 'OK')
+		self.assertIsNotNone(self.cache.get(self.node, 'configKeys', b'<a/>'))
+		self.node.password = u"wrong"
+		self.assertIsNone(self.cache.get(self.node, 'configKeys', b'<a/>'))
+	
+	def test_ttl(self):
+		config['response_cache'] = { 'getVersion': 0.05 }
+		self.cache.set(self.node, 'getVersion', b'<envelope/>', b'<reply/>', 200, 'OK')
+		self.assertIsNotNone(self.cache.get(self.node, 'getVersion', b'<envelope/>'))
+		time.sleep(0.1)
+		self.assertIsNone(self.cache.get(self.node, 'getVersion', b'<envelope/>'))
+	
+	def test_invalidate(self):
+		self.cache.set(self.node, 'configKeys', b'<envelope/>', b'<reply/>', 200, 'OK')
+		self.cache.set(self.node, 'getVersion', b'<envelope/>', b'<reply/>', 200, 'OK')
+		self.cache.invalidate(Node("http://other@0.0.0.1", 'n1'), 'configKeySet')
+		self.assertIsNone(self.cache.get(self.node, 'configKeys', b'<envelope/>'))
+		self.assertIsNotNone(self.cache.get(self.node, 'getVersion', b'<envelope/>'))
+	
+	def test_canonical(self):
+		a = b'<a:Envelope xmlns:a="urn:env" xmlns:b="urn:halon" xmlns:x="urn:xsi"><a:Body><b:getVersion x:type="b:string">1</b:getVersion></a:Body></a:Envelope>'
+		b = b'<b:Envelope xmlns:b="urn:env" xmlns:a="urn:halon" xmlns:y="urn:xsi"><b:Body><a:getVersion y:type="a:string">1</a:getVersion></b:Body></b:Envelope>'
+		self.assertEqual(canonical(a), canonical(b))
+		self.assertNotEqual(canonical(a), canonical(a.replace(b'>1<', b'>2<')))
@@ -0,0 +1,99 @@
+import time
+import unittest
+from threading import Lock
+from concurrent.futures import wait
+from halonctl.scheduler import Scheduler, limits
+from halonctl.config import config
+from halonctl.models import Node, NodeList
+
+class Counter(object):
+	def __init__(self):
+		self.lock = Lock()
+		self.current = 0
+		self.peak = 0
+	
+	def __call__(self):
+		with self.lock:
+			self.current += 1
+			self.peak = max(self.peak, self.current)
+		time.sleep(0.05)
+		with self.lock:
+			self.current -= 1
+
+class TestScheduler(unittest.TestCase):
+	def setUp(self):
+		self.small = NodeList()
+		self.small.name = 'small'
+		self.large = NodeList()
+		self.large.name = 'large'
+		for i in range(4):
+			self.small.append(Node("http://0.0.1.{0}".format(i), 's{0}'.format(i), self.small))
+		for i in range(8):
+			self.large.append(Node("http://0.0.2.{0}".format(i), 'l{0}'.format(i), self.large))
+	
+	def tearDown(self):
+		config.clear()
+	
+	def test_lazy(self):
+		scheduler = Scheduler()
+		self.assertIsNone(scheduler.pool)
+		self.assertEqual(scheduler.submit(lambda: 42).result(), 42)
+		self.assertIsNotNone(scheduler.pool)
+	
+	def test_max_workers(self):
+		config['max_workers'] = 3
+		self.assertEqual(Scheduler().get_pool()._max_workers, 3)
+	
+	def test_exception(self):
+		scheduler = Scheduler()
+		future = scheduler.submit(lambda: 1 // 0)
+		self.assertRaises(ZeroDivisionError, future.result)
+	
+	def test_no_limits(self):
+		self.assertEqual(limits(self.small[0]), [])
+		self.assertEqual(limits(None), [])
+	
+	def test_cluster_concurrency(self):
+		config['cluster_concurrency'] = 2
+		scheduler = Scheduler()
+		small, large = Counter(), Counter()
+		futures = [scheduler.submit_for(node, small) for node in self.small]
+		futures += [scheduler.submit_for(node, large) for node in self.large]
+		wait(futures)
+		self.assertEqual(small.peak, 2)
+		self.assertEqual(large.peak, 2)
+	
+	def test_cluster_override(self):
+		config['cluster_concurrency'] = 2
+		self.large.concurrency = 4
+		scheduler = Scheduler()
+		counter = Counter()
+		wait([scheduler.submit_for(node, counter) for node in self.large])
+		self.assertEqual(counter.peak, 4)
+	
+	def test_node_concurrency(self):
+		config['node_concurrency'] = 1
+		scheduler = Scheduler()
+		counter = Counter()
+		wait([scheduler.submit_for(self.small[0], counter) for i in range(4)])
+		self.assertEqual(counter.peak, 1)
+	
+	def test_node_and_cluster_concurrency(self):
+		config['cluster_concurrency'] = 2
+		config['node_concurrency'] = 1
+		scheduler = Scheduler()
+		counter = Counter()
+		futures = [scheduler.submit_for(node, counter) for i in range(3) for node in self.small]
+		wait(futures)
+		self.assertEqual(counter.peak, 2)
+		self.assertTrue(all(future.done() for future in futures))
+		self.assertEqual(scheduler.pending, {})
+	
+	def test_wait_stats(self):
+		config['node_concurrency'] = 1
+		scheduler = Scheduler()
+		node = self.small[0]
+		wait([scheduler.submit_for(node, time.sleep, 0.05) for i in range(3)])
+		stats = scheduler.waits[(node.scheme, node.host)]
+		self.assertEqual(stats.calls, 3)
+		self.assertGreaterEqual(stats.max, 0.09)
@@ -0,0 +1,90 @@
+import six
+import os
+import shutil
+import tempfile
+import unittest
+from halonctl.simulator import Simulator, Settings, generate_config, loopback_address
+from halonctl.models import Node, NodeList
+from halonctl.wsdl import wsdls
+from halonctl.__main__ import process_config
+
+class TestSimulator(unittest.TestCase):
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		os.environ['XDG_CACHE_HOME'] = self.tempdir
+		
+		self.settings = Settings(items=25, size=10000)
+		self.server = Simulator(('127.0.0.1', 0), self.settings)
+		self.server.start()
+		self.node = self.make_node(u"n1")
+		wsdls.refresh([self.node], True)
+	
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		wsdls.clear()
+		del os.environ['XDG_CACHE_HOME']
+		shutil.rmtree(self.tempdir)
+	
+	def make_node(self, name, password=u"admin"):
+		return Node(u"admin:{0}@127.0.0.1:{1}".format(password, self.server.port), name)
+	
+	def test_calls(self):
+		code, uptime = self.node.service.getUptime()
+		self.assertEqual(code, 200)
+		self.assertGreater(uptime, 0)
+		self.assertEqual(self.node.service.getVersion(), (200, self.server.nodes['127.0.0.1:{0}'.format(self.server.port)].version))
+	
+	def test_lists(self):
+		code, result = self.node.service.mailQueue(limit=10, options={ 'totalhits': True })
+		self.assertEqual(code, 200)
+		self.assertEqual(len(result.result.item), 10)
+		self.assertEqual(result.totalhits, 25)
+		
+		records = list(self.node.service.stream().statList(None, None, None, limit=100)[1])
+		self.assertEqual(len(records), 25)
+	
+	def test_config(self):
+		self.assertEqual(self.node.service.configKeySet(key=u"file__2", params={ 'item': [
+			{ 'first': u"name", 'second': u"Test" },
+			{ 'first': u"type", 'second': u"text/plain" },
+			{ 'first': u"data", 'second': u"SGVsbG8=" },
+		] })[0], 200)
+		
+		code, result = self.node.service.configKeys()
+		keys = { item.name: item.params.item for item in result.item }
+		self.assertEqual(keys[u"file__2"], [u"Test", u"text/plain", u"SGVsbG8="])
+	
+	def test_command(self):
+		code, cmd = self.node.command(u"statd", u"-g", u"mail-acc")
+		self.assertEqual(code, 200)
+		six.assertRegex(self, cmd.all(), r'^mail-acc=\d+\n$')
+		
+		code, cmd = self.node.command(u"ls")
+		self.assertEqual(len(cmd.all()), self.settings.size)
+	
+	def test_unauthorized(self):
+		self.assertEqual(self.make_node(u"n2", u"wrong").service.getUptime()[0], 401)
+	
+	def test_failures(self):
+		self.settings.error_rate = 1.0
+		self.assertEqual(self.node.service.getUptime()[0], 500)
+		
+		self.settings.error_rate, self.settings.drop_rate = 0.0, 1.0
+		self.assertEqual(NodeList([self.node]).service.getUptime()[self.node][0], 0)
+		self.assertEqual(self.server.calls['getUptime'], { 'failed': 1, 'dropped': 1 })
+
+class TestGenerateConfig(unittest.TestCase):
+	def test_loopback_addresses(self):
+		addresses = [loopback_address(i) for i in range(3000)]
+		self.assertEqual(addresses[0], u"127.0.0.1")
+		self.assertEqual(addresses[254], u"127.0.1.1")
+		self.assertEqual(len(set(addresses)), 3000)
+		self.assertFalse([a for a in addresses if a.endswith('.0') or a.endswith('.255')])
+	
+	def test_config(self):
+		nodes, clusters = process_config(generate_config(120, 8080, 50))
+		self.assertEqual(len(nodes), 120)
+		self.assertEqual(sorted(len(c) for c in clusters.values()), [20, 50, 50])
+		node = nodes[u"node001"]
+		self.assertEqual((node.scheme, node.host, node.username, node.password), ('http', u"127.0.0.1:8080", u"admin", u"admin"))
@@ -0,0 +1,60 @@
+import unittest
+from six import BytesIO
+from halonctl.streaming import iter_records, Record, UnexpectedReply, MAIL_TYPES, STAT_TYPES
+
+ENVELOPE = b'<?xml version="1.0" encoding="UTF-8"?><SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ns1="urn:halon"><SOAP-ENV:Body>{0}</SOAP-ENV:Body></SOAP-ENV:Envelope>'
+
+def reply(body):
+	return BytesIO(ENVELOPE.replace(b'{0}', body))
+
+class TestIterRecords(unittest.TestCase):
+	def test_stat_list(self):
+		f = reply(b'<ns1:statListResponse><result>'
+			b'<item><key1>mail</key1><key2>a</key2><key3></key3><count>5</count><updated>1262439425</updated><created>1262439400</created></item>'
+			b'<item><key1>mail</key1><key2>b</key2><key3></key3><count>7</count><updated>1262439425</updated><created>1262439400</created></item>'
+			b'</result></ns1:statListResponse>')
+		records = list(iter_records(f, STAT_TYPES))
+		self.assertEqual(len(records), 2)
+		self.assertEqual(records[0].key2, 'a')
+		self.assertIsNone(records[0].key3)
+		self.assertEqual(records[1].count, 7)
+		self.assertEqual(sum(r.count for r in records), 12)
+	
+	def test_mail_queue(self):
+		f = reply(b'<ns1:mailQueueResponse><result><result>'
+			b'<item><id>1</id><msgfrom>a@halon.se</msgfrom><msgts0>1262439425</msgts0></item>'
+			b'</result><totalhits>1</totalhits></result></ns1:mailQueueResponse>')
+		records = list(iter_records(f, MAIL_TYPES))
+		self.assertEqual(records, [{'id': '1', 'msgfrom': 'a@halon.se', 'msgts0': 1262439425}])
+		self.assertEqual(getattr(records[0], 'msgfrom', None), 'a@halon.se')
+		self.assertIsNone(getattr(records[0], 'msgto', None))
+	
+	def test_nested_arrays(self):
+		f = reply(b'<ns1:configKeysResponse><result>'
+			b'<item><name>transport_flow</name><params><item>a</item><item>b</item></params></item>'
+			b'</result></ns1:configKeysResponse>')
+		self.assertEqual(list(iter_records(f)), [{'name': 'transport_flow', 'params': ['a', 'b']}])
+	
+	def test_empty(self):
+		f = reply(b'<ns1:statListResponse><result></result></ns1:statListResponse>')
+		self.assertEqual(list(iter_records(f, STAT_TYPES)), [])
+	
+	def test_incremental(self):
+		items = b''.join(b'<item><count>' + str(i).encode('ascii') + b'</count></item>' for i in range(10000))
+		records = iter_records(reply(b'<ns1:statListResponse><result>' + items + b'</result></ns1:statListResponse>'), STAT_TYPES)
+		self.assertEqual(next(records).count, 0)
+		self.assertEqual(next(records).count, 1)
+		self.assertEqual(sum(r.count for r in records), sum(range(2, 10000)))
+	
+	def test_unexpected(self):
+		f = reply(b'<ns1:statListResponse><result>Not an array</result></ns1:statListResponse>')
+		self.assertRaises(UnexpectedReply, list, iter_records(f, STAT_TYPES))
+		
+		f = reply(b'<ns1:mailQueueResponse><result><result></result><totalhits>0</totalhits></result></ns1:mailQueueResponse>')
+		self.assertEqual(list(iter_records(f, MAIL_TYPES)), [])
+
+class TestRecord(unittest.TestCase):
+	def test_attributes(self):
+		r = Record(a=1)
+		self.assertEqual(r.a, 1)
+		self.assertRaises(AttributeError, getattr, r, 'b')
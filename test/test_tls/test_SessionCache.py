@@ -0,0 +1,97 @@
+import os
+import sys
+import ssl
+import socket
+import subprocess
+import unittest
+import threading
+from halonctl.tls import SessionCache, is_supported
+from halonctl.config import config
+
+CERT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'fixtures', 'tls.pem'))
+
+class Server(object):
+	def __init__(self, version):
+		self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+		self.context.load_cert_chain(CERT_PATH)
+		self.context.minimum_version = self.context.maximum_version = version
+		self.listener = socket.socket()
+		self.listener.bind(('127.0.0.1', 0))
+		self.listener.listen(4)
+		self.port = self.listener.getsockname()[1]
+		self.thread = threading.Thread(target=self.serve)
+		self.thread.start()
+	
+	def serve(self):
+		while True:
+			sock, _ = self.listener.accept()
+			try:
+				conn = self.context.wrap_socket(sock, server_side=True)
+			except (ssl.SSLError, OSError):
+				sock.close()
+				continue
+			if conn.recv(16) == b'stop':
+				conn.close()
+				break
+			conn.sendall(b'ok')
+			conn.close()
+		self.listener.close()
+	
+	def stop(self):
+		self.request(ssl.create_default_context(cafile=CERT_PATH), b'stop')
+		self.thread.join()
+	
+	def request(self, context, data=b'hi'):
+		conn = context.wrap_socket(socket.create_connection(('127.0.0.1', self.port)), server_hostname='localhost')
+		conn.sendall(data)
+		conn.recv(16)
+		return conn
+
+@unittest.skipUnless(is_supported(), "TLS sessions are not supported")
+class TestSessionCache(unittest.TestCase):
+	def setUp(self):
+		self.cache = SessionCache()
+	
+	def tearDown(self):
+		config.pop('tls_session_reuse', None)
+	
+	def resume(self, version):
+		server = Server(version)
+		try:
+			context = self.cache.context(CERT_PATH)
+			conns = [server.request(context) for i in range(3)]
+			self.assertEqual([c.session_reused for c in conns], [False, True, True])
+		finally:
+			server.stop()
+		
+		stats = self.cache.stats['localhost']
+		self.assertEqual((stats.full, stats.resumed), (1, 2))
+	
+	def test_resume_tls12(self):
+		self.resume(ssl.TLSVersion.TLSv1_2)
+	
+	def test_resume_tls13(self):
+		self.resume(ssl.TLSVersion.TLSv1_3)
+	
+	def test_disabled(self):
+		config['tls_session_reuse'] = False
+		server = Server(ssl.TLSVersion.TLSv1_2)
+		try:
+			context = self.cache.context(CERT_PATH)
+			conns = [server.request(context) for i in range(2)]
+			self.assertEqual([c.session_reused for c in conns], [False, False])
+		finally:
+			server.stop()
+	
+	def test_shared_contexts(self):
+		self.assertIs(self.cache.context(True), self.cache.context(True))
+		self.assertIs(self.cache.context(False), self.cache.context(0))
+		self.assertIsNot(self.cache.context(True), self.cache.context(False))
+		self.assertEqual(self.cache.context(False).verify_mode, ssl.CERT_NONE)
+
+class TestUnsupported(unittest.TestCase):
+	def test_import(self):
+		# Like on Python 2.7 and 3.4, which have no SSLObject or SSLSession
+		script = u"import ssl; del ssl.SSLObject, ssl.SSLSession; from halonctl import pool, tls; print(tls.sessions.context(True))"
+		output = subprocess.check_output([sys.executable, '-c', script])
+		self.assertEqual(output.strip(), b'None')
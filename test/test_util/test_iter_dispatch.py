@@ -0,0 +1,32 @@
+import time
+import unittest
+from halonctl.util import iter_dispatch
+
+def sleep(t):
+	time.sleep(t)
+	return t
+
+class TestIterDispatch(unittest.TestCase):
+	def test_as_completed(self):
+		query = { 'slow': (sleep, [0.2]), 'fast': (sleep, [0.01]) }
+		self.assertEqual(list(iter_dispatch(query)), [('fast', 0.01), ('slow', 0.2)])
+	
+	def test_ordered(self):
+		query = { 'slow': (sleep, [0.2]), 'fast': (sleep, [0.01]) }
+		self.assertEqual(list(iter_dispatch(query, ['slow', 'fast'])), [('slow', 0.2), ('fast', 0.01)])
+	
+	def test_ordered_prefix(self):
+		query = { 'a': (sleep, [0.01]), 'b': (sleep, [0.5]) }
+		start = time.time()
+		results = iter_dispatch(query, ['a', 'b'])
+		self.assertEqual(next(results), ('a', 0.01))
+		self.assertLess(time.time() - start, 0.4)
+		self.assertEqual(next(results), ('b', 0.5))
+	
+	def test_dispatched_eagerly(self):
+		query = { 'a': (sleep, [0.2]), 'b': (sleep, [0.2]) }
+		start = time.time()
+		results = iter_dispatch(query, ['a', 'b'])
+		time.sleep(0.2)
+		list(results)
+		self.assertLess(time.time() - start, 0.35)
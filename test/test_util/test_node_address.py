@@ -0,0 +1,15 @@
+import unittest
+from halonctl.models import Node
+from halonctl.util import node_address
+
+class TestNodeAddress(unittest.TestCase):
+	def test_default_port(self):
+		self.assertEqual(node_address(Node("http://admin@0.0.0.1")), ('0.0.0.1', 80))
+		self.assertEqual(node_address(Node("https://admin@0.0.0.1")), ('0.0.0.1', 443))
+	
+	def test_port(self):
+		self.assertEqual(node_address(Node("http://admin@0.0.0.1:8080")), ('0.0.0.1', 8080))
+	
+	def test_ipv6(self):
+		self.assertEqual(node_address(Node("http://admin:password@[::1]")), ('::1', 80))
+		self.assertEqual(node_address(Node("http://admin:password@[::1]:18080")), ('::1', 18080))
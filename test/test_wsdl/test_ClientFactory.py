@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+from suds.wsdl import Definitions
+from halonctl.wsdl import ClientFactory, DIRNAME
+from halonctl.simulator import DEFAULT_WSDL as WSDL_PATH
+from halonctl import cache
+
+class TestClientFactory(unittest.TestCase):
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		os.environ['XDG_CACHE_HOME'] = self.tempdir
+		self.factory = ClientFactory()
+	
+	def tearDown(self):
+		del os.environ['XDG_CACHE_HOME']
+		cache.checked.clear()
+		shutil.rmtree(self.tempdir)
+	
+	def test_shared_wsdl(self):
+		a = self.factory.client("http://0.0.0.1/remote/", WSDL_PATH)
+		b = self.factory.client("http://0.0.0.2/remote/", WSDL_PATH)
+		self.assertIs(a.wsdl, b.wsdl)
+		self.assertIsNot(a.options, b.options)
+	
+	def test_location(self):
+		client = self.factory.client("http://0.0.0.1/remote/", WSDL_PATH)
+		context = client.service.getUptime()
+		self.assertEqual(context.client.location(), "http://0.0.0.1/remote/")
+		self.assertIn(b'getUptime', context.envelope)
+	
+	def test_pickled(self):
+		self.factory.client("http://0.0.0.1/remote/", WSDL_PATH)
+		self.assertTrue(os.listdir(cache.get_path(DIRNAME)))
+		
+		# A fresh factory shouldn't need to parse anything
+		parse = Definitions.__init__
+		def fail(*args, **kwargs):
+			self.fail("The WSDL was parsed again")
+		Definitions.__init__ = fail
+		try:
+			client = ClientFactory().client("http://0.0.0.2/remote/", WSDL_PATH)
+		finally:
+			Definitions.__init__ = parse
+		self.assertEqual(client.service.getUptime().client.location(), "http://0.0.0.2/remote/")
+	
+	@unittest.skipUnless(hasattr(os, 'geteuid') and os.geteuid() == 0, "needs to be able to chown")
+	def test_not_unpickled_from_others(self):
+		self.factory.client("http://0.0.0.1/remote/", WSDL_PATH)
+		path = cache.get_path(DIRNAME)
+		for name in os.listdir(path):
+			os.chown(os.path.join(path, name), os.getuid() + 1, -1)
+		
+		parsed = []
+		parse = Definitions.__init__
+		def count(*args, **kwargs):
+			parsed.append(True)
+			parse(*args, **kwargs)
+		Definitions.__init__ = count
+		try:
+			ClientFactory().client("http://0.0.0.2/remote/", WSDL_PATH)
+		finally:
+			Definitions.__init__ = parse
+		self.assertEqual(parsed, [True])
+	
+	def test_clear(self):
+		self.factory.client("http://0.0.0.1/remote/", WSDL_PATH)
+		self.factory.clear()
+		self.assertEqual(os.listdir(cache.get_path(DIRNAME)), [])
+		self.assertEqual(self.factory.bases, {})
@@ -0,0 +1,130 @@
+import os
+import shutil
+import threading
+import tempfile
+import unittest
+import requests
+from halonctl import wsdl
+from halonctl.wsdl import WsdlStore
+from halonctl.models import Node
+from halonctl.config import config
+
+class Response(object):
+	def __init__(self, status_code, content=b'', headers={}):
+		self.status_code = status_code
+		self.content = content
+		self.headers = headers
+		self.closed = False
+	
+	def iter_content(self, size):
+		for i in range(0, len(self.content), size):
+			yield self.content[i:i+size]
+	
+	def close(self):
+		self.closed = True
+
+class TestWsdlStore(unittest.TestCase):
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		os.environ['XDG_CACHE_HOME'] = self.tempdir
+		
+		self.store = WsdlStore()
+		self.nodes = [Node("10.0.0.{0}".format(i), "n{0}".format(i)) for i in range(3)]
+		self.served = { node.host: b'<wsdl version="1"/>' for node in self.nodes }
+		self.requests = []
+		
+		self.old_get, wsdl.requests.get = wsdl.requests.get, self.get
+	
+	def tearDown(self):
+		wsdl.requests.get = self.old_get
+		del os.environ['XDG_CACHE_HOME']
+		shutil.rmtree(self.tempdir)
+		config.clear()
+	
+	def get(self, url, headers={}, verify=True, stream=False, timeout=None):
+		host = url.split('/')[2]
+		self.requests.append((host, headers.get('If-None-Match')))
+		self.assertEqual(timeout, config.get('timeout', 10))
+		content = self.served.get(host)
+		if content is None:
+			raise requests.exceptions.ConnectionError()
+		etag = '"{0}"'.format(hash(content))
+		if headers.get('If-None-Match') == etag:
+			return Response(304)
+		return Response(200, content, { 'ETag': etag })
+	
+	def expire(self):
+		for entry in self.store.index['nodes'].values():
+			entry['checked'] -= wsdl.MAX_AGE + 1
+		wsdl.cache.set_entry(wsdl.WSDL_DIRNAME, wsdl.INDEX, wsdl.json.dumps(self.store.index).encode('utf-8'))
+	
+	def test_first_download(self):
+		self.assertTrue(self.store.refresh(self.nodes, True))
+		requests = len(self.requests)
+		paths = set(self.store.node_path(node) for node in self.nodes)
+		self.assertEqual(len(paths), 1)
+		with open(paths.pop(), 'rb') as f:
+			self.assertEqual(f.read(), b'<wsdl version="1"/>')
+		
+		# Nothing is requested again while it's fresh
+		self.assertTrue(self.store.refresh(self.nodes, True))
+		self.assertEqual(len(self.requests), requests)
+	
+	def test_revalidate(self):
+		self.store.refresh(self.nodes, True)
+		self.served['10.0.0.2'] = b'<wsdl version="2"/>'
+		self.expire()
+		self.requests = []
+		
+		self.assertTrue(self.store.refresh(self.nodes, True))
+		self.assertEqual(len(self.requests), 3)
+		self.assertTrue(all(etag for host, etag in self.requests))
+		self.assertEqual(self.store.node_path(self.nodes[0]), self.store.node_path(self.nodes[1]))
+		self.assertNotEqual(self.store.node_path(self.nodes[0]), self.store.node_path(self.nodes[2]))
+	
+	def test_unreachable(self):
+		self.served = {}
+		self.assertFalse(self.store.refresh(self.nodes, True))
+		self.assertIsNone(self.store.node_path(self.nodes[0]))
+	
+	def test_all_down(self):
+		self.assertFalse(self.store.refresh(self.nodes, True, self.nodes))
+		self.assertEqual(self.requests, [])
+		
+		self.assertTrue(self.store.refresh(self.nodes[:1], True))
+		self.assertTrue(self.store.refresh(self.nodes, True, self.nodes[1:]))
+		self.assertEqual(len(self.requests), 1)
+	
+	def test_keeps_stale_wsdl(self):
+		self.store.refresh(self.nodes, True)
+		path = self.store.node_path(self.nodes[0])
+		self.served = {}
+		self.expire()
+		self.assertTrue(self.store.refresh(self.nodes, True))
+		self.assertEqual(self.store.node_path(self.nodes[0]), path)
+	
+	def test_prune(self):
+		config['wsdl_versions'] = 2
+		self.store.refresh(self.nodes, True)
+		self.served = { node.host: '<wsdl version="{0}"/>'.format(i).encode('utf-8') for i, node in enumerate(self.nodes) }
+		self.expire()
+		self.store.refresh(self.nodes, True)
+		
+		files = [name for name in os.listdir(wsdl.cache.get_path(wsdl.WSDL_DIRNAME)) if name.endswith('.xml')]
+		self.assertEqual(len(files), 2)
+		self.assertTrue(all(self.store.node_path(node) for node in self.nodes))
+	
+	def test_fetch_first(self):
+		del self.served['10.0.0.0']
+		self.served['10.0.0.1'] = b'<wsdl version="1"/>' * 100000
+		self.assertTrue(self.store.fetch_first(self.nodes, True))
+		self.assertEqual(set(host for host, etag in self.requests), set(node.host for node in self.nodes))
+	
+	def test_fetch_cancelled(self):
+		cancel = threading.Event()
+		cancel.set()
+		self.assertIsNone(self.store.fetch(self.nodes[0], True, cancel=cancel))
+	
+	def test_timeout(self):
+		config['timeout'] = 3
+		self.assertTrue(self.store.refresh(self.nodes, True))